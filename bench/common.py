@@ -0,0 +1,145 @@
+"""
+Shared helpers for the benchmarks: timing statistics, JSON result files and
+synthetic data directories cubed with fake_degrib.py
+"""
+import json, os, platform, subprocess, sys, time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+fake_degrib = os.path.join(bench_dir, 'fake_degrib.py')
+fixtures_dir = os.path.join(bench_dir, 'fixtures')
+
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+
+# Params written to synthetic data directories, as in grib2.noaa_params
+params = ['maxt', 'mint', 'temp', 'pop12', 'qpf', 'snow', 'sky', 'wspd', 'wgust', 'wx', 'rhm']
+periods = ['VP.001-003', 'VP.004-007']
+
+def fixture(name):
+    """ Contents of a DWML fixture """
+    with open(os.path.join(fixtures_dir, name), 'rb') as f:
+        return f.read()
+
+def measure(function, repeat=50, warmup=3):
+    """
+    Time repeated calls of a function
+
+    returns - stats() of the call durations in seconds
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        samples.append(time.time() - start)
+    return stats(samples)
+
+def stats(samples):
+    """ Count, mean, min, max and percentiles of a list of durations in seconds """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'n': 0}
+    def percentile(p):
+        return ordered[min(int(round(p / 100.0 * (len(ordered) - 1))), len(ordered) - 1)]
+    return {
+        'n': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'min': ordered[0],
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': ordered[-1]
+    }
+
+def write_results(suite, results, output=None):
+    """
+    Write benchmark results as JSON, with what is needed to compare runs
+    between commits and machines
+
+    args:
+        suite - benchmark suite name
+        results - dictionary of results by benchmark name
+        output - path to write, or None for stdout
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+            stderr=open(os.devnull, 'w')).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    document = {
+        'suite': suite,
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': _cpu_count(),
+        'results': results
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+
+def make_bins(data_dir, size=1024, names=None):
+    """
+    Write placeholder .bin files for every param and period
+
+    args:
+        data_dir - directory to write VP.*/ds.*.bin files to
+        size - bytes per file
+        names - list of 'VP.*/ds.*.bin' paths, defaults to every param and
+            period
+    returns - list of paths written
+    """
+    paths = []
+    for name in names or ['{0}/ds.{1}.bin'.format(period, param) for period in periods for param in params]:
+        path = os.path.join(data_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+def make_data_dir(base_dir):
+    """
+    Create a served data directory like app.py maintains: base_dir/active
+    linking to a generation cubed with fake_degrib.py
+
+    returns - path of the active symlink
+    """
+    from pysky import grib2
+
+    generation_dir = os.path.join(base_dir, 'bench')
+    make_bins(generation_dir)
+    grib2._cube(grib2.Config(fake_degrib), generation_dir, generation_dir, set(params))
+    active = os.path.join(base_dir, 'active')
+    if os.path.lexists(active):
+        os.unlink(active)
+    os.symlink(generation_dir, active)
+    return active
+
+def load_app(data_dir, *args):
+    """
+    Import app.py as the server would run it, against a data directory and
+    fake_degrib.py
+
+    args:
+        data_dir - base data directory, see make_data_dir()
+        args - further app.py command line arguments
+    returns - the app module
+    """
+    sys.argv = ['app.py', '--data', data_dir, '--degrib', fake_degrib] + list(args)
+    sys.path.insert(0, os.path.join(repo_dir, 'src'))
+    import app
+    return app
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Compare two benchmark result files, printing the change in median time of
+every benchmark they share. Exits with status 1 if any benchmark got slower
+by more than the threshold.
+"""
+import argparse, json, sys
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files.')
+    parser.add_argument('baseline', help='JSON results of the baseline run')
+    parser.add_argument('current', help='JSON results of the run to check')
+    parser.add_argument('--metric', default='p50', help='Statistic to compare. Default is %(default)s')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed slowdown as a fraction. Default is %(default)s')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = 0
+    print '{0:<60} {1:>12} {2:>12} {3:>8}'.format('benchmark', baseline['commit'][:10] if baseline['commit'] else 'baseline',
+        current['commit'][:10] if current['commit'] else 'current', 'change')
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before = baseline['results'][name].get(args.metric)
+        after = current['results'][name].get(args.metric)
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or not before:
+            continue
+        change = after / before - 1
+        flag = ''
+        if change > args.threshold:
+            flag = ' !'
+            regressions += 1
+        print '{0:<60} {1:>12.6f} {2:>12.6f} {3:>+7.1%}{4}'.format(name, before, after, change, flag)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Stand-in for the degrib executable, for benchmarks
+
+Point probes (X.ind ... -DP -pnt ... -XML N) check that the cube indexes
+exist and replay a recorded DWML fixture from bench/fixtures: -XML 1 and 2
+replay BENCH_FIXTURE (default time-series-7day.xml), -XML 3 and 4 the 12 and
+24 hourly summaries.
+
+Each ds.{param}.bin file stands for a series of grids at the usual NDFD
+time steps for its VP.* period, starting at midnight UTC today. The
+inventory (X.bin -I) lists them, and converting one of them (X.bin -C -msg N
+-Flt -out Y.flt) writes it as an ESRI float raster, Y.flt and Y.hdr, with
+its metadata in Y.txt unless -nMet is given; without -Flt, only the metadata
+is written. With -namePath and -nameStyle instead of -out, and for -msg
+all, grids are written to the -namePath directory, named by -nameStyle with
+%e replaced by the element and %v by the valid time (YYYYMMDDHHMM). Cubing (... -Data -Index X.ind
+-out X.dat) only writes placeholder files, as degrib's cube layout is its
+own and only degrib reads it.
+
+Environment:
+    BENCH_DEGRIB_LATENCY - seconds to sleep before answering a probe
+    BENCH_CUBE_LATENCY - seconds to sleep per .bin file cubed
+    BENCH_FIXTURE - fixture replayed for -XML 1 and 2
+    BENCH_GRID - grid size as "nx,ny", default 200,100
+    BENCH_PROJECTION - projection described by the grid metadata: lambert
+        (default), mercator or polar
+"""
+import os, re, sys, time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+fixtures_dir = os.path.join(bench_dir, 'fixtures')
+
+# -XML argument -> fixture replayed
+xml_fixtures = {
+    '3': 'byday-12hourly.xml',
+    '4': 'byday-24hourly.xml'
+}
+
+# param -> (degrib element, unit, hours per step, base value)
+params = {
+    'maxt': ('MaxT', '[F]', 24, 60.0),
+    'mint': ('MinT', '[F]', 24, 35.0),
+    'temp': ('Temp', '[F]', 3, 50.0),
+    'td': ('Td', '[F]', 3, 40.0),
+    'apt': ('ApparentT', '[F]', 3, 48.0),
+    'pop12': ('PoP12', '[%]', 12, 30.0),
+    'qpf': ('QPF', '[inch]', 6, 0.1),
+    'snow': ('SnowAmt', '[inch]', 6, 0.0),
+    'sky': ('Sky', '[%]', 3, 50.0),
+    'wspd': ('WindSpd', '[kt]', 3, 8.0),
+    'wdir': ('WindDir', '[deg]', 3, 180.0),
+    'wgust': ('WindGust', '[kt]', 3, 15.0),
+    'wx': ('Wx', '[-]', 3, 0.0),
+    'rhm': ('RH', '[%]', 3, 60.0)
+}
+
+# Grid of the synthetic cube: (nx, ny) from BENCH_GRID, then lat1, lon1,
+# orientation longitude, latin1, latin2, dx (meters) and earth radius (km)
+grid = [int(v) for v in os.environ.get('BENCH_GRID', '200,100').split(',')] + \
+    [20.192, -121.554, -95.0, 25.0, 25.0, 2539.703, 6371.2]
+
+# Projection of the synthetic grid, from BENCH_PROJECTION, and its degrib
+# Projection Type
+projection = os.environ.get('BENCH_PROJECTION', 'lambert')
+projections = {
+    'lambert': '30 (Lambert Conformal)',
+    'mercator': '10 (Mercator)',
+    'polar': '20 (Polar Stereographic)'
+}
+
+# Elements valid over a period ending at their valid time
+period_elements = ('MaxT', 'MinT', 'PoP12', 'QPF', 'SnowAmt')
+
+def main(argv):
+    if '-Data' in argv:
+        time.sleep(float(os.environ.get('BENCH_CUBE_LATENCY', 0)) * len(argv[:argv.index('-Data')]))
+        return cube(argv[:argv.index('-Data')], argv[argv.index('-Index') + 1], argv[argv.index('-out') + 1])
+    if '-I' in argv:
+        return inventory(argv[0])
+    if '-C' in argv:
+        def option(name, default=None):
+            return argv[argv.index(name) + 1] if name in argv else default
+        metadata, raster = '-nMet' not in argv, '-Flt' in argv
+        if option('-msg') == 'all':
+            return convert_all(argv[0], option('-namePath', '.'), option('-nameStyle'), metadata, raster)
+        number = int(option('-msg'))
+        out = option('-out') or os.path.join(option('-namePath', '.'), output_name(argv[0], number, option('-nameStyle')))
+        return convert(argv[0], number, out, metadata, raster)
+
+    for path in argv[:argv.index('-DP')] if '-DP' in argv else []:
+        if not os.path.isfile(path):
+            sys.stderr.write('{0}: No such file\n'.format(path))
+            return 1
+    time.sleep(float(os.environ.get('BENCH_DEGRIB_LATENCY', 0)))
+    xml = argv[argv.index('-XML') + 1] if '-XML' in argv else '1'
+    name = xml_fixtures.get(xml, os.environ.get('BENCH_FIXTURE', 'time-series-7day.xml'))
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    with open(os.path.join(fixtures_dir, name), 'rb') as f:
+        while True:
+            chunk = f.read(8192)
+            if not chunk:
+                break
+            out.write(chunk)
+    out.flush()
+    return 0
+
+def messages(path):
+    """
+    Synthetic grids of a .bin file
+
+    returns - list of (element, unit, reference, start, end, base value)
+        tuples, times as UTC epoch seconds
+    """
+    if not os.path.isfile(path):
+        sys.stderr.write('{0}: No such file\n'.format(path))
+        sys.exit(1)
+    param = os.path.basename(path).split('.')[1]
+    element, unit, hours, base = params.get(param, (param, '[-]', 3, 0.0))
+    period = re.search(r'VP\.(\d+)-(\d+)', path)
+    first_day, last_day = (int(period.group(1)) - 1, int(period.group(2))) if period else (0, 3)
+    if hours < 6 and first_day >= 3:
+        hours = 6 # NDFD steps coarsen after day 3
+    today = int(time.time()) // 86400 * 86400
+    return [(element, unit, today, start, start + hours * 3600, base)
+        for start in range(today + first_day * 86400, today + last_day * 86400, hours * 3600)]
+
+def values(start, reference, base):
+    """ Rows of a synthetic grid, south to north """
+    nx, ny = grid[:2]
+    offset = base + (start - reference) // 3600 % 24 / 4.0
+    scale = (10.0 if base >= 1 else 1.0) / float(nx + ny)
+    return [[offset + (i + j) * scale for i in range(nx)] for j in range(ny)]
+
+def inventory(path):
+    """ Print the inventory of a .bin file, as degrib -I does """
+    lines = ['MsgNum, Byte, GRIB-Version, elem, level, reference(UTC), valid(UTC), Proj(hr)']
+    for n, (element, _, reference, start, end, _) in enumerate(messages(path)):
+        valid = end if element in period_elements else start
+        lines.append('{0}.0, {1}, 2, {2}, 0-SFC, {3}, {4}, {5:.2f}'.format(n + 1, n * 1000, element,
+            time.strftime('%m/%d/%Y %H:%M', time.gmtime(reference)),
+            time.strftime('%m/%d/%Y %H:%M', time.gmtime(valid)), (valid - reference) / 3600.0))
+    sys.stdout.write('\n'.join(lines) + '\n')
+    return 0
+
+def output_name(path, number, name_style):
+    """ Output file name of a grid, from a -nameStyle with %e and %v """
+    element, _, _, start, end, _ = messages(path)[number - 1]
+    valid = end if element in period_elements else start
+    return name_style.replace('%e', element).replace('%v', time.strftime('%Y%m%d%H%M', time.gmtime(valid)))
+
+def convert(path, number, out, metadata, raster=True):
+    """
+    Write one grid of a .bin file as an ESRI float raster, as degrib -C -Flt
+    does, with its metadata, or only the metadata without raster
+    """
+    import array
+
+    grids = messages(path)
+    if not 1 <= number <= len(grids):
+        sys.stderr.write('{0}: no message {1}\n'.format(path, number))
+        return 1
+    element, _, reference, start, _, base = grids[number - 1]
+    nx, ny, lat1, lon1, orient_lon, latin1, latin2, dx, radius = grid
+    base_path = os.path.splitext(out)[0]
+    if raster:
+        cells = array.array('f')
+        for row in reversed(values(start, reference, base)):
+            cells.extend(row)
+        if sys.byteorder != 'little':
+            cells.byteswap()
+        with open(base_path + '.flt', 'wb') as f:
+            f.write(cells.tostring() if hasattr(cells, 'tostring') else cells.tobytes())
+        with open(base_path + '.hdr', 'w') as f:
+            f.write('ncols {0}\nnrows {1}\nxllcorner 0\nyllcorner 0\ncellsize {2}\nNODATA_value 9999\n'
+                'byteorder LSBFIRST\n'.format(nx, ny, dx))
+    if metadata:
+        with open(base_path + '.txt', 'w') as f:
+            for field, value in gds():
+                f.write('GDS | {0} | {1}\n'.format(field, value))
+            f.write('PDS-S4 | Element | {0}\n'.format(element))
+    return 0
+
+def gds():
+    """ Grid definition lines of the metadata, as degrib -Met prints them """
+    nx, ny, lat1, lon1, orient_lon, latin1, latin2, dx, radius = grid
+    fields = [
+        ('Number of Points', nx * ny),
+        ('Projection Type', projections[projection]),
+        ('Shape of Earth', 'sphere'),
+        ('Radius', '{0:f} (km)'.format(radius)),
+        ('Nx (Number of points on parallel)', nx),
+        ('Ny (Number of points on meridian)', ny),
+        ('Lat1', '{0:f}'.format(lat1)),
+        ('Lon1', '{0:f}'.format(lon1 % 360.0))]
+    if projection == 'mercator':
+        # Rows and columns 0.025 degrees apart, near enough at this scale
+        fields += [
+            ('Lat2', '{0:f}'.format(lat1 + (ny - 1) * 0.025)),
+            ('Lon2', '{0:f}'.format((lon1 + (nx - 1) * 0.025) % 360.0)),
+            ('Dx', '{0:f} (m)'.format(dx)),
+            ('Dy', '{0:f} (m)'.format(dx)),
+            ('MeshLat', '{0:f}'.format(latin1))]
+    else:
+        fields += [
+            ('Dx', '{0:f} (m)'.format(dx)),
+            ('Dy', '{0:f} (m)'.format(dx)),
+            ('Orientation Lon', '{0:f}'.format(orient_lon % 360.0))]
+        if projection == 'polar':
+            fields += [('Lat_D', '{0:f}'.format(latin1))]
+        else:
+            fields += [('Latin 1', '{0:f}'.format(latin1)), ('Latin 2', '{0:f}'.format(latin2))]
+    return fields + [('Scan mode', 64)]
+
+def convert_all(path, name_path, name_style, metadata, raster):
+    """ Write every grid of a .bin file as an ESRI float raster, as degrib -C -msg all -Flt does """
+    for number in range(1, len(messages(path)) + 1):
+        status = convert(path, number, os.path.join(name_path, output_name(path, number, name_style)), metadata, raster)
+        if status:
+            return status
+    return 0
+
+def cube(bin_paths, index_path, data_path):
+    """ Write placeholders for degrib's cube of a list of .bin files """
+    count = sum(len(messages(path)) for path in bin_paths)
+    for path in (index_path, data_path):
+        with open(path, 'w') as f:
+            f.write('fake_degrib cube of {0} grids\n'.format(count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
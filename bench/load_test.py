@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+HTTP load test of app.py, run entirely locally
+
+Starts noaa_mirror.py and app.py (with fake_degrib.py as degrib), waits for
+the first refresh, then has concurrent clients replay a mix of point
+queries for a duration. Refreshes can be published and triggered during the
+run. Reports throughput, latency percentiles and error rates per route, and
+the lock and worker wait times app.py recorded on /metrics, as JSON, see
+common.write_results().
+"""
+import argparse, httplib, json, os, random, re, shutil, subprocess, sys, tempfile, threading, time
+
+import common
+from noaa_mirror import Mirror
+from pysky import cube
+
+# (weight, route label, function of a random.Random and a (lat, lon) point
+# returning a path)
+requests_mix = [
+    (40, '/ndfdXmlclient', lambda rng, point:
+        '/ndfdXmlclient?lat={0:.4f}&lon={1:.4f}'.format(*point)),
+    (20, '/ndfdXmlclient[elements]', lambda rng, point:
+        '/ndfdXmlclient?lat={0:.4f}&lon={1:.4f}&elements={2}'.format(point[0], point[1],
+            ','.join(rng.sample(['maxt', 'mint', 'temp', 'pop12', 'qpf', 'wspd', 'sky'], rng.randint(1, 3))))),
+    (10, '/ndfdXmlclient[glance]', lambda rng, point:
+        '/ndfdXmlclient?lat={0:.4f}&lon={1:.4f}&product=glance'.format(*point)),
+    (30, '/ndfdBrowserClientByDay', lambda rng, point:
+        '/ndfdBrowserClientByDay?lat={0:.4f}&lon={1:.4f}&format={2}'.format(point[0], point[1],
+            rng.choice(['12+hourly', '24+hourly'])))
+]
+
+def make_points(count, seed):
+    """
+    Points spread over the fake_degrib grid. Popularity follows a Zipf-like
+    curve, as a few locations get most of the traffic in practice.
+
+    returns - (points, cumulative weights)
+    """
+    nx, ny = [int(v) for v in os.environ.get('BENCH_GRID', '200,100').split(',')]
+    grid = cube.Grid(nx, ny, 20.192, -121.554, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+    rng = random.Random(seed)
+    cells = [(rng.randrange(nx), rng.randrange(ny)) for _ in range(count)]
+    latitudes, longitudes = grid.projection.inverse([i for i, j in cells], [j for i, j in cells])
+    points = zip(latitudes.tolist(), longitudes.tolist())
+    weights, total = [], 0.0
+    for n in range(count):
+        total += 1.0 / (n + 1)
+        weights.append(total)
+    return points, weights
+
+class Client(threading.Thread):
+    """ One client sending requests back to back over a keep-alive connection """
+
+    def __init__(self, port, points, weights, deadline, seed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.points = points
+        self.weights = weights
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.samples = [] # (route, seconds, status)
+
+    def run(self):
+        import bisect
+
+        total_weight = sum(weight for weight, _, _ in requests_mix)
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        while time.time() < self.deadline:
+            pick = self.rng.uniform(0, total_weight)
+            for weight, route, path in requests_mix:
+                pick -= weight
+                if pick <= 0:
+                    break
+            point = self.points[min(bisect.bisect(self.weights, self.rng.uniform(0, self.weights[-1])), len(self.points) - 1)]
+            url = path(self.rng, point)
+            start = time.time()
+            try:
+                connection.request('GET', url)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (httplib.HTTPException, IOError):
+                status = None
+                connection.close()
+                connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.samples.append((route, time.time() - start, status))
+        connection.close()
+
+def scrape(port):
+    """ Sums and counts of the wait stages on /metrics """
+    connection = httplib.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', '/metrics')
+    text = connection.getresponse().read()
+    connection.close()
+    waits = {}
+    for name, kind, label, value in re.findall(r'^(pysky_\w+?)_(sum|count)\{(?:stage|phase)="(\w+)"\} (\S+)$', text, re.M):
+        waits.setdefault('{0}:{1}'.format(name, label), {})[kind] = float(value)
+    return waits
+
+def wait_stats(before, after):
+    """ Mean and total wait per stage between two scrapes """
+    result = {}
+    for key, values in after.items():
+        if not key.endswith('wait'):
+            continue
+        old = before.get(key, {})
+        count = values.get('count', 0) - old.get('count', 0)
+        total = values.get('sum', 0) - old.get('sum', 0)
+        result[key] = {'count': count, 'seconds': total, 'mean': total / count if count else None}
+    return result
+
+def wait_for_refresh(port, timeout=300):
+    """ Trigger a refresh and wait until it has finished """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = httplib.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.request('POST', '/update_cache')
+            job = json.loads(connection.getresponse().read())
+            while job['state'] == 'running' and time.time() < deadline:
+                time.sleep(0.2)
+                connection.request('GET', '/update_cache/' + job['id'])
+                job = json.loads(connection.getresponse().read())
+            connection.close()
+            return job
+        except (httplib.HTTPException, IOError, ValueError):
+            time.sleep(0.2)
+    raise RuntimeError('app.py did not finish a refresh')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load tests app.py against a local mirror and fake degrib.')
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent clients. Default is %(default)s')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to send requests for. Default is %(default)s')
+    parser.add_argument('--points', type=int, default=2000, help='Distinct points requested. Default is %(default)s')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds fake_degrib takes per probe. Default is %(default)s')
+    parser.add_argument('--refresh-every', type=float, help='Seconds between refreshes published and triggered during the run. Default is none')
+    parser.add_argument('--refresh-files', type=int, default=3, help='Files changed per refresh. Default is %(default)s')
+    parser.add_argument('--port', type=int, default=5055, help='Port for app.py. Default is %(default)s')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the request mix. Default is %(default)s')
+    parser.add_argument('--output', help='File to write JSON results to, instead of stdout')
+    parser.add_argument('app_args', nargs=argparse.REMAINDER, help='Further app.py arguments, after --, e.g. -- --workers 8 --cache-size 0')
+    args = parser.parse_args()
+
+    mirror = Mirror().start()
+    base_dir = tempfile.mkdtemp(prefix='pysky-load-')
+    env = dict(os.environ, BENCH_DEGRIB_LATENCY=str(args.latency))
+    app_args = [a for a in args.app_args if a != '--']
+    server = subprocess.Popen([sys.executable, os.path.join(common.repo_dir, 'src', 'app.py'),
+        '--data', base_dir, '--degrib', common.fake_degrib, '--base-url', mirror.url,
+        '--port', str(args.port)] + app_args, env=env, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    try:
+        wait_for_refresh(args.port)
+        points, weights = make_points(args.points, args.seed)
+        before = scrape(args.port)
+
+        start = time.time()
+        deadline = start + args.duration
+        clients = [Client(args.port, points, weights, deadline, args.seed * 100000 + n) for n in range(args.clients)]
+        for client in clients:
+            client.start()
+
+        refreshes = []
+        if args.refresh_every:
+            while time.time() + args.refresh_every < deadline:
+                time.sleep(args.refresh_every)
+                mirror.update(args.refresh_files)
+                refresh_start = time.time()
+                job = wait_for_refresh(args.port)
+                refreshes.append({'seconds': time.time() - refresh_start, 'state': job['state'], 'updated': job['updated']})
+
+        for client in clients:
+            client.join()
+        elapsed = time.time() - start
+        after = scrape(args.port)
+    finally:
+        server.terminate()
+        server.wait()
+        mirror.stop()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    samples = [sample for client in clients for sample in client.samples]
+    results = {}
+    for route in sorted(set(route for route, _, _ in samples)) + [None]:
+        route_samples = [s for s in samples if route is None or s[0] == route]
+        summary = common.stats([seconds for _, seconds, status in route_samples if status == 200])
+        errors = len([1 for _, _, status in route_samples if status != 200])
+        summary['requests'] = len(route_samples)
+        summary['errors'] = errors
+        summary['error_rate'] = errors / float(len(route_samples)) if route_samples else 0.0
+        summary['throughput'] = len(route_samples) / elapsed
+        results[route or 'all'] = summary
+    results['waits'] = wait_stats(before, after)
+    results['refreshes'] = refreshes
+    results['config'] = {
+        'clients': args.clients,
+        'duration': elapsed,
+        'points': args.points,
+        'degrib_latency': args.latency,
+        'app_args': app_args
+    }
+    common.write_results('load', results, args.output)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Write the DWML fixtures replayed by fake_degrib.py to bench/fixtures
+
+The fixtures follow the layout of degrib -XML output for a point and are
+generated from a fixed seed, so rerunning this script reproduces them.
+"""
+import datetime, os, random
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# First valid time, local to the point (UTC-6)
+start = datetime.datetime(2012, 1, 1, 7)
+
+def time_series(days, seed=1):
+    """
+    DWML time series like degrib -XML 1, with every NDFD element used by
+    pysky.forecast at its usual time resolution
+    """
+    rng = random.Random(seed)
+    layouts = []
+    n3 = days * 8
+    layouts.append(_layout('k-p24h-n{0}-1'.format(days), 24, days, 12))
+    layouts.append(_layout('k-p24h-n{0}-2'.format(days), 24, days, 12, start + datetime.timedelta(hours=12)))
+    layouts.append(_layout('k-p12h-n{0}-3'.format(days * 2), 12, days * 2, 12))
+    layouts.append(_layout('k-p3h-n{0}-4'.format(n3), 3, n3))
+    layouts.append(_layout('k-p6h-n{0}-5'.format(days * 4), 6, days * 4, 6))
+
+    k24a, k24b = 'k-p24h-n{0}-1'.format(days), 'k-p24h-n{0}-2'.format(days)
+    k12, k3, k6 = 'k-p12h-n{0}-3'.format(days * 2), 'k-p3h-n{0}-4'.format(n3), 'k-p6h-n{0}-5'.format(days * 4)
+    parameters = [
+        _parameter('temperature', 'type="maximum" units="Fahrenheit"', k24a, 'Daily Maximum Temperature',
+            [rng.randint(40, 80) for _ in range(days)]),
+        _parameter('temperature', 'type="minimum" units="Fahrenheit"', k24b, 'Daily Minimum Temperature',
+            [rng.randint(20, 50) for _ in range(days)]),
+        _parameter('temperature', 'type="hourly" units="Fahrenheit"', k3, 'Temperature',
+            [rng.randint(20, 80) for _ in range(n3)]),
+        _parameter('temperature', 'type="dew point" units="Fahrenheit"', k3, 'Dew Point Temperature',
+            [rng.randint(20, 60) for _ in range(n3)]),
+        _parameter('precipitation', 'type="liquid" units="inches"', k6, 'Liquid Precipitation Amount',
+            ['%.2f' % rng.random() for _ in range(days * 4)]),
+        _parameter('precipitation', 'type="snow" units="inches"', k6, 'Snow Amount',
+            ['%.1f' % rng.random() for _ in range(days * 4)]),
+        _parameter('probability-of-precipitation', 'type="12 hour" units="percent"', k12,
+            '12 Hourly Probability of Precipitation', [rng.randint(0, 100) for _ in range(days * 2)]),
+        _parameter('wind-speed', 'type="sustained" units="knots"', k3, 'Wind Speed',
+            [rng.randint(0, 20) for _ in range(n3)]),
+        _parameter('wind-speed', 'type="gust" units="knots"', k3, 'Wind Speed Gust',
+            [rng.randint(5, 30) for _ in range(n3)]),
+        _parameter('cloud-amount', 'type="total" units="percent"', k3, 'Cloud Cover Amount',
+            [rng.randint(0, 100) for _ in range(n3)]),
+        _parameter('humidity', 'type="relative" units="percent"', k3, 'Relative Humidity',
+            [rng.randint(20, 100) for _ in range(n3)]),
+        _weather(k3, n3, rng),
+        _icons(k3, n3, rng)
+    ]
+    return _document(layouts, parameters)
+
+def by_day(days, hours, seed=2):
+    """
+    DWML summary like degrib -XML 3 (hours=12) or -XML 4 (hours=24)
+    """
+    rng = random.Random(seed)
+    periods = days * 24 // hours
+    key = 'k-p{0}h-n{1}-1'.format(hours, periods)
+    layouts = [
+        _layout('k-p24h-n{0}-2'.format(days), 24, days, 12),
+        _layout('k-p24h-n{0}-3'.format(days), 24, days, 12, start + datetime.timedelta(hours=12)),
+        _layout(key, hours, periods, hours)
+    ]
+    parameters = [
+        _parameter('temperature', 'type="maximum" units="Fahrenheit"', 'k-p24h-n{0}-2'.format(days),
+            'Daily Maximum Temperature', [rng.randint(40, 80) for _ in range(days)]),
+        _parameter('temperature', 'type="minimum" units="Fahrenheit"', 'k-p24h-n{0}-3'.format(days),
+            'Daily Minimum Temperature', [rng.randint(20, 50) for _ in range(days)]),
+        _parameter('probability-of-precipitation', 'type="12 hour" units="percent"', key,
+            '12 Hourly Probability of Precipitation', [rng.randint(0, 100) for _ in range(periods)]),
+        _weather(key, periods, rng),
+        _icons(key, periods, rng)
+    ]
+    return _document(layouts, parameters)
+
+def _layout(key, step, count, span=None, first=start):
+    lines = ['    <time-layout time-coordinate="local" summarization="none">',
+        '      <layout-key>{0}</layout-key>'.format(key)]
+    for n in range(count):
+        valid = first + datetime.timedelta(hours=step * n)
+        lines.append('      <start-valid-time>{0}-06:00</start-valid-time>'.format(valid.strftime('%Y-%m-%dT%H:%M:%S')))
+        if span:
+            valid += datetime.timedelta(hours=span)
+            lines.append('      <end-valid-time>{0}-06:00</end-valid-time>'.format(valid.strftime('%Y-%m-%dT%H:%M:%S')))
+    lines.append('    </time-layout>')
+    return '\n'.join(lines)
+
+def _parameter(tag, attributes, key, name, values):
+    lines = ['      <{0} {1} time-layout="{2}">'.format(tag, attributes, key),
+        '        <name>{0}</name>'.format(name)]
+    lines += ['        <value>{0}</value>'.format(value) for value in values]
+    lines.append('      </{0}>'.format(tag))
+    return '\n'.join(lines)
+
+def _weather(key, count, rng):
+    lines = ['      <weather time-layout="{0}">'.format(key),
+        '        <name>Weather Type, Coverage, and Intensity</name>']
+    for _ in range(count):
+        if rng.random() < 0.5:
+            lines.append('        <weather-conditions/>')
+        else:
+            lines.append('        <weather-conditions>')
+            lines.append('          <value coverage="{0}" intensity="light" weather-type="{1}" qualifier="none"/>'.format(
+                rng.choice(['chance', 'likely', 'slight chance']), rng.choice(['rain', 'snow', 'rain showers'])))
+            lines.append('        </weather-conditions>')
+    lines.append('      </weather>')
+    return '\n'.join(lines)
+
+def _icons(key, count, rng):
+    lines = ['      <conditions-icon type="forecast-NWS" time-layout="{0}">'.format(key),
+        '        <name>Conditions Icons</name>']
+    for _ in range(count):
+        lines.append('        <icon-link>http://www.nws.noaa.gov/weather/images/fcicons/{0}{1}.jpg</icon-link>'.format(
+            rng.choice(['sct', 'ra', 'nsct', 'bkn', 'sn']), rng.choice([10, 20, 30, 50])))
+    lines.append('      </conditions-icon>')
+    return '\n'.join(lines)
+
+def _document(layouts, parameters):
+    return '\n'.join([
+        '<?xml version="1.0"?>',
+        '<dwml version="1.0" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">',
+        '  <head>',
+        '    <product concise-name="time-series" operational-mode="official">',
+        '      <title>NOAA\'s National Weather Service Forecast Data</title>',
+        '    </product>',
+        '  </head>',
+        '  <data>',
+        '    <location>',
+        '      <location-key>point1</location-key>',
+        '      <point latitude="35.53" longitude="-90.53"/>',
+        '    </location>'] + layouts + [
+        '    <parameters applicable-location="point1">'] + parameters + [
+        '    </parameters>',
+        '  </data>',
+        '</dwml>',
+        ''])
+
+fixtures = {
+    'time-series-1day.xml': lambda: time_series(1),
+    'time-series-3day.xml': lambda: time_series(3),
+    'time-series-7day.xml': lambda: time_series(7),
+    'byday-12hourly.xml': lambda: by_day(7, 12),
+    'byday-24hourly.xml': lambda: by_day(7, 24)
+}
+
+if __name__ == '__main__':
+    if not os.path.exists(fixtures_dir):
+        os.makedirs(fixtures_dir)
+    for name, generate in sorted(fixtures.items()):
+        with open(os.path.join(fixtures_dir, name), 'w') as f:
+            f.write(generate())
+        print name
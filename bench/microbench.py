@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of DWML parsing, forecast aggregation and the point query
+routes, run against recorded fixtures and fake_degrib.py
+
+Writes JSON results, see common.write_results(). Compare two runs with
+compare.py.
+"""
+import argparse, os, shutil, sys, tempfile
+
+import common
+
+def parse_benchmarks(repeat):
+    from pysky import dwml, forecast
+
+    results = {}
+    for name in ['time-series-1day.xml', 'time-series-3day.xml', 'time-series-7day.xml']:
+        xml = common.fixture(name)
+        label = name[:-4]
+        xml_data = dwml.parse_xml(xml)
+        results['dwml.parse_xml[{0}]'.format(label)] = common.measure(lambda: dwml.parse_xml(xml), repeat)
+        results['forecast.process_xml[{0}]'.format(label)] = common.measure(
+            lambda: forecast.process_xml(xml), repeat)
+        results['forecast.process_xml[{0},hourly]'.format(label)] = common.measure(
+            lambda: forecast.process_xml(xml, True), repeat)
+        results['forecast._daily[{0}]'.format(label)] = common.measure(lambda: forecast._daily(xml_data), repeat)
+        results['forecast._hourly[{0}]'.format(label)] = common.measure(lambda: forecast._hourly(xml_data), repeat)
+    return results
+
+def route_benchmarks(repeat, workers, latency):
+    from pysky.degrib_pool import DegribPool
+
+    results = {}
+    base_dir = tempfile.mkdtemp(prefix='pysky-bench-')
+    os.environ['BENCH_DEGRIB_LATENCY'] = str(latency)
+    try:
+        common.make_data_dir(base_dir)
+        app = common.load_app(base_dir, '--cache-size', '0')
+        client = app.app.test_client()
+        routes = [
+            ('/ndfdXmlclient', '/ndfdXmlclient?lat=35.53&lon=-90.53'),
+            ('/ndfdXmlclient[elements]', '/ndfdXmlclient?lat=35.53&lon=-90.53&elements=maxt,mint'),
+            ('/ndfdBrowserClientByDay', '/ndfdBrowserClientByDay?lat=35.53&lon=-90.53&format=24%20hourly')
+        ]
+
+        def request(url):
+            response = client.get(url)
+            response.data
+            response.close()
+            if response.status_code != 200:
+                raise RuntimeError('{0} returned {1}'.format(url, response.status_code))
+
+        for pooled in (False, True):
+            app.grib2_config.pool = DegribPool(workers) if pooled else None
+            try:
+                for name, url in routes:
+                    label = 'route:{0}[{1}]'.format(name, 'pool' if pooled else 'spawn')
+                    results[label] = common.measure(lambda: request(url), repeat)
+            finally:
+                if app.grib2_config.pool:
+                    app.grib2_config.pool.close()
+                    app.grib2_config.pool = None
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the pysky microbenchmarks.')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls per benchmark. Default is %(default)s')
+    parser.add_argument('--workers', type=int, default=4, help='degrib workers for the pooled route benchmarks. Default is %(default)s')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds fake_degrib sleeps per probe. Default is %(default)s')
+    parser.add_argument('--skip-routes', action='store_true', help='Only benchmark parsing and aggregation')
+    parser.add_argument('--output', help='File to write JSON results to, instead of stdout')
+    args = parser.parse_args()
+
+    results = parse_benchmarks(args.repeat)
+    if not args.skip_routes:
+        results.update(route_benchmarks(args.repeat, args.workers, args.latency))
+    common.write_results('micro', results, args.output)
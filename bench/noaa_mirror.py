@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the NOAA NDFD server, for refresh benchmarks
+
+Serves a synthetic sector tree, VP.001-003 and VP.004-007 each holding an
+ls-l listing and ds.{param}.bin files, over keep-alive HTTP/1.1 with
+Last-Modified and If-Modified-Since like the real server. Latency can be
+added to every request and the transfer rate of every response capped.
+
+Files carry the mirror's own clock, which update() advances by a minute
+each time, because ls-l only shows timestamps to the minute.
+
+Run it standalone to point app.py at it, or use Mirror from benchmarks.
+"""
+import argparse, email.utils, os, random, shutil, socket, tempfile, threading, time
+import BaseHTTPServer, SocketServer
+
+import common
+
+class Mirror(object):
+    """ Synthetic NDFD tree served on a local port """
+
+    def __init__(self, root=None, file_size=256 * 1024, latency=0, bandwidth=None, port=0):
+        """
+        args:
+            root - directory to build the tree in, a temporary one if None
+            file_size - bytes per .bin file
+            latency - seconds added before every response
+            bandwidth - maximum bytes per second sent per response, or None
+            port - port to listen on, any free one if 0
+        """
+        self.root = root or tempfile.mkdtemp(prefix='pysky-mirror-')
+        self._temporary = root is None
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.clock = int(time.time()) // 60 * 60 - 3600 # Last-Modified of the current files
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+        self.paths = [os.path.relpath(path, self.root) for path in common.make_bins(self.root, file_size)]
+        for path in self.paths:
+            self._touch(path)
+        self._write_listings()
+
+        class Handler(_Handler):
+            mirror = self
+        self._server = _Server(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:{0}/'.format(self._server.server_address[1])
+        self._thread = None
+
+    def start(self):
+        """ Serve in a background thread """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and remove a temporary tree """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._temporary:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def update(self, count):
+        """
+        Publish new versions of some .bin files, as NOAA does every few
+        minutes, and rewrite the listings
+
+        args:
+            count - number of files to change, all of them if larger
+        returns - list of the changed paths, relative to the root
+        """
+        with self._lock:
+            self.clock += 60
+            changed = self._random.sample(self.paths, min(count, len(self.paths)))
+            for path in changed:
+                with open(os.path.join(self.root, path), 'wb') as f:
+                    f.write(os.urandom(self.file_size))
+                self._touch(path)
+            self._write_listings()
+        return changed
+
+    def _touch(self, path):
+        os.utime(os.path.join(self.root, path), (self.clock, self.clock))
+
+    def _write_listings(self):
+        for period in common.periods:
+            period_dir = os.path.join(self.root, period)
+            lines = []
+            for name in sorted(os.listdir(period_dir)):
+                if not name.endswith('.bin'):
+                    continue
+                stat = os.stat(os.path.join(period_dir, name))
+                lines.append('-rw-r--r--   1 ndfd     ndfd     {0:>9} {1} {2}'.format(stat.st_size,
+                    time.strftime('%b %d %H:%M', time.gmtime(stat.st_mtime)), name))
+            listing = os.path.join(period_dir, 'ls-l')
+            with open(listing, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.utime(listing, (self.clock, self.clock))
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mirror = None
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def _respond(self, send_body):
+        mirror = self.mirror
+        if mirror.latency:
+            time.sleep(mirror.latency)
+        with mirror._lock:
+            mirror.requests += 1
+            path = os.path.join(mirror.root, self.path.split('?')[0].lstrip('/'))
+            found = '..' not in self.path and os.path.isfile(path)
+            if found:
+                modified = int(os.stat(path).st_mtime)
+                with open(path, 'rb') as f:
+                    body = f.read()
+        if not found:
+            self._send(404, {}, b'')
+            return
+
+        since = self.headers.getheader('If-Modified-Since')
+        since = email.utils.parsedate_tz(since) if since else None
+        if since and modified <= email.utils.mktime_tz(since):
+            self._send(304, {'Last-Modified': email.utils.formatdate(modified, usegmt=True)}, b'')
+            return
+        self._send(200, {
+            'Content-Type': 'application/octet-stream',
+            'Last-Modified': email.utils.formatdate(modified, usegmt=True)
+        }, body if send_body else b'', len(body))
+
+    def _send(self, status, headers, body, length=None):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.end_headers()
+        bandwidth = self.mirror.bandwidth
+        chunk_size = 16384
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            began = time.time()
+            try:
+                self.wfile.write(chunk)
+            except socket.error:
+                return
+            if bandwidth:
+                time.sleep(max(len(chunk) / float(bandwidth) - (time.time() - began), 0))
+        with self.mirror._lock:
+            self.mirror.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a synthetic NDFD tree for offline refreshes.')
+    parser.add_argument('--root', help='Directory to build the tree in. Default is a temporary directory')
+    parser.add_argument('--port', type=int, default=8766, help='Port to listen on. Default is %(default)s')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Bytes per .bin file. Default is %(default)s')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every request. Default is %(default)s')
+    parser.add_argument('--bandwidth', type=int, help='Bytes per second sent per response. Default is unlimited')
+    parser.add_argument('--update-every', type=float, help='Seconds between scripted updates. Default is never')
+    parser.add_argument('--update-files', type=int, default=3, help='Files changed per update. Default is %(default)s')
+    args = parser.parse_args()
+
+    mirror = Mirror(args.root, args.file_size, args.latency, args.bandwidth, args.port).start()
+    print 'Serving {0} at {1}'.format(mirror.root, mirror.url)
+    try:
+        while True:
+            time.sleep(args.update_every or 3600)
+            if args.update_every:
+                print 'Updated {0}'.format(', '.join(mirror.update(args.update_files)))
+    except KeyboardInterrupt:
+        mirror.stop()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+End-to-end refresh benchmark: grib2.download against noaa_mirror.py, cubing
+with fake_degrib.py, and the swap to the new generation, as app.py runs it
+
+Scenarios run in order on one data directory: a full download into an empty
+directory, a check with nothing changed, then updates of a given number of
+files. Writes JSON results, see common.write_results().
+"""
+import argparse, os, random, shutil, string, tempfile, time
+
+import common
+from noaa_mirror import Mirror
+from pysky import grib2
+from pysky.generations import Generations
+
+def refresh(base_dir, generations, config, repeat_label, results):
+    """ Run one refresh like app.run_update and record its progress """
+    new_dir = os.path.join(base_dir, ''.join(random.choice(string.ascii_letters) for _ in range(10)))
+    progress = grib2.Progress()
+    start = time.time()
+    updated = grib2.download(generations.active_path, new_dir, progress, config=config)
+    if updated:
+        generations.swap(new_dir)
+    else:
+        shutil.rmtree(new_dir, ignore_errors=True)
+    seconds = time.time() - start
+    results.setdefault(repeat_label, []).append({
+        'seconds': seconds,
+        'updated': updated,
+        'bytes': progress['bytes'],
+        'files_checked': progress['files_checked'],
+        'files_changed': progress['files_changed'],
+        'timings': dict(progress['timings'])
+    })
+
+def summarize(runs):
+    """ Timing statistics of repeated runs of a scenario, with their counters """
+    summary = common.stats([run['seconds'] for run in runs])
+    for key in ('bytes', 'files_checked', 'files_changed'):
+        summary[key] = runs[-1][key]
+    phases = {}
+    for run in runs:
+        for phase, seconds in run['timings'].items():
+            phases.setdefault(phase, []).append(seconds)
+    summary['phases'] = dict((phase, sum(seconds) / len(seconds)) for phase, seconds in phases.items())
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times full and incremental cache refreshes against a local mirror.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per incremental scenario. Default is %(default)s')
+    parser.add_argument('--updates', default='1,5,22', help='Comma-separated numbers of files changed per incremental scenario. Default is %(default)s')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Bytes per .bin file. Default is %(default)s')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds the mirror adds to every request. Default is %(default)s')
+    parser.add_argument('--bandwidth', type=int, help='Bytes per second the mirror sends per response. Default is unlimited')
+    parser.add_argument('--download-threads', type=int, default=4, help='Concurrent downloads. Default is %(default)s')
+    parser.add_argument('--output', help='File to write JSON results to, instead of stdout')
+    args = parser.parse_args()
+
+    mirror = Mirror(file_size=args.file_size, latency=args.latency, bandwidth=args.bandwidth).start()
+    base_dir = tempfile.mkdtemp(prefix='pysky-refresh-')
+    grib2.base_url = mirror.url
+    grib2.noaa_params = 'ALL'
+    config = grib2.Config(common.fake_degrib, download_threads=args.download_threads)
+    generations = Generations(os.path.join(base_dir, 'active'))
+    runs = {}
+    try:
+        refresh(base_dir, generations, config, 'full', runs)
+        for _ in range(args.repeat):
+            refresh(base_dir, generations, config, 'unchanged', runs)
+        for count in [int(n) for n in args.updates.split(',')]:
+            for _ in range(args.repeat):
+                mirror.update(count)
+                refresh(base_dir, generations, config, 'update-{0}'.format(count), runs)
+    finally:
+        mirror.stop()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    results = dict((label, summarize(label_runs)) for label, label_runs in runs.items())
+    common.write_results('refresh', results, args.output)
@@ -3,37 +3,105 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)) + '/lib')
 
-from flask import Flask, abort, request
-from pysky import grib2
+from flask import Flask, Response, abort, request
+from pysky import cube, daily, forecast, grib2, metrics, prefork, projection
+from pysky.cache import ResponseCache
+from pysky.degrib_pool import DegribError, DegribPool
+from pysky.generations import generation
+from pysky.hotspots import Hotspots
+from pysky.sectors import Sector, Sectors
+from pysky.singleflight import SingleFlight
 import threading
-import argparse, random, re, shutil, string, sys
+from collections import OrderedDict
+import argparse, json, random, re, shutil, signal, string, sys, time
 
 parser = argparse.ArgumentParser(description='Runs an NDFD server.')
 parser.add_argument('--data', dest='data', required=True, help='Path to directory where local NDFD cache will be maintained.')
 parser.add_argument('--degrib', dest='degrib', default='/usr/local/bin/degrib', help='Location of degrib executable. Default is %(default)s')
 parser.add_argument('--geodata', dest='geodata', default='/usr/local/share/degrib/geodata', help='Location of degrib geodata directory. Default is %(default)s')
-parser.add_argument('--sector', dest='sector', default='conus', help='Sector to use. Default is %(default)s. Specify a smaller region to reduce disk usage and to reduce update processing time. See http://www.nws.noaa.gov/ndfd/anonymous_ftp.htm for a list of available sectors.')
+parser.add_argument('--sector', dest='sector', default='conus', help='Comma-separated sectors to use, each optionally followed by :SECONDS between its refreshes, e.g. conus,alaska:900,hawaii. Default is %(default)s. Specify a smaller region to reduce disk usage and to reduce update processing time. See http://www.nws.noaa.gov/ndfd/anonymous_ftp.htm for a list of available sectors. With several sectors, each is kept in its own directory under --data and points are served from the smallest sector covering them.')
+parser.add_argument('--base-url', dest='base_url', help='URL of the NDFD sector directory to download from, e.g. a mirror; {sector} is replaced by the sector name, as needed with several sectors. Default is the NOAA server directory of each sector')
+parser.add_argument('--port', dest='port', type=int, default=5000, help='Port to listen on. Default is %(default)s')
+parser.add_argument('--processes', dest='processes', type=int, default=1, help='Number of processes serving requests from a shared socket. With more than one, a master process runs the refreshes and the serving processes each have their own --workers, cache and metrics. Default is %(default)s')
+parser.add_argument('--worker', dest='worker', help=argparse.SUPPRESS) # file descriptors from the master, see prefork.connect()
+parser.add_argument('--workers', dest='workers', type=int, default=4, help='Number of degrib worker processes, and so of point queries run at once, per serving process. Default is %(default)s')
+parser.add_argument('--degrib-timeout', dest='degrib_timeout', type=float, default=30, help='Seconds allowed for a point query, including the wait for a free worker. Default is %(default)s')
+parser.add_argument('--download-threads', dest='download_threads', type=int, default=4, help='Number of NDFD files downloaded at once. Default is %(default)s')
+parser.add_argument('--cache-size', dest='cache_size', type=int, default=256, help='Megabytes of point query responses to cache, 0 to disable. Default is %(default)s')
+parser.add_argument('--prewarm', dest='prewarm', type=int, default=100, help='Number of the most requested point queries cached for new data before it is served, 0 to disable. Needs the cache. Default is %(default)s')
+parser.add_argument('--prewarm-workers', dest='prewarm_workers', type=int, default=2, help='Number of point queries run at once while prewarming. Default is %(default)s')
 
 args = parser.parse_args()
 
-grib2.degrib_path = args.degrib
-grib2.base_url = 'http://weather.noaa.gov/pub/SL.us008001/ST.opnl/DF.gr2/DC.ndfd/AR.{}/'.format(args.sector)
-grib2.geodata_path = args.geodata
-grib2.noaa_params = 'ALL'
+grib2_config = grib2.Config(args.degrib, args.geodata, args.download_threads,
+	flights=SingleFlight(), flight_timeout=args.degrib_timeout) # shared by every sector
 ndfd_grib_check_interval = 300
+generation_sweep_interval = 10
+control_timeout = 30
+prewarm_timeout = 300
 
-mutex = threading.Lock()
-downloading_mutex = threading.Lock()
+jobs = OrderedDict() # refresh jobs by id, oldest first
+jobs_lock = threading.Lock()
+max_jobs = 20
 download_base = args.data
-download_dir = download_base + '/active'
+projection.table_dirs = [os.path.join(os.path.dirname(os.path.abspath(args.geodata)), 'grids'), download_base + '/grids']
+
+sector_specs = [spec.strip().partition(':') for spec in args.sector.split(',')]
+if len(sector_specs) > 1 and args.base_url and '{sector}' not in args.base_url:
+	parser.error('--base-url needs {sector} with several sectors')
+sectors = Sectors(Sector(name,
+	download_base if len(sector_specs) == 1 else os.path.join(download_base, name),
+	args.base_url.format(sector=name) if args.base_url else None,
+	'ALL',
+	float(interval) if interval else ndfd_grib_check_interval,
+	shared=args.processes > 1,
+	config=grib2_config) for name, _, interval in sector_specs)
+master = None # prefork.Master, in the master process
+control = None # prefork.Channel to the master, in a serving process
+
+if args.cache_size > 0:
+	grib2_config.cache = ResponseCache(args.cache_size * 1024 * 1024)
+	for sector in sectors:
+		grib2_config.cache.invalidate(generation(sector.generations.current()), sector.name)
+		sector.generations.subscribe(lambda data_dir, sector=sector: grib2_config.cache.invalidate(generation(data_dir), sector.name))
+	if args.prewarm > 0:
+		grib2_config.hotspots = Hotspots(max(10 * args.prewarm, 1000))
 
 app = Flask(__name__)
+app.wsgi_app = metrics.track_requests(app.wsgi_app)
 
 
 
-def get_new_download_dir():
-	rnd = ''.join(random.choice(string.ascii_letters + string.digits) for i in range(10))
-	return download_base + '/' + rnd
+def generation_age():
+	"""
+	Seconds since the cube being served was built, or None without one. With
+	several sectors, a dictionary of them by sector.
+	"""
+	ages = {}
+	for sector in sectors:
+		try:
+			indexes = grib2.cube_indexes(sector.generations.current())
+			if indexes:
+				ages[sector.name] = time.time() - max(os.path.getmtime(path) for path in indexes)
+		except OSError:
+			pass
+	if len(sectors) > 1:
+		return ages
+	return ages.popitem()[1] if ages else None
+
+metrics.gauge('pysky_generation_age_seconds', 'Seconds since the cube being served was built', generation_age, combine='max')
+metrics.gauge('pysky_response_cache', 'Response cache entries, bytes and hit/miss/eviction counts',
+	lambda: grib2_config.cache.stats() if grib2_config.cache else None)
+metrics.gauge('pysky_coalescing', 'Point queries in flight, and leaders and followers of coalesced queries', grib2_config.flights.stats)
+
+
+
+def sector_for(lat, lon):
+	""" Sector serving a point, see Sectors.route() """
+	sector = sectors.route(lat, lon)
+	if sector is None:
+		raise ValueError('No sector covers {0},{1}'.format(lat, lon))
+	return sector
 
 
 
@@ -64,9 +132,10 @@ def ndfdXmlclient():
 
 		if len(elements) == 0:
 			elements = None
-		with mutex:
-			result = grib2.xml(download_dir, lat, lon, elements=elements, product=product, begin=begin, end=end)
-		return result
+		return streamed(sector_for(lat, lon), grib2.xml_stream, lat, lon, elements=elements, product=product, begin=begin, end=end)
+	except DegribError as e:
+		print "Point query failed: {0}".format(e)
+		abort(503)
 	except:
 		abort(400)
 
@@ -87,14 +156,243 @@ def ndfdBrowserClientByDay():
 				if valid_format(val.lower()):
 					format = val.lower()
 
-		with mutex:
-			result = grib2.xml_byday(download_dir, lat, lon, format=format)
-		return result
+		return streamed(sector_for(lat, lon), grib2.xml_byday_stream, lat, lon, format=format)
+	except DegribError as e:
+		print "Point query failed: {0}".format(e)
+		abort(503)
+	except:
+		abort(400)
+
+
+
+@app.route('/forecast/<lat>/<lon>')
+@app.route('/forecast/<lat>/<lon>/<elements>')
+def forecast_summary(lat, lon, elements=None):
+	"""
+	Daily (and, with ?hourly=1, hourly) forecast summary as JSON, optionally
+	limited to a comma-separated list of elements
+	"""
+	try:
+		lat = float(lat)
+		lon = float(lon)
+		if elements:
+			elements = [e for e in elements.lower().split(',') if valid_element(e)] or None
+		include_hourly = request.args.get('hourly', '').lower() in ('1', 'true', 'yes')
+
+		sector = sector_for(lat, lon)
+		with sector.generations.pin() as data_dir:
+			result = forecast.forecast_json(sector.config, data_dir, lat, lon, include_hourly, elements)
+		return Response(result, mimetype='application/json')
+	except DegribError as e:
+		print "Point query failed: {0}".format(e)
+		abort(503)
 	except:
 		abort(400)
 
 
 
+@app.route('/daily/<lat>/<lon>')
+def daily_summary(lat, lon):
+	"""
+	Daily forecast summary as JSON from the precomputed whole-grid arrays,
+	without weather and symbol. Until the current generation has been
+	summarized, the same fields are taken from the degrib-based forecast.
+	"""
+	try:
+		lat = float(lat)
+		lon = float(lon)
+		sector = sector_for(lat, lon)
+		with sector.generations.pin() as data_dir:
+			result = daily.lookup(data_dir, lat, lon) if sector.gridded else None
+			if result is None:
+				result = daily.from_forecast(json.loads(forecast.forecast_json(sector.config, data_dir, lat, lon))['daily'])
+		return Response(json.dumps(result), mimetype='application/json')
+	except DegribError as e:
+		print "Point query failed: {0}".format(e)
+		abort(503)
+	except:
+		abort(400)
+
+
+
+def streamed(sector, query, *args, **kwargs):
+	"""
+	Response forwarding the degrib output chunks of a grib2 streaming query
+	as they are produced. The query runs against a pinned generation of the
+	sector, which is released when the response is closed. The first chunk
+	is read up front so a failing query can still be answered with an error.
+	"""
+	generations = sector.generations
+	data_dir = generations.acquire()
+	try:
+		stream = query(sector.config, data_dir, *args, **kwargs)
+	except:
+		generations.release(data_dir)
+		raise
+	try:
+		first = next(stream, b'')
+	except:
+		stream.close()
+		generations.release(data_dir)
+		raise
+
+	def generate():
+		yield first
+		for chunk in stream:
+			yield chunk
+
+	def close():
+		stream.close()
+		generations.release(data_dir)
+
+	response = Response(generate())
+	response.call_on_close(close)
+	return response
+
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+	"""
+	Value time series for many points, read straight from the cube. Expects a
+	JSON body like {"points": [[lat, lon], ...], "elements": "maxt,temp",
+	"product": "time-series", "begin": ..., "end": ...} and streams back one
+	JSON object per line and point as points are resolved, grouped by sector.
+	Points of sectors the cube cannot be read for directly come back without
+	data.
+	"""
+	try:
+		body = request.get_json(force=True)
+		points = [(float(lat), float(lon)) for lat, lon in body['points']]
+		product = body.get('product', 'time-series').lower()
+		if not valid_product(product):
+			product = 'time-series'
+		begin = body.get('begin')
+		begin = begin.upper() if begin and valid_datetime(begin.upper()) else None
+		end = body.get('end')
+		end = end.upper() if end and valid_datetime(end.upper()) else None
+		elements = body.get('elements') or []
+		if not isinstance(elements, list):
+			elements = elements.split(',')
+		elements = [e for e in (e.lower() for e in elements) if valid_element(e)]
+	except:
+		abort(400)
+
+	groups = OrderedDict() # sector -> indices of its points
+	for n, (lat, lon) in enumerate(points):
+		sector = sectors.route(lat, lon)
+		groups.setdefault(sector if sector and sector.gridded else None, []).append(n)
+	pins = [(sector, sector.generations.acquire()) for sector in groups if sector]
+
+	def close():
+		for sector, data_dir in pins:
+			sector.generations.release(data_dir)
+
+	# Open the cubes before answering, so a cube that cannot be read is
+	# still reported with an error status
+	try:
+		results = [(groups[sector], grib2.batch(data_dir, [points[i] for i in groups[sector]], elements or None, product, begin, end))
+			for sector, data_dir in pins]
+	except (IOError, OSError, ValueError) as e:
+		print "Batch query failed: {0}".format(e)
+		close()
+		abort(503)
+
+	def generate():
+		for indices, result in results:
+			for n, lat, lon, cell, data in result:
+				yield line(indices[n], lat, lon, cell, data)
+		for n in groups.get(None, []):
+			yield line(n, points[n][0], points[n][1], None, None)
+
+	def line(n, lat, lon, cell, data):
+		return json.dumps({
+			'index': n,
+			'lat': lat,
+			'lon': lon,
+			'cell': cell,
+			'data': dict((element, [[iso_time(start), iso_time(end), value] for start, end, value in values])
+				for element, values in data.iteritems()) if data else None
+		}) + '\n'
+
+	response = Response(generate(), mimetype='application/x-ndjson')
+	response.call_on_close(close)
+	return response
+
+
+
+@app.route('/grid')
+def grid():
+	"""
+	Dense grids of the cells covering bbox=west,south,east,north for the
+	requested elements and valid times, read straight from the cube.
+	step=N keeps every Nth cell; format=npy returns a single NPY array with
+	the JSON header in the X-Grid-Header response header, otherwise the raw
+	format of grib2.subgrid is returned. The box is served from the sector
+	covering its centre.
+	"""
+	try:
+		west, south, east, north = [float(v) for v in request.args['bbox'].split(',')]
+		if south > north or west > east:
+			raise ValueError('Empty bbox')
+		elements = [e for e in request.args.get('elements', '').lower().split(',') if valid_element(e)]
+		begin = request.args.get('begin', '').upper()
+		begin = begin if valid_datetime(begin) else None
+		end = request.args.get('end', '').upper()
+		end = end if valid_datetime(end) else None
+		step = int(request.args.get('step', 1))
+		if step < 1:
+			raise ValueError('Invalid step')
+		format = request.args.get('format', 'raw').lower()
+		if format not in ('raw', 'npy'):
+			raise ValueError('Invalid format')
+	except:
+		abort(400)
+
+	sector = sectors.route((south + north) / 2, (west + east) / 2)
+	if sector is None or not sector.gridded:
+		abort(404)
+	generations = sector.generations
+	data_dir = generations.acquire()
+	try:
+		result = grib2.subgrid(data_dir, (south, west, north, east), elements or None, begin, end, step, format)
+	except (IOError, OSError, ValueError) as e:
+		generations.release(data_dir)
+		print "Grid query failed: {0}".format(e)
+		abort(503)
+	except:
+		generations.release(data_dir)
+		raise
+	if result is None:
+		generations.release(data_dir)
+		abort(404)
+	header, chunks, length = result
+
+	response = Response(chunks, mimetype='application/octet-stream')
+	response.headers['Content-Length'] = str(length)
+	if format == 'npy':
+		response.headers['X-Grid-Header'] = json.dumps(header)
+	response.call_on_close(lambda: generations.release(data_dir))
+	return response
+
+
+
+@app.route('/metrics')
+def metrics_text():
+	"""
+	Counters, gauges and latency histograms in the Prometheus text format,
+	of all processes combined
+	"""
+	text = control.call('metrics', None, control_timeout) if control else metrics.render()
+	return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+
+def iso_time(epoch):
+	return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+
 def valid_product(subject):
 	return subject == 'time-series' or subject == 'glance'
 
@@ -120,58 +418,278 @@ def valid_element(subject):
 
 
 
-@app.route('/update_cache')
+@app.route('/update_cache', methods=['GET', 'POST'])
 def update_cache():
-	new_download_dir = get_new_download_dir()
-	lock_acquired = downloading_mutex.acquire(False)
+	"""
+	Start refreshing the cache in the background, or join the refresh that is
+	already running, and return its status with 202 Accepted. With several
+	sectors, ?sector=NAME refreshes one of them; without it all of them are
+	refreshed and a list of their statuses is returned.
+	"""
+	name = request.args.get('sector')
+	if name is not None and sectors.get(name) is None:
+		abort(404)
+	status = control.call('start', name, control_timeout) if control else start_updates(name)
+	if isinstance(status, list):
+		return (json.dumps(status), 202, {'Content-Type': 'application/json'})
+	return (json.dumps(status), 202, {'Content-Type': 'application/json', 'Location': '/update_cache/' + status['id']})
+
+
+
+@app.route('/update_cache/<job_id>')
+def update_cache_status(job_id):
+	status = control.call('status', job_id, control_timeout) if control else find_job(job_id)
+	if status is None:
+		abort(404)
+	return (json.dumps(status), 200, {'Content-Type': 'application/json'})
+
+
+
+def find_job(job_id):
+	""" Status of a job by id, or None """
+	with jobs_lock:
+		job = jobs.get(job_id)
+	return job_status(job) if job else None
+
+
+
+def job_status(job):
+	""" Snapshot of a job for reporting while its thread updates it """
+	status = dict(job)
+	progress = dict(job['progress'])
+	progress['timings'] = dict(progress['timings'])
+	progress['files'] = progress['files'][:]
+	status['progress'] = progress
+	return status
+
+
+
+def start_updates(name=None):
+	"""
+	Start refreshing a sector by name, or the only sector
+
+	returns - the job's status, or with several sectors and no name, a list
+		of the statuses of jobs refreshing each of them
+	"""
+	if name is None and len(sectors) > 1:
+		return [job_status(start_update(sector)) for sector in sectors]
+	return job_status(start_update(sectors.get(name) if name else next(iter(sectors))))
+
+
+
+def start_update(sector):
+	"""
+	Start a refresh job for a sector unless one is already running
+
+	returns - the running job's status dictionary
+	"""
+	with jobs_lock:
+		for job in jobs.itervalues():
+			if job['state'] == 'running' and job['sector'] == sector.name:
+				return job
+		job = {
+			'id': ''.join(random.choice(string.ascii_letters + string.digits) for i in range(10)),
+			'sector': sector.name,
+			'state': 'running',
+			'started': time.time(),
+			'finished': None,
+			'updated': None,
+			'error': None,
+			'progress': grib2.Progress()
+		}
+		jobs[job['id']] = job
+		while len(jobs) > max_jobs:
+			jobs.popitem(last=False)
+
+	thread = threading.Thread(target=run_update, args=(job,))
+	thread.daemon = True
+	thread.start()
+	return job
+
+
+
+def run_update(job):
+	sector = sectors.get(job['sector'])
+	new_download_dir = sector.new_data_dir()
+	start = time.time()
+	with sector.mutex:
+		metrics.observe('pysky_refresh_phase_seconds', time.time() - start, phase='mutex_wait')
+		try:
+			job['updated'] = sector.download(new_download_dir, job['progress'])
+			if job['updated']:
+				prewarm(sector, new_download_dir, job['progress'])
+				sector.generations.swap(new_download_dir)
+		except Exception as e:
+			shutil.rmtree(new_download_dir, ignore_errors=True)
+			job['error'] = str(e)
+			job['state'] = 'failed'
+
+	if job['state'] != 'failed':
+		try:
+			summarize(sector, job['progress'])
+		except Exception as e:
+			# The new data is served regardless, with daily lookups falling
+			# back to degrib
+			job['error'] = "Daily summaries failed: {0}".format(e)
+			metrics.inc('pysky_daily_errors_total')
+			print "NDFD daily summaries of {0} failed: {1}".format(sector.name, e)
+		job['state'] = 'done'
+	job['finished'] = time.time()
+
+	metrics.inc('pysky_refreshes_total', outcome='failed' if job['state'] == 'failed' else 'updated' if job['updated'] else 'unchanged')
+	if job['state'] == 'failed':
+		print "NDFD grib update of {0} failed: {1}".format(sector.name, job['error'])
+	elif job['updated']:
+		print "NDFD grib update of {0} completed. New files downloaded.".format(sector.name)
+	else:
+		print "NDFD grib update of {0} completed. No new files.".format(sector.name)
+
+
+
+def prewarm(sector, data_dir, progress):
+	"""
+	Cache the responses to the most requested point queries of a sector from
+	a new generation before swapping to it, so they do not all miss at once
+	when it goes live
+	"""
+	if sector.config.hotspots is None or not grib2.cube_indexes(data_dir):
+		return
+	progress.phase('prewarming')
+	if master:
+		# Each serving process caches its own most requested queries
+		count = sum(n or 0 for n in master.broadcast('prewarm', {'sector': sector.name, 'dir': data_dir}, prewarm_timeout))
+	else:
+		count = prewarm_sector(sector, data_dir)
+	progress.phase('done')
+	print "Prewarmed {0} point queries of {1}.".format(count, sector.name)
 
-	if not lock_acquired:
-		print "Service Unavailable"
-		abort(503) # Service Unavailable
 
-	try:
-		new_files = grib2.download(download_dir, new_download_dir)
-		if new_files:
-			old_download_dir = os.path.realpath(download_dir)
-			with mutex:
-				if os.path.exists(download_dir) and os.path.islink(download_dir):
-					os.unlink(download_dir)
-				elif os.path.exists(download_dir) and os.path.isdir(download_dir):
-					shutil.rmtree(download_dir)
-				os.symlink(new_download_dir, download_dir)
-			if os.path.exists(old_download_dir) and not os.path.islink(old_download_dir):
-				shutil.rmtree(old_download_dir)
-
-		downloading_mutex.release()
-	except:
-		downloading_mutex.release()
-		abort(500)
 
-	if new_files:
-		return ('Success - new files downloaded.', 200)
-	else:
-		return ('Success - no update needed.', 304)
+def prewarm_sector(sector, data_dir):
+	""" Run the most requested point queries of a sector in this process """
+	where = None if len(sectors) == 1 else lambda lat, lon: sectors.route(lat, lon) is sector
+	return grib2.prewarm(sector.config, data_dir, args.prewarm, args.prewarm_workers, sector.name, where)
 
 
 
-def update_cache_timer():
-	try:
-		print "Automated NDFD grib update begin."
-		msg, code = update_cache()
-		sys.stdout.write("Automated NDFD grib update completed. ")
-		if code == 200:
-			print "New files downloaded."
-		else:
-			print "No new files."
-	except:
-		print "Automated NDFD grib update failed."
+def summarize(sector, progress):
+	"""
+	Precompute the daily summaries of a sector's current generation unless
+	they have been built already. Runs after the swap, so the new data is
+	served meanwhile and daily lookups fall back to degrib until it
+	completes.
+
+	raises - the error of daily.build()
+	"""
+	if not sector.gridded:
+		return
+	with sector.generations.pin() as data_dir:
+		if not os.path.exists(os.path.join(data_dir, cube.index_name)) or daily.ready(data_dir):
+			return
+		progress.phase('summarizing')
+		try:
+			daily.build(data_dir)
+		finally:
+			progress.phase('done')
+
+
 
-	update_timer = threading.Timer(ndfd_grib_check_interval, update_cache_timer)
+def update_cache_timer(sector):
+	print "Automated NDFD grib update of {0} begin.".format(sector.name)
+	start_update(sector)
+
+	update_timer = threading.Timer(sector.interval, update_cache_timer, args=(sector,))
 	update_timer.daemon = True
 	update_timer.start()
 
 
 
+def update_cache_timers():
+	for sector in sectors:
+		update_cache_timer(sector)
+
+
+
+def sweep_timer():
+	for sector in sectors:
+		sector.generations.sweep()
+
+	sweep_timer_thread = threading.Timer(generation_sweep_interval, sweep_timer)
+	sweep_timer_thread.daemon = True
+	sweep_timer_thread.start()
+
+
+
+def master_call(op, arg):
+	""" Calls from serving processes to the master """
+	if op == 'start':
+		return start_updates(arg)
+	elif op == 'status':
+		return find_job(arg)
+	elif op == 'metrics':
+		snapshots = master.broadcast('snapshot', None, control_timeout)
+		return metrics.render([metrics.snapshot()] + [s for s in snapshots if s])
+	raise ValueError('Unknown call {0}'.format(op))
+
+
+
+def worker_call(op, arg):
+	""" Calls from the master to a serving process """
+	if op == 'swap':
+		sectors.get(arg['sector']).generations.notify(arg['dir'])
+	elif op == 'prewarm':
+		return prewarm_sector(sectors.get(arg['sector']), arg['dir'])
+	elif op == 'snapshot':
+		return metrics.snapshot()
+	else:
+		raise ValueError('Unknown call {0}'.format(op))
+
+
+
+def serve_master():
+	"""
+	Start --processes serving processes on a shared socket, then run the
+	refreshes for all of them. Swaps are made here and announced to the
+	serving processes, which find the new generation through the symlink.
+	"""
+	global master
+	master = prefork.Master(args.processes,
+		[sys.executable, os.path.realpath(__file__)] + sys.argv[1:] + ['--worker'], master_call)
+	for sector in sectors:
+		if os.path.isdir(sector.generations.current()):
+			sector.generations.prepare(sector.generations.current())
+	master.listen('0.0.0.0', args.port).start()
+	for sector in sectors:
+		sector.generations.subscribe(lambda data_dir, sector=sector:
+			master.broadcast('swap', {'sector': sector.name, 'dir': data_dir}, control_timeout))
+	update_cache_timers()
+	sweep_timer()
+	master.run()
+
+
+
+def serve_worker():
+	""" Serve requests from the master's socket until terminated """
+	global control
+	from werkzeug.serving import make_server
+
+	listener, control = prefork.connect(args.worker, worker_call)
+	grib2_config.pool = DegribPool(args.workers, args.degrib_timeout)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	server = make_server('0.0.0.0', args.port, app, threaded=True, fd=listener)
+	try:
+		server.serve_forever()
+	finally:
+		grib2_config.pool.close()
+
+
+
 if __name__ == '__main__':
-	update_cache_timer()
-	app.run(host='0.0.0.0', threaded=True)
+	if args.worker:
+		serve_worker()
+	elif args.processes > 1:
+		serve_master()
+	else:
+		grib2_config.pool = DegribPool(args.workers, args.degrib_timeout)
+		update_cache_timers()
+		app.run(host='0.0.0.0', port=args.port, threaded=True)
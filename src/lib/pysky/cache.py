@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+class ResponseCache(object):
+    """
+    Thread-safe LRU cache of degrib responses, bounded by total size in bytes
+
+    Keys start with the cube generation the response was computed from, so a
+    whole generation can be dropped with invalidate() once it is swapped out.
+    Once generations are being served, only their responses are added, and
+    those of a new generation being prewarmed, see allow(). Several
+    generations are served at once when the server has several sectors,
+    one per group.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        args:
+            max_bytes - total size of cached values before the least recently
+                used entries are evicted
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._served = {} # group -> generation being served, once known
+        self._allowed = {} # group -> generation about to be served
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Cached value for a key, or None """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value # most recently used last
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Cache a value, evicting least recently used entries as needed """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._served and key[0] not in self._served.values() and key[0] not in self._allowed.values():
+                return # computed from a generation that has been swapped out
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def allow(self, generation, group=None):
+        """
+        Accept responses of a generation that is not served yet, so they can
+        be cached ahead of the swap to it. invalidate() to that generation
+        keeps them; the next invalidate() of the group stops accepting it
+        either way.
+        """
+        with self._lock:
+            self._allowed[group] = generation
+
+    def invalidate(self, generation=None, group=None):
+        """
+        Drop cached entries
+
+        args:
+            generation - generation now served for the group: keep entries
+                of it and of the other groups' generations and drop the
+                rest, or None to drop everything
+            group - name of the generations this one replaces, e.g. a sector
+        """
+        with self._lock:
+            if generation is None:
+                self._served.clear()
+                self._allowed.clear()
+            else:
+                self._served[group] = generation
+                self._allowed.pop(group, None)
+            served = set(self._served.values())
+            for key in list(self._entries):
+                if key[0] not in served:
+                    self._bytes -= len(self._entries.pop(key))
+
+    def stats(self):
+        """ Dictionary of entry count, size and hit/miss/eviction counters """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,674 @@
+"""
+In-process reader for the grids of a cube generation
+
+degrib probes its own data cubes (cubes/{param}.ind and .dat, written by
+degrib -Data), whose layout is private to degrib. The in-process reader
+reads a sidecar built from degrib's documented output instead: convert() lists the
+messages of .bin files with degrib -I, has degrib write each file out as
+ESRI float rasters (-C -msg all -Flt) and appends the rasters to a data file
+described by an index in the layout below. Indexes are built per param and unioned
+into rasters.idx, next to degrib's cubes, by merge_indexes().
+
+The index is read once and the data files are memory-mapped, so probing a
+grid cell is a handful of struct unpacks against the page cache instead of a
+degrib process per request. Mapped cubes are shared by all threads.
+
+Sidecar index layout (little-endian):
+    header      4s magic PSKY, uint16 version, uint16 number of data files
+    data files  uint16 length + path, relative to the index directory
+    grid        int32 nx, int32 ny, float64 lat1, lon1, orient_lon,
+                latin1, latin2, dx (meters), earth radius (meters)
+    records     uint32 count, then per record: 16s element, 16s unit,
+                int64 reference, valid start and valid end time (UTC epoch
+                seconds), uint16 data file, 6 pad bytes, uint64 offset
+
+Each record's grid is nx * ny float32 values, row-major from the south-west
+corner (lat1, lon1), starting at offset in its data file.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from pysky import projection
+
+_MAGIC = b'PSKY'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHH')
+_NAME_LENGTH = struct.Struct('<H')
+_GRID = struct.Struct('<iiddddddd')
+_COUNT = struct.Struct('<I')
+_RECORD = struct.Struct('<16s16sqqqH6xQ')
+_VALUE = struct.Struct('<f')
+
+# Sidecar index of a generation, next to degrib's cubes, and the directory
+# of its per-param segments
+index_name = 'rasters.idx'
+segments_name = 'rasters'
+
+# degrib marks cells without data with this value
+MISSING = 9999.0
+
+# NDFD element codes used by the REST interface -> degrib element names
+elements = {
+    'maxt': 'MaxT',
+    'mint': 'MinT',
+    'temp': 'Temp',
+    'td': 'Td',
+    'appt': 'ApparentT',
+    'pop12': 'PoP12',
+    'qpf': 'QPF',
+    'snow': 'SnowAmt',
+    'sky': 'Sky',
+    'wspd': 'WindSpd',
+    'wdir': 'WindDir',
+    'wgust': 'WindGust',
+    'wx': 'Wx',
+    'rhm': 'RH'
+}
+
+# Units of degrib elements converted with -Unit e
+units = {
+    'MaxT': '[F]',
+    'MinT': '[F]',
+    'Temp': '[F]',
+    'Td': '[F]',
+    'ApparentT': '[F]',
+    'PoP12': '[%]',
+    'QPF': '[inch]',
+    'SnowAmt': '[inch]',
+    'Sky': '[%]',
+    'WindSpd': '[kt]',
+    'WindDir': '[deg]',
+    'WindGust': '[kt]',
+    'RH': '[%]'
+}
+
+# Hours covered by degrib elements that are valid over a period ending at
+# their valid time; other elements are valid from their valid time until
+# the next one
+periods = {
+    'MaxT': 12,
+    'MinT': 12,
+    'PoP12': 12,
+    'QPF': 6,
+    'SnowAmt': 6
+}
+
+_cubes = OrderedDict()
+_cubes_lock = threading.Lock()
+_max_open_cubes = 4
+
+class Record(object):
+    """ One grid in the cube """
+
+    __slots__ = ('element', 'unit', 'reference', 'start', 'end', 'file', 'offset')
+
+    def __init__(self, element, unit, reference, start, end, file, offset):
+        self.element = element
+        self.unit = unit
+        self.reference = reference
+        self.start = start
+        self.end = end
+        self.file = file
+        self.offset = offset
+
+class Grid(object):
+    """ Lambert conformal grid definition of the cube """
+
+    def __init__(self, nx, ny, lat1, lon1, orient_lon, latin1, latin2, dx, radius):
+        self.nx = nx
+        self.ny = ny
+        self.lat1 = lat1
+        self.lon1 = lon1
+        self.orient_lon = orient_lon
+        self.latin1 = latin1
+        self.latin2 = latin2
+        self.dx = dx
+        self.radius = radius
+        self.projection = projection.LambertConformal(lat1, lon1, orient_lon, latin1, latin2, dx, radius)
+
+    def cell(self, latitude, longitude):
+        """
+        Grid cell nearest to a point
+
+        returns - (i, j) tuple, or None if the point is outside the grid
+        """
+        i, j = projection.snap(*self.projection.point(latitude, longitude))
+        if 0 <= i < self.nx and 0 <= j < self.ny:
+            return i, j
+        return None
+
+    def cells(self, latitudes, longitudes):
+        """
+        Grid cells nearest to arrays of points
+
+        returns - (i, j, inside) tuple of arrays, where inside is False for
+            points outside the grid
+        """
+        i, j = projection.snap(*self.projection.forward(latitudes, longitudes))
+        inside = (i >= 0) & (i < self.nx) & (j >= 0) & (j < self.ny)
+        return i, j, inside
+
+    def window(self, south, west, north, east):
+        """
+        Smallest block of cells covering a latitude/longitude box. Grid rows
+        and columns are curved in latitude/longitude, so points along every
+        edge of the box are projected, not just its corners.
+
+        returns - (i0, j0, i1, j1) inclusive cell bounds, or None if the box
+            does not overlap the grid
+        """
+        import numpy as np
+
+        edge = np.linspace(0.0, 1.0, 33)
+        latitudes = south + (north - south) * edge
+        longitudes = west + (east - west) * edge
+        x, y = self.projection.forward(
+            np.concatenate([latitudes, latitudes, np.full_like(edge, south), np.full_like(edge, north)]),
+            np.concatenate([np.full_like(edge, west), np.full_like(edge, east), longitudes, longitudes]))
+        i0 = max(projection.snap(x.min(), 0)[0], 0)
+        i1 = min(projection.snap(x.max(), 0)[0], self.nx - 1)
+        j0 = max(projection.snap(0, y.min())[1], 0)
+        j1 = min(projection.snap(0, y.max())[1], self.ny - 1)
+        if i0 > i1 or j0 > j1:
+            return None
+        return i0, j0, i1, j1
+
+    def coordinates(self):
+        """
+        Latitude and longitude of every cell centre, see
+        projection.coordinates()
+
+        returns - (latitudes, longitudes) tuple of arrays shaped (ny, nx)
+        """
+        return projection.coordinates(self)
+
+    def definition(self):
+        """ Tuple of the values the grid was constructed with """
+        return (self.nx, self.ny, self.lat1, self.lon1, self.orient_lon,
+            self.latin1, self.latin2, self.dx, self.radius)
+
+class Cube(object):
+    """ Memory-mapped view of a cube index and its data files """
+
+    def __init__(self, index_path):
+        """
+        args:
+            index_path - path of the sidecar index, usually
+                {data_dir}/rasters.idx
+        """
+        self.index_path = index_path
+        with open(index_path, 'rb') as f:
+            index = f.read()
+        self.files, self.grid, self.records = _parse_index(index)
+        base_dir = os.path.dirname(os.path.abspath(index_path))
+        self._maps = []
+        for name in self.files:
+            with open(os.path.join(base_dir, name), 'rb') as f:
+                self._maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        size = 4 * self.grid.nx * self.grid.ny
+        for record in self.records:
+            if record.file >= len(self._maps) or record.offset + size > len(self._maps[record.file]):
+                raise ValueError('Data of {0} is missing from {1}'.format(record.element, index_path))
+
+    def cell(self, latitude, longitude):
+        """ Grid cell (i, j) nearest to a point, or None if outside the grid """
+        return self.grid.cell(latitude, longitude)
+
+    def value(self, record, i, j):
+        """
+        Value of a record at a grid cell
+
+        returns - float, or None if the cell has no data
+        """
+        offset = record.offset + 4 * (j * self.grid.nx + i)
+        value = _VALUE.unpack_from(self._maps[record.file], offset)[0]
+        return None if value == MISSING else value
+
+    def grid_values(self, record):
+        """
+        Whole grid of a record as a NumPy array view of the mapped data, with
+        shape (ny, nx) and rows running south to north. Cells without data
+        hold MISSING.
+        """
+        import numpy as np
+
+        return np.frombuffer(self._maps[record.file], dtype='<f4',
+            count=self.grid.nx * self.grid.ny, offset=record.offset).reshape(self.grid.ny, self.grid.nx)
+
+    def select(self, element_codes=None, begin=None, end=None):
+        """
+        Records for a list of NDFD element codes (see ``elements``), in time
+        order
+
+        args:
+            element_codes - list of NDFD element codes, or None for all
+            begin - only records valid after this UTC epoch time, or None
+            end - only records valid before this UTC epoch time, or None
+        """
+        records = self.records
+        if element_codes:
+            names = set(elements.get(code, code) for code in element_codes)
+            records = [r for r in records if r.element in names]
+        if begin is not None:
+            records = [r for r in records if r.end > begin]
+        if end is not None:
+            records = [r for r in records if r.start < end]
+        return sorted(records, key=lambda r: (r.start, r.end))
+
+    def series(self, i, j, element_codes=None, begin=None, end=None):
+        """
+        Value time series for a grid cell
+
+        args:
+            i, j - grid cell, see cell()
+            element_codes, begin, end - record selection, see select()
+        returns - dictionary keyed by degrib element name, each a list of
+            (valid start, valid end, value) tuples in time order
+        """
+        return self.cells_series([(i, j)], element_codes, begin, end)[0]
+
+    def cells_series(self, cells, element_codes=None, begin=None, end=None):
+        """
+        Value time series for many grid cells, in a single pass over the
+        selected records
+
+        args:
+            cells - list of (i, j) grid cells
+            element_codes, begin, end - record selection, see select()
+        returns - list with a series() dictionary per cell
+        """
+        nx = self.grid.nx
+        offsets = [4 * (j * nx + i) for i, j in cells]
+        data = [{} for _ in cells]
+        unpack = _VALUE.unpack_from
+        for record in self.select(element_codes, begin, end):
+            data_map = self._maps[record.file]
+            for n, offset in enumerate(offsets):
+                value = unpack(data_map, record.offset + offset)[0]
+                data[n].setdefault(record.element, []).append(
+                    (record.start, record.end, None if value == MISSING else value))
+        return data
+
+    def point(self, latitude, longitude, element_codes=None):
+        """ Value time series for the grid cell nearest to a point, see series() """
+        cell = self.cell(latitude, longitude)
+        if cell is None:
+            return None
+        return self.series(cell[0], cell[1], element_codes)
+
+def open_cube(data_dir):
+    """
+    Shared cube for a data directory. Cubes are kept open per generation so
+    repeated probes reuse the same mappings.
+
+    args:
+        data_dir - directory containing rasters.idx, normally a pinned
+            generation
+    returns - Cube
+    """
+    index_path = os.path.join(os.path.realpath(data_dir), index_name)
+    with _cubes_lock:
+        cube = _cubes.pop(index_path, None)
+        if cube is None:
+            cube = Cube(index_path)
+        _cubes[index_path] = cube # most recently used last
+        if len(_cubes) > _max_open_cubes:
+            _cubes.popitem(last=False)
+        return cube
+
+def write_index(index_path, files, grid, records):
+    """
+    Write a cube index
+
+    args:
+        index_path - path of the index to write
+        files - data file names, relative to the index directory
+        grid - Grid shared by all records
+        records - list of Records, whose file attribute indexes files
+    """
+    parts = [_HEADER.pack(_MAGIC, _VERSION, len(files))]
+    for name in files:
+        name = name.encode('utf-8')
+        parts.append(_NAME_LENGTH.pack(len(name)))
+        parts.append(name)
+    parts.append(_GRID.pack(*grid.definition()))
+    parts.append(_COUNT.pack(len(records)))
+    for r in records:
+        parts.append(_RECORD.pack(r.element.encode('ascii'), r.unit.encode('ascii'),
+            r.reference, r.start, r.end, r.file, r.offset))
+    with open(index_path, 'wb') as f:
+        f.write(b''.join(parts))
+
+def merge_indexes(index_path, segment_paths):
+    """
+    Write an index that unions the records of several segment indexes. The
+    segments' data files are referenced in place, not copied.
+
+    args:
+        index_path - path of the union index to write
+        segment_paths - paths of the segment indexes, which must share a grid
+    """
+    base_dir = os.path.dirname(os.path.abspath(index_path))
+    files = []
+    grid = None
+    records = []
+    for segment_path in segment_paths:
+        with open(segment_path, 'rb') as f:
+            segment_files, segment_grid, segment_records = _parse_index(f.read())
+        if grid is None:
+            grid = segment_grid
+        elif segment_grid.definition() != grid.definition():
+            raise ValueError('Grid of {0} does not match'.format(segment_path))
+
+        segment_dir = os.path.dirname(os.path.abspath(segment_path))
+        first_file = len(files)
+        for name in segment_files:
+            files.append(os.path.relpath(os.path.join(segment_dir, name), base_dir))
+        for r in segment_records:
+            records.append(Record(r.element, r.unit, r.reference, r.start, r.end,
+                first_file + r.file, r.offset))
+    if grid is None:
+        raise ValueError('No segments to merge')
+
+    tmp_path = index_path + '.part'
+    write_index(tmp_path, files, grid, records)
+    os.rename(tmp_path, index_path)
+
+def convert(bin_paths, index_path, data_path, degrib_path, threads=4):
+    """
+    Build a sidecar segment from GRIB2 files with degrib. Each file is
+    listed by degrib -I and written out whole, one ESRI float raster per
+    message, by a single degrib -C -msg all -Flt run; the metadata of the
+    first file (-Met) gives the grid definition. The rasters of each file
+    are appended to the data file in inventory order and deleted.
+
+    The data file is an uncompressed float32 copy of every grid, so a
+    segment takes 4 * nx * ny bytes per message, about as much disk as
+    degrib's own cube of the same files. While converting, the rasters of
+    the files being converted take as much again, in a temporary directory
+    next to the data file.
+
+    args:
+        bin_paths - .bin files to convert
+        index_path - path of the segment index to write
+        data_path - path of the segment data file to write
+        degrib_path - degrib executable
+        threads - number of degrib runs at once
+    raises - DegribError if degrib fails, ValueError if its output does not
+        describe a Lambert conformal grid that Grid can read
+    """
+    import glob, shutil, tempfile
+    from collections import deque
+
+    work_dir = tempfile.mkdtemp(prefix='rasters-', dir=os.path.dirname(os.path.abspath(data_path)))
+    try:
+        # Per .bin file, its messages as (element, reference, valid time)
+        inventories = [None] * len(bin_paths)
+        queue = deque(enumerate(bin_paths))
+        errors = []
+
+        def work():
+            while not errors:
+                try:
+                    n, bin_path = queue.popleft()
+                except IndexError:
+                    return
+                try:
+                    inventories[n] = [message[1:] for message in
+                        _inventory(run_degrib([degrib_path, bin_path, '-I']))]
+                    run_degrib([degrib_path, bin_path, '-C', '-msg', 'all', '-Flt', '-nShp',
+                        '-Met' if n == 0 else '-nMet', '-Unit', 'e',
+                        '-namePath', os.path.join(work_dir, str(n)), '-nameStyle', '%e_%v.txt'])
+                except Exception as e:
+                    errors.append(e)
+
+        for n in range(len(bin_paths)):
+            os.mkdir(os.path.join(work_dir, str(n)))
+        workers = [threading.Thread(target=work) for _ in range(min(threads, len(bin_paths)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        if not any(inventories):
+            raise ValueError('No messages in {0}'.format(' '.join(bin_paths)))
+
+        metadata = sorted(glob.glob(os.path.join(work_dir, '0', '*.txt')))
+        if not metadata:
+            raise ValueError('{0}: degrib wrote no grid metadata'.format(bin_paths[0]))
+        grid = metadata_grid(_metadata_fields(metadata[0]))
+        if grid is None:
+            raise ValueError('{0}: grid is not Lambert conformal'.format(bin_paths[0]))
+        records = []
+        with open(data_path, 'wb') as f:
+            for n, messages in enumerate(inventories):
+                raster_dir = os.path.join(work_dir, str(n))
+                for element, reference, valid in messages:
+                    start, end = valid, valid
+                    if element in periods:
+                        start = valid - periods[element] * 3600
+                    records.append(Record(element, units.get(element, '[-]'), reference, start, end, 0, f.tell()))
+                    name = '{0}_{1}'.format(element, time.strftime('%Y%m%d%H%M', time.gmtime(valid)))
+                    f.write(_read_raster(os.path.join(raster_dir, name), grid))
+                shutil.rmtree(raster_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Instantaneous elements are valid until their next valid time
+    by_element = {}
+    for record in sorted(records, key=lambda r: r.start):
+        by_element.setdefault(record.element, []).append(record)
+    for element_records in by_element.values():
+        step = 3600
+        for record, following in zip(element_records, element_records[1:] + [None]):
+            if following and following.start > record.start:
+                step = following.start - record.start
+            if record.end == record.start:
+                record.end = record.start + step # the last one keeps the step before it
+    write_index(index_path, [os.path.relpath(data_path, os.path.dirname(os.path.abspath(index_path)))], grid, records)
+
+def run_degrib(args, cwd=None):
+    """
+    Run degrib to completion, in a working directory if given
+
+    returns - its output
+    raises - DegribError if it exits with an error
+    """
+    import subprocess
+    from pysky.degrib_pool import DegribError
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True, cwd=cwd)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise DegribError('{0} exited with status {1}: {2}'.format(' '.join(args),
+            process.returncode, (errors or output).strip()[-500:]))
+    return output
+
+def _inventory(output):
+    """
+    Messages of a degrib -I inventory, lines like
+    "1.1, 0, 2, MaxT, 0-SFC, 10/18/2026 00:00, 10/19/2026 00:00, 24.00"
+
+    returns - list of (message number, element, reference, valid time)
+        tuples, times as UTC epoch seconds
+    """
+    import calendar, time
+
+    messages = []
+    for line in output.decode('ascii', 'replace').splitlines():
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) < 8 or not fields[0].replace('.', '').isdigit():
+            continue # header line
+        reference, valid = [calendar.timegm(time.strptime(field, '%m/%d/%Y %H:%M')) for field in fields[5:7]]
+        messages.append((fields[0].split('.')[0], fields[3], reference, valid))
+    return messages
+
+def grid_metadata(bin_path, degrib_path):
+    """
+    Grid definition of the first message of a GRIB2 file, from the metadata
+    degrib -C -Met writes for it, whatever its projection
+
+    returns - dictionary of GDS field names, without their units in
+        parentheses, to values, see metadata_grid()
+    raises - DegribError if degrib fails, ValueError if it wrote no metadata
+    """
+    import glob, shutil, tempfile
+
+    work_dir = tempfile.mkdtemp(prefix='grid-')
+    try:
+        run_degrib([degrib_path, bin_path, '-C', '-msg', '1', '-Met', '-nShp',
+            '-namePath', work_dir, '-nameStyle', 'grid.txt'])
+        paths = glob.glob(os.path.join(work_dir, '*.txt'))
+        if not paths:
+            raise ValueError('{0}: degrib wrote no grid metadata'.format(bin_path))
+        return _metadata_fields(paths[0])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def metadata_grid(fields):
+    """
+    Grid from degrib grid metadata, see grid_metadata()
+
+    returns - Grid, or None if the grid is not Lambert conformal
+    raises - ValueError if a field of a Lambert conformal grid is missing
+    """
+    if not fields.get('Projection Type', '').startswith('30'):
+        return None
+    return Grid(int(_number(fields, 'Nx')), int(_number(fields, 'Ny')), _number(fields, 'Lat1'),
+        _longitude(fields, 'Lon1'), _longitude(fields, 'Orientation Lon'), _number(fields, 'Latin 1'),
+        _number(fields, 'Latin 2'), _number(fields, 'Dx'), _number(fields, 'Radius') * 1000.0)
+
+def metadata_bounds(fields):
+    """
+    Box covering a grid, from degrib grid metadata, see grid_metadata().
+    Lambert conformal and polar stereographic grids are bounded by points
+    along their edges, Mercator and latitude/longitude grids by their corner
+    cells.
+
+    returns - (south, west, north, east) tuple. A west edge east of the east
+        edge crosses the antimeridian.
+    raises - ValueError for other projections or if a field is missing
+    """
+    kind = fields.get('Projection Type', '').split(' ')[0]
+    if kind == '30':
+        grid = metadata_grid(fields)
+        return _edge_bounds(grid.projection, grid.nx, grid.ny)
+    if kind == '20':
+        return _edge_bounds(projection.PolarStereographic(_number(fields, 'Lat1'), _longitude(fields, 'Lon1'),
+            _longitude(fields, 'Orientation Lon'), _number(fields, 'Lat_D'), _number(fields, 'Dx'),
+            _number(fields, 'Radius') * 1000.0), int(_number(fields, 'Nx')), int(_number(fields, 'Ny')))
+    if kind in ('0', '10'):
+        latitudes = (_number(fields, 'Lat1'), _number(fields, 'Lat2'))
+        return (min(latitudes), _longitude(fields, 'Lon1'), max(latitudes), _longitude(fields, 'Lon2'))
+    raise ValueError('No bounds for projection {0}'.format(fields.get('Projection Type')))
+
+def _number(fields, name):
+    try:
+        return float(fields[name].split()[0])
+    except (KeyError, IndexError, ValueError):
+        raise ValueError('No {0} in the grid definition'.format(name))
+
+def _longitude(fields, name):
+    return round((_number(fields, name) + 180.0) % 360.0 - 180.0, 6)
+
+def _edge_bounds(grid_projection, nx, ny):
+    """ Box covering a projected grid, from points along its edges """
+    import numpy as np
+
+    # Outer edges of the edge cells, as far as Grid.cell() snaps points in
+    west, east, south, north = -0.5, nx - 0.5, -0.5, ny - 0.5
+    x = np.concatenate([np.linspace(west, east, 65), np.full(65, east), np.linspace(west, east, 65), np.full(65, west)])
+    y = np.concatenate([np.full(65, south), np.linspace(south, north, 65), np.full(65, north), np.linspace(south, north, 65)])
+    latitudes, longitudes = grid_projection.inverse(x, y)
+    pole_x, pole_y = grid_projection.forward([90.0], [0.0])
+    if west <= pole_x[0] <= east and south <= pole_y[0] <= north:
+        return (float(latitudes.min()), -180.0, 90.0, 180.0)
+    # Longitudes east and west of the centre, so a grid across the
+    # antimeridian is not taken for one around the globe
+    centre = float(grid_projection.inverse([(nx - 1) / 2.0], [(ny - 1) / 2.0])[1][0])
+    offsets = (longitudes - centre + 180.0) % 360.0 - 180.0
+    west_lon, east_lon = [round((centre + offset + 180.0) % 360.0 - 180.0, 6)
+        for offset in (float(offsets.min()), float(offsets.max()))]
+    return (float(latitudes.min()), west_lon, float(latitudes.max()), east_lon)
+
+def _metadata_fields(path):
+    """ GDS fields from the "GDS | name | value" lines of a degrib metadata file """
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) >= 3 and parts[0] == 'GDS':
+                fields[parts[1].split(' (')[0]] = parts[2]
+    return fields
+
+def _read_raster(path, grid):
+    """
+    Values of an ESRI float raster written by degrib -Flt (path without
+    extension), as little-endian float32 bytes in the sidecar row order. The
+    raster's first row is its northernmost, so rows are reversed to run
+    south to north.
+    """
+    import numpy as np
+
+    header = {}
+    with open(path + '.hdr') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                header[parts[0].lower()] = parts[1]
+    if (int(header['ncols']), int(header['nrows'])) != (grid.nx, grid.ny):
+        raise ValueError('{0}: raster does not match the {1}x{2} grid'.format(path, grid.nx, grid.ny))
+    dtype = '>f4' if header.get('byteorder', 'LSBFIRST').upper() == 'MSBFIRST' else '<f4'
+    values = np.fromfile(path + '.flt', dtype=dtype, count=grid.nx * grid.ny)
+    if values.size != grid.nx * grid.ny:
+        raise ValueError('{0}: raster is truncated'.format(path))
+    values = values.reshape(grid.ny, grid.nx)[::-1].astype('<f4')
+    nodata = float(header.get('nodata_value', MISSING))
+    if nodata != MISSING:
+        values[values == nodata] = MISSING
+    return values.tobytes()
+
+def _parse_index(index):
+    """
+    Parse index bytes into (data file names, Grid, list of Records)
+
+    raises - ValueError if the index is not in the sidecar layout or is
+        truncated
+    """
+    try:
+        return _unpack_index(index)
+    except struct.error:
+        raise ValueError('Truncated cube index')
+
+def _unpack_index(index):
+    magic, version, nfiles = _HEADER.unpack_from(index, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError('Unsupported cube index')
+    pos = _HEADER.size
+
+    files = []
+    for _ in range(nfiles):
+        length = _NAME_LENGTH.unpack_from(index, pos)[0]
+        pos += _NAME_LENGTH.size
+        files.append(index[pos:pos + length].decode('utf-8'))
+        pos += length
+
+    grid = Grid(*_GRID.unpack_from(index, pos))
+    pos += _GRID.size
+
+    count = _COUNT.unpack_from(index, pos)[0]
+    pos += _COUNT.size
+
+    records = []
+    for _ in range(count):
+        element, unit, reference, start, end, file, offset = _RECORD.unpack_from(index, pos)
+        pos += _RECORD.size
+        records.append(Record(element.rstrip(b'\0').decode('ascii'), unit.rstrip(b'\0').decode('ascii'),
+            reference, start, end, file, offset))
+    return files, grid, records
@@ -0,0 +1,331 @@
+"""
+Precomputed daily summaries for the whole grid of a cube generation
+
+build() computes the numeric daily aggregates of forecast._daily for every
+grid cell at once and saves one array per field, shaped (days, ny, nx), in
+{data_dir}/daily/. Lookups memory-map those arrays, so a daily summary is an
+array index per field with no degrib run or DWML parsing.
+
+Days are local calendar days of each cell, dated by the local start time of
+each record, as forecast._daily_batch dates them by the start-valid-time
+degrib reports. The standard UTC offset of a cell is taken from its
+longitude unless a fixed offset is given, and daylight saving time is
+applied with the US rules degrib uses (second Sunday of March to the first
+Sunday of November, at 2 AM local time). degrib reads both from its
+geodata, so cells whose zone boundary strays from their longitude, or that
+do not observe daylight saving time such as Arizona's, can still be a day
+off from it around midnight.
+
+The weather and symbol fields are not precomputed: degrib derives them from
+the Wx string table and its icon rules, which are not part of the cube.
+"""
+import calendar
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from pysky import cube
+from pysky import utils
+
+_dir_name = 'daily'
+_days_name = 'days.json'
+
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+_max_open_summaries = 4
+
+def _same_date(start_day, end_day):
+    """ 12-hour precipitation that does not cross a date (daytime) """
+    return start_day == end_day
+
+def _other_date(start_day, end_day):
+    """ 12-hour precipitation that crosses a date (overnight) """
+    return start_day != end_day
+
+def _format_integer(value):
+    """ Format values that degrib reports as integers """
+    return str(int(round(value)))
+
+def _format_wind(value):
+    """ Format wind speeds in knots as MPH, see forecast._format_wind """
+    from pysky import forecast
+    return forecast._format_wind(value)
+
+# Daily fields, see forecast._daily_config
+#   element: degrib element name - required
+#   aggregator: 'first', 'sum', 'average' or 'max' - required
+#   mask: function of a record's local start and end day numbers, whether the
+#       record counts towards its start day
+#   decimals: round values to this many decimals before aggregating
+#   formatter: method that applies formatting to a looked up value
+_config = {
+    'high': {'element': 'MaxT', 'aggregator': 'first', 'formatter': _format_integer},
+    'low': {'element': 'MinT', 'aggregator': 'first', 'formatter': _format_integer},
+    'precip_day': {'element': 'PoP12', 'aggregator': 'first', 'mask': _same_date, 'formatter': _format_integer},
+    'precip_night': {'element': 'PoP12', 'aggregator': 'first', 'mask': _other_date, 'formatter': _format_integer},
+    'rain_amount': {'element': 'QPF', 'aggregator': 'sum', 'decimals': 2},
+    'snow_amount': {'element': 'SnowAmt', 'aggregator': 'sum', 'decimals': 1},
+    'humidity': {'element': 'RH', 'aggregator': 'average'},
+    'wind_gust': {'element': 'WindGust', 'aggregator': 'max', 'formatter': _format_wind},
+    'wind_sustained': {'element': 'WindSpd', 'aggregator': 'average', 'formatter': _format_wind}
+}
+
+def _daylight_saving(utc_seconds, hours):
+    """
+    Whether US daylight saving time is in effect at a time, for a zone
+    whose standard UTC offset is a number of hours
+    """
+    local = time.gmtime(utc_seconds + hours * 3600) # local standard time
+    year = local.tm_year
+
+    def sunday(month, week):
+        first = calendar.weekday(year, month, 1) # Monday is 0
+        day = 1 + (6 - first) % 7 + 7 * (week - 1)
+        return calendar.timegm((year, month, day, 0, 0, 0))
+
+    begins = sunday(3, 2) + 2 * 3600 # 2 AM standard time
+    ends = sunday(11, 1) + 1 * 3600 # 2 AM daylight time
+    return begins <= utc_seconds + hours * 3600 < ends
+
+def _local_day(utc_seconds, hours, daylight):
+    """ Local day number (days since the epoch) of a UTC time in a zone """
+    if daylight and _daylight_saving(utc_seconds, hours):
+        hours += 1
+    return (utc_seconds + hours * 3600) // 86400
+
+def build(data_dir, utc_offset=None, daylight=True):
+    """
+    Compute the daily summaries of a cube generation. The arrays are written
+    to a temporary directory that is renamed into place once complete.
+
+    args:
+        data_dir - directory containing rasters.idx, see cube.open_cube()
+        utc_offset - hours added to UTC to get the local standard time of
+            every cell, or None to derive it per cell from its longitude
+        daylight - whether the cells observe daylight saving time
+    returns - number of days summarized
+    """
+    start = time.time()
+    data_cube = cube.open_cube(data_dir)
+    grid = data_cube.grid
+    if utc_offset is None:
+        offsets = np.round(grid.coordinates()[1] / 15.0).astype(int)
+    else:
+        offsets = np.full((grid.ny, grid.nx), int(utc_offset), dtype=int)
+    zones = [(int(hours), offsets == hours) for hours in np.unique(offsets)]
+    if len(zones) == 1:
+        zones = [(zones[0][0], None)] # no need to mask a single zone
+
+    records = data_cube.select()
+    if not records:
+        return 0
+    first_day = min(r.start for r in records) // 86400 - 1
+    last_day = max(r.start for r in records) // 86400 + 1
+    ndays = last_day - first_day + 1
+
+    daily_dir = os.path.join(data_dir, _dir_name)
+    tmp_dir = daily_dir + '.part'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    present = np.zeros(ndays, dtype=bool)
+    for field, entry in sorted(_config.items()):
+        field_records = [r for r in records if r.element == entry['element']]
+        path = os.path.join(tmp_dir, field + '.npy')
+        result = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(ndays, grid.ny, grid.nx))
+        result[:] = np.nan
+        days = _aggregate(data_cube, field_records, entry, zones, daylight, first_day, result)
+        present[days] = True
+        result.flush()
+        del result
+
+    days = [time.strftime('%Y-%m-%d', time.gmtime((first_day + d) * 86400)) for d in range(ndays)]
+    with open(os.path.join(tmp_dir, _days_name), 'w') as f:
+        json.dump({'days': days, 'present': present.tolist(), 'utc_offset': utc_offset, 'daylight': daylight}, f)
+
+    shutil.rmtree(daily_dir, ignore_errors=True)
+    os.rename(tmp_dir, daily_dir)
+    utils.info("Summarized {0} days in {1:.1f}s".format(int(present.sum()), time.time() - start))
+    return int(present.sum())
+
+def _aggregate(data_cube, records, entry, zones, daylight, first_day, result):
+    """
+    Reduce the records of one field into its (days, ny, nx) result array
+
+    args:
+        data_cube - Cube the records belong to
+        records - records of the field's element, in time order
+        entry - field configuration, see _config
+        zones - list of (standard UTC offset in hours, boolean cell mask or
+            None)
+        daylight - whether daylight saving time is observed, see _local_day()
+        first_day - day number (days since the epoch) of result[0]
+        result - array to fill, NaN where a day has no value
+    returns - list of the day indexes that were filled
+    """
+    aggregator = entry['aggregator']
+    mask = entry.get('mask')
+    decimals = entry.get('decimals')
+    seen = {} # day -> cells already set, for 'first'
+    counts = {} # day -> number of values, for 'average'
+    filled = set()
+
+    for record in records:
+        values = data_cube.grid_values(record)
+        values = np.where(values == cube.MISSING, np.nan, values)
+        if decimals is not None:
+            values = np.round(values, decimals)
+
+        # Cells of zones that share a local start day are reduced together
+        groups = OrderedDict()
+        for hours, cells in zones:
+            start_day = _local_day(record.start, hours, daylight)
+            end_day = _local_day(record.end, hours, daylight)
+            if mask and not mask(start_day, end_day):
+                continue
+            groups.setdefault(start_day - first_day, []).append(cells)
+
+        for day, masks in groups.iteritems():
+            filled.add(day)
+            if any(m is None for m in masks):
+                cells = None
+            else:
+                cells = masks[0] if len(masks) == 1 else np.logical_or.reduce(masks)
+            day_result = result[day]
+
+            if aggregator == 'first':
+                if day not in seen:
+                    seen[day] = np.zeros(values.shape, dtype=bool)
+                update = ~seen[day] if cells is None else cells & ~seen[day]
+                day_result[update] = values[update]
+                seen[day] |= update
+
+            elif aggregator == 'max':
+                update = np.fmax(day_result, values)
+                if cells is None:
+                    day_result[:] = update
+                else:
+                    day_result[cells] = update[cells]
+
+            else: # 'sum' and 'average'
+                valid = ~np.isnan(values)
+                if cells is not None:
+                    valid &= cells
+                total = np.where(np.isnan(day_result), 0, day_result)
+                total[valid] += values[valid]
+                if aggregator == 'sum':
+                    # a day with values of any kind sums to a number, see
+                    # forecast._reduce
+                    touched = np.ones(values.shape, dtype=bool) if cells is None else cells
+                    day_result[touched] = total[touched]
+                else:
+                    if day not in counts:
+                        counts[day] = np.zeros(values.shape, dtype=np.float32)
+                    counts[day][valid] += 1
+                    day_result[valid] = total[valid]
+
+    for day, count in counts.iteritems():
+        found = count > 0
+        result[day][found] /= count[found]
+    return sorted(filled)
+
+def ready(data_dir):
+    """ Whether the daily summaries of a generation have been built """
+    return os.path.exists(os.path.join(data_dir, _dir_name, _days_name))
+
+def open_summary(data_dir):
+    """
+    Shared memory-mapped daily summaries of a data directory
+
+    returns - dictionary with 'days' (list of dates) and 'fields' (field name
+        -> array shaped (days, ny, nx)), or None if they have not been built
+    """
+    daily_dir = os.path.join(os.path.realpath(data_dir), _dir_name)
+    with _summaries_lock:
+        summary = _summaries.pop(daily_dir, None)
+        if summary is None:
+            if not os.path.exists(os.path.join(daily_dir, _days_name)):
+                return None
+            with open(os.path.join(daily_dir, _days_name)) as f:
+                days = json.load(f)
+            summary = {
+                'days': [day for day, present in zip(days['days'], days['present']) if present],
+                'index': [d for d, present in enumerate(days['present']) if present],
+                'fields': dict((field, np.load(os.path.join(daily_dir, field + '.npy'), mmap_mode='r'))
+                    for field in _config)
+            }
+        _summaries[daily_dir] = summary # most recently used last
+        if len(_summaries) > _max_open_summaries:
+            _summaries.popitem(last=False)
+        return summary
+
+def lookup(data_dir, latitude, longitude):
+    """
+    Daily summary for a point from the precomputed arrays
+
+    args:
+        data_dir - directory containing rasters.idx, normally a pinned
+            generation
+        latitude - forecast point latitude
+        longitude - forecast point longitude
+    returns - list of daily dictionaries like forecast._daily without the
+        weather and symbol fields, with every field present and None where
+        a day has no value; [] if the point is outside the grid, or None if
+        the summaries have not been built
+    """
+    summary = open_summary(data_dir)
+    if summary is None:
+        return None
+    cell = cube.open_cube(data_dir).cell(latitude, longitude)
+    if cell is None:
+        return []
+    i, j = cell
+
+    results = []
+    for date, d in zip(summary['days'], summary['index']):
+        day = dict.fromkeys(_config)
+        found = False
+        for field, values in summary['fields'].iteritems():
+            value = float(values[d, j, i])
+            if value == value: # not NaN
+                entry = _config[field]
+                if entry.get('decimals') is not None:
+                    value = round(value, entry['decimals'])
+                day[field] = entry['formatter'](value) if entry.get('formatter') else value
+                found = True
+        if found:
+            day['date'] = date
+            results.append(day)
+    return results
+
+def from_forecast(days):
+    """
+    Reduce the daily part of a degrib-based forecast to the fields and
+    rounding of lookup(), for serving points whose summaries have not been
+    built. Dates remain the local dates reported by degrib.
+
+    args:
+        days - list of daily dictionaries, see forecast._daily
+    returns - list of daily dictionaries like lookup()
+    """
+    results = []
+    for day in days:
+        summary = dict.fromkeys(_config)
+        found = False
+        for field, value in day.iteritems():
+            entry = _config.get(field)
+            if entry is None:
+                continue
+            if entry.get('decimals') is not None and isinstance(value, float):
+                value = round(value, entry['decimals'])
+            summary[field] = value
+            found = True
+        if found:
+            summary['date'] = day['date']
+            results.append(summary)
+    return results
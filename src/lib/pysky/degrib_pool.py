@@ -0,0 +1,233 @@
+"""
+Pool of long-lived helper processes that run degrib jobs
+
+degrib has no server mode, so each job is still one degrib exec. The helpers
+are small processes forked once, when the pool starts, and they exec degrib
+directly without a shell. The server process itself never forks per request.
+
+Jobs are sent to a helper as one JSON line holding the degrib argument list.
+The helper answers with frames of "<length>\\n<bytes>" as degrib writes its
+output, then a "0\\n" frame and a "<exit status>\\n" line.
+"""
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError: # helper processes may run under any python
+    import queue
+
+_chunk_size = 65536
+
+# Seconds before starting a helper again after it failed to start
+_retry_delay = 5
+
+class DegribError(Exception):
+    """
+    Raised when a degrib job fails, times out or its helper process dies
+    """
+    pass
+
+class _Worker(object):
+    """ One helper process """
+
+    def __init__(self):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        self.process = subprocess.Popen([sys.executable, script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self._fd = self.process.stdout.fileno()
+        self._buffer = b''
+        self.status = None # exit status of the last job
+
+    def run(self, argv, deadline):
+        """
+        Run a job, yielding degrib output chunks as they arrive. Once they
+        are all read, degrib's exit status is left in status.
+
+        args:
+            argv - degrib argument list
+            deadline - time.time() by which the whole job must be done
+        """
+        self.status = None
+        self.process.stdin.write(json.dumps(argv).encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        while True:
+            length = int(self._read_line(deadline))
+            if not length:
+                break
+            yield self._read(length, deadline)
+        self.status = int(self._read_line(deadline))
+
+    def kill(self):
+        """ Kill the helper and any degrib it is running """
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            # The helper has not made its own process group yet
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+        self.process.wait()
+
+    def _read_line(self, deadline):
+        while b'\n' not in self._buffer:
+            self._fill(deadline)
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line
+
+    def _read(self, length, deadline):
+        while len(self._buffer) < length:
+            self._fill(deadline)
+        data, self._buffer = self._buffer[:length], self._buffer[length:]
+        return data
+
+    def _fill(self, deadline):
+        import time
+
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([self._fd], [], [], remaining)[0]:
+            raise DegribError('degrib job timed out')
+        data = os.read(self._fd, _chunk_size)
+        if not data:
+            raise DegribError('degrib helper process exited')
+        self._buffer += data
+
+class DegribPool(object):
+    """ Bounded pool of degrib helper processes shared by all threads """
+
+    def __init__(self, size=4, timeout=30):
+        """
+        args:
+            size - number of helper processes, and so of concurrent jobs
+            timeout - default seconds allowed per job, including the wait
+                for a free helper
+        """
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(_Worker())
+
+    def run(self, argv, timeout=None):
+        """
+        Run degrib and return its output
+
+        args:
+            argv - degrib argument list, starting with the executable
+            timeout - seconds allowed, defaults to the pool timeout
+        returns - output string
+        """
+        return b''.join(self.stream(argv, timeout))
+
+    def stream(self, argv, timeout=None):
+        """
+        Run degrib, yielding its output in chunks as it is produced. The
+        helper is returned to the pool when the generator is exhausted or
+        closed.
+
+        args:
+            argv - degrib argument list, starting with the executable
+            timeout - seconds allowed, defaults to the pool timeout
+        raises - DegribError once the output has been read if degrib exited
+            with an error or was killed by a signal
+        """
+        import time
+        from pysky import metrics
+
+        timeout = timeout if timeout else self.timeout
+        start = time.time()
+        deadline = start + timeout # for the wait and the job together
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise DegribError('No degrib worker available')
+        finally:
+            metrics.observe('pysky_stage_seconds', time.time() - start, stage='degrib_wait')
+
+        completed = False
+        try:
+            for chunk in worker.run(argv, deadline):
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                status = worker.status # before another job can reuse it
+                self._release(worker)
+            else:
+                # Timed out, crashed or abandoned mid-job: the helper's state
+                # is unknown, so replace it.
+                worker.kill()
+                self._replace()
+        if status:
+            raise DegribError('{0} exited with status {1}'.format(' '.join(argv), status))
+
+    def close(self):
+        """ Stop all idle helper processes """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+    def _release(self, worker):
+        """ Return a helper to the pool, or stop it if the pool is closed """
+        with self._lock:
+            if not self._closed:
+                self._idle.put(worker)
+                return
+        worker.kill()
+
+    def _replace(self):
+        """
+        Start a helper in place of one that was killed. If it cannot be
+        started, e.g. out of processes, try again later rather than let the
+        pool shrink for good.
+        """
+        with self._lock:
+            if self._closed:
+                return
+        try:
+            worker = _Worker()
+        except OSError:
+            timer = threading.Timer(_retry_delay, self._replace)
+            timer.daemon = True
+            timer.start()
+            return
+        self._release(worker)
+
+def _serve():
+    """ Helper process main loop """
+    os.setsid() # own process group, so a timed out job can be killed with its degrib
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+        try:
+            argv = json.loads(line.decode('utf-8'))
+            process = subprocess.Popen(argv, stdout=subprocess.PIPE, close_fds=True)
+            while True:
+                chunk = os.read(process.stdout.fileno(), _chunk_size)
+                if not chunk:
+                    break
+                stdout.write(('%d\n' % len(chunk)).encode('ascii') + chunk)
+                stdout.flush()
+            status = process.wait()
+        except (OSError, ValueError):
+            status = 127
+        stdout.write(('0\n%d\n' % status).encode('ascii'))
+        stdout.flush()
+
+if __name__ == '__main__':
+    _serve()
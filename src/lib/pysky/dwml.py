@@ -1,4 +1,8 @@
-from xml.etree import ElementTree
+from io import BytesIO
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 
 _codes =  {
     'Daily Maximum Temperature' : 'maxt',
@@ -19,135 +23,108 @@ _codes =  {
 }
 
 # Parse xml string
-def parse_xml(xml):
-        
-    tree = ElementTree.fromstring(xml)
-
-    # Parse timelayouts
-    timelayouts = _parse_time_layouts(tree)
-
-    # Parse parameter data
-    data = _parse_parameter_data(tree, timelayouts)
-
-    return data
-        
-def _parse_time_layouts(tree):
+def parse_xml(xml, codes=None):
     """
-    Parse time layouts
+    Parse a DWML document incrementally, keeping only the parameters asked
+    for
 
     args:
-        tree - etree tree
+        xml - DWML string
+        codes - list of parameter codes (see _codes) to keep, or None for all
     returns:
-        dictionary of timelayouts
-            key is DWML unique layout key
-            value is list of start date and end date
-    """        
-        
+        dictionary keyed by parameter code. Each parameter is a dictionary
+        with its 'name', its 'values' (a list of strings) and 'times', the
+        time layout of the values. A time layout is a dictionary of lists
+        parallel to the values: 'start', 'startDate', 'startTime', 'end',
+        'endDate' and 'endTime'. Parameters with the same DWML time layout
+        share one layout dictionary.
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    codes = set(codes) if codes else None
+
     timelayouts = {}
-    for timelayout in tree.getiterator("time-layout"):
-            
-        currentKey = ''
-        position = -1
-        for child in timelayout.getchildren():
-            
-            if (child.tag == 'layout-key'):
-                currentKey = child.text
-                position = -1
-                timelayouts[child.text] = []
-                    
-            if (child.tag == 'start-valid-time'):
-                position = position + 1
-                timelayouts[currentKey].append(['',''])
-                xmlDate = child.text
-                        
-                timelayouts[currentKey][position][0] = _convert_xml_date(xmlDate)
-                    
-            if (child.tag == 'end-valid-time'):
-                    
-                xmlDate = child.text
-                        
-                timelayouts[currentKey][position][1] = _convert_xml_date(xmlDate)
-                    
-    return timelayouts
-        
-def _parse_parameter_data(tree, timelayouts):
-        
     parameter_data = {}
-        
-    # Loop over parameters
-    for parameters in tree.getiterator('parameters'):
-            
-        currentCode = ''
-            
-        # Loop over each parameter
-        for parameter in parameters.getchildren():
-                
-            # If a time-layout attribute exists, we have a parameter element
-            if 'time-layout' in parameter.attrib:
-                    
-                valueCount = 0
-                timeLayoutKey = parameter.attrib['time-layout']
-                
-                for child in parameter.getchildren():
-                        
-                    value = ''
-                    if child.tag == 'name':
-                            
-                        name = child.text
-                        currentCode = _codes[name]
-                        parameter_data[currentCode] = {
-                            'name': name, 
-                            'values': []
-                            }
-                        continue
-                        
-                    # Grab values for regular 'value' or 'icon-link' tags
-                    elif child.tag == 'value' or child.tag == 'icon-link':
-                        value = child.text
-                        if value is None:
-                            value = ''
-                            
-                    # Special values for weather conditions
-                    elif child.tag == 'weather-conditions':
-                        
-                        value = ''
-                        for nextchild in child.getchildren():
-                            
-                            if nextchild.tag == 'value':
-                                
-                                weatherData = {'coverage':'', 'intensity':'', 'weather-type':'', 'qualifier':''}
-                                for k, v in nextchild.attrib.items():
-                                    weatherData[k] = v
-                                    
-                                value += "|coverage:{0}|intensity:{1}|weather-type:{2}|qualifier:{3}".format(weatherData['coverage'], weatherData['intensity'], weatherData['weather-type'], weatherData['qualifier'])
-                                #value += "|{0}:{1}".format(k, v)
-                                        
-                    else:
-                            
-                        continue
-                    #if value is not None or child.tag == 'weather-conditions': # weather-conditions has blank values
-                        #print timeLayoutKey
-                        #print timelayouts[timeLayoutKey]
-                    start = timelayouts[timeLayoutKey][valueCount][0]
-                    startDate, startTime = start.split(' ') if len(start) else ['', '']
-                    end = timelayouts[timeLayoutKey][valueCount][1]
-                    endDate, endTime = end.split(' ') if len(end) else ['', '']
-                    parameter_data[currentCode]['values'].append(
-                        { 
-                            'value': value, 
-                            'start': start,
-                            'startDate': startDate,
-                            'startTime': startTime,
-                            'end': end,
-                            'endDate': endDate,
-                            'endTime': endTime
-                        }
-                    )
-                    
-                    valueCount += 1
+    for event, element in ElementTree.iterparse(BytesIO(xml)):
+
+        if element.tag == 'time-layout':
+            key, layout = _parse_time_layout(element)
+            timelayouts[key] = layout
+            element.clear()
+
+        # If a time-layout attribute exists, we have a parameter element
+        elif 'time-layout' in element.attrib:
+            name = element.findtext('name')
+            code = _codes.get(name)
+            if code and (codes is None or code in codes):
+                parameter_data[code] = {
+                    'name': name,
+                    'times': element.attrib['time-layout'],
+                    'values': _parse_values(element)
+                }
+            element.clear()
+
+    # Replace layout keys by the layouts, which precede their parameters in
+    # DWML but are resolved here so document order does not matter
+    for parameter in parameter_data.itervalues():
+        parameter['times'] = timelayouts[parameter['times']]
 
     return parameter_data
-                
+
+def _parse_time_layout(timelayout):
+    """
+    Parse a time layout element
+
+    args:
+        timelayout - time-layout element
+    returns:
+        tuple of the DWML unique layout key and the time layout dictionary
+    """
+    key = timelayout.findtext('layout-key')
+    layout = {'start': [], 'startDate': [], 'startTime': [], 'end': [], 'endDate': [], 'endTime': []}
+    for child in timelayout:
+        if child.tag == 'start-valid-time':
+            layout['start'].append(_convert_xml_date(child.text or ''))
+            layout['end'].append('')
+        elif child.tag == 'end-valid-time':
+            layout['end'][-1] = _convert_xml_date(child.text or '')
+
+    for field in ('start', 'end'):
+        for value in layout[field]:
+            date, time = value.split(' ') if len(value) else ['', '']
+            layout[field + 'Date'].append(date)
+            layout[field + 'Time'].append(time)
+
+    return key, layout
+
+def _parse_values(parameter):
+    """
+    Parse the values of a parameter element
+
+    args:
+        parameter - parameter element
+    returns:
+        list of value strings
+    """
+    values = []
+    for child in parameter:
+
+        # Grab values for regular 'value' or 'icon-link' tags
+        if child.tag == 'value' or child.tag == 'icon-link':
+            values.append(child.text if child.text is not None else '')
+
+        # Special values for weather conditions
+        elif child.tag == 'weather-conditions':
+            value = ''
+            for nextchild in child:
+                if nextchild.tag == 'value':
+                    weatherData = {'coverage':'', 'intensity':'', 'weather-type':'', 'qualifier':''}
+                    weatherData.update(nextchild.attrib)
+                    value += "|coverage:{0}|intensity:{1}|weather-type:{2}|qualifier:{3}".format(weatherData['coverage'], weatherData['intensity'], weatherData['weather-type'], weatherData['qualifier'])
+            values.append(value)
+
+    return values
+
 def _get_xml_from_date_object(dateObject):
         
     return dateObject.strftime('%Y-%m-%dT%H:%M:%S+00:00')
@@ -0,0 +1,185 @@
+import email.utils
+import httplib
+import os
+import socket
+import threading
+import time
+import urlparse
+import Queue
+
+class ConnectionPool(object):
+    """
+    Bounded pool of keep-alive HTTP connections to the host of a base URL.
+    Files are fetched conditionally, so unchanged files cost a 304 response
+    instead of a download.
+    """
+
+    def __init__(self, base_url, size=4, timeout=60):
+        """
+        args:
+            base_url - URL that fetched paths are relative to
+            size - maximum number of open connections
+            timeout - socket timeout in seconds
+        """
+        url = urlparse.urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None) # connected on first use
+
+    def fetch(self, path, local_path=None, if_modified_since=None, method='GET'):
+        """
+        Fetch a file
+
+        args:
+            path - path relative to the base URL
+            local_path - where to save the body of a 200 response, or None to
+                discard it
+            if_modified_since - epoch time of the local copy, or None to fetch
+                unconditionally
+            method - GET or HEAD
+        returns - dictionary with the path, HTTP status, Last-Modified as
+            epoch time, bytes saved and seconds taken
+        """
+        start = time.time()
+        headers = {}
+        if if_modified_since:
+            headers['If-Modified-Since'] = email.utils.formatdate(if_modified_since, usegmt=True)
+
+        connection = self._idle.get()
+        try:
+            for attempt in (1, 2):
+                if connection is None:
+                    connection = self._connect()
+                try:
+                    result = self._request(connection, method, path, headers, local_path)
+                    break
+                except (httplib.HTTPException, socket.error):
+                    # The server may have closed an idle keep-alive
+                    # connection; retry once on a fresh one.
+                    connection.close()
+                    connection = None
+                    if attempt == 2:
+                        raise
+                except Exception:
+                    connection.close()
+                    connection = None
+                    raise
+            if result.pop('close'):
+                connection.close()
+                connection = None
+        finally:
+            self._idle.put(connection)
+
+        if result['status'] not in (200, 304):
+            raise IOError('HTTP {0} fetching {1}'.format(result['status'], path))
+        result['seconds'] = time.time() - start
+        return result
+
+    def close(self):
+        """ Close idle connections """
+        connections = []
+        while True:
+            try:
+                connections.append(self._idle.get_nowait())
+            except Queue.Empty:
+                break
+        for connection in connections:
+            if connection is not None:
+                connection.close()
+            self._idle.put(None)
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _request(self, connection, method, path, headers, local_path):
+        connection.request(method, '{0}/{1}'.format(self.base_path, path), headers=headers)
+        response = connection.getresponse()
+        result = {
+            'path': path,
+            'status': response.status,
+            'last_modified': _http_time(response.getheader('Last-Modified')),
+            'bytes': 0,
+            'close': response.getheader('Connection', '').lower() == 'close'
+        }
+        if response.status == 200 and method == 'GET' and local_path:
+            result['bytes'] = _save(response, local_path)
+        else:
+            response.read()
+        return result
+
+def fetch_all(pool, jobs, threads=None):
+    """
+    Run ConnectionPool.fetch() calls concurrently
+
+    args:
+        pool - ConnectionPool
+        jobs - list of (path, local_path, if_modified_since) tuples
+        threads - number of concurrent fetches, defaults to the pool size
+    returns - list of fetch() results in job order. If any fetch failed, the
+        first error is raised once all jobs have finished.
+    """
+    results = [None] * len(jobs)
+    errors = []
+    pending = Queue.Queue()
+    for n, job in enumerate(jobs):
+        pending.put((n, job))
+
+    def work():
+        while True:
+            try:
+                n, (path, local_path, if_modified_since) = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[n] = pool.fetch(path, local_path, if_modified_since)
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=work) for _ in range(min(threads or pool.size, len(jobs)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def _http_time(value):
+    """ Convert an HTTP date header to epoch time, or None """
+    parsed = email.utils.parsedate_tz(value) if value else None
+    return email.utils.mktime_tz(parsed) if parsed else None
+
+def _save(response, local_path):
+    """
+    Save a response body, writing to a temporary file that is renamed into
+    place once complete
+
+    returns - number of bytes saved
+    """
+    local_dir = os.path.dirname(local_path)
+    if local_dir and not os.path.exists(local_dir):
+        try:
+            os.makedirs(local_dir)
+        except OSError:
+            if not os.path.isdir(local_dir):
+                raise
+
+    chunk_size = 65536
+    size = 0
+    tmp_path = local_path + '.part'
+    with open(tmp_path, 'wb') as f:
+        chunk = response.read(chunk_size)
+        while chunk:
+            f.write(chunk)
+            size += len(chunk)
+            chunk = response.read(chunk_size)
+    os.rename(tmp_path, local_path)
+    return size
@@ -1,4 +1,9 @@
+import json
+
+import numpy as np
+
 from pysky import dwml
+from pysky import metrics
 from pysky import utils
 
 _hourly_params = { 'snow_amount': 'snow', 'temp': 'temp', 'humidity': 'rhm', 'precip': 'pop12', 'rain_amount': 'qpf',
@@ -58,17 +63,54 @@ def get_forecast(latitude, longitude,
     # If grib2 directory is provided, use grib2 files
     if grib2_dir:
         from pysky import grib2
-        xml = grib2.xml(grib2_dir, latitude, longitude)
-        utils.info(xml)
+        return forecast_json(grib2.Config(), grib2_dir, latitude, longitude, include_hourly)
     # Otherwise, use SOAP web service
     else:
         from pysky import noaa_ws
         xml = noaa_ws.xml(latitude, longitude)
         utils.info(xml)
 
-    # Initialize object for data
-    print(process_xml(xml, include_hourly))  # TODO fix json call
-    #print(json.dumps(process_xml(xml, include_hourly))) # TODO fix
+    return json.dumps(process_xml(xml, include_hourly))
+
+def forecast_json(config, grib2_dir, latitude, longitude, include_hourly=False, elements=None):
+    """
+    Get JSON forecast for a point from the grib2 data cube. The encoded
+    result is kept in the config's response cache, keyed by generation and grid cell, so
+    repeat requests skip degrib, DWML parsing and aggregation, and concurrent
+    identical requests share one computation.
+
+    Args:
+        config - grib2.Config
+        grib2_dir - grib2 data directory
+        latitude - forecast point latitude
+        longitude - forecast point longitude
+        include_hourly - flag to include hourly forecast, defaults to false
+        elements - list of NDFD elements to request from degrib, or None
+            for all
+
+    Returns: json-formatted string - see README
+    """
+    from pysky import grib2
+
+    key = grib2.cache_key(config, grib2_dir, latitude, longitude, 'forecast',
+        tuple(elements) if elements else None, None, None, 'hourly' if include_hourly else 'daily')
+    grib2.track(config, key, ('forecast', latitude, longitude, include_hourly, elements))
+    if key and config.cache is not None:
+        cached = config.cache.get(key)
+        if cached is not None:
+            return cached
+
+    def compute():
+        xml = grib2.xml(config, grib2_dir, latitude, longitude, elements)
+        utils.info(xml)
+        result = json.dumps(process_xml(xml, include_hourly))
+        if key and config.cache is not None:
+            config.cache.put(key, result)
+        return result
+
+    if key and config.flights is not None:
+        return config.flights.do(key, compute, config.flight_timeout)
+    return compute()
 
 
 def exec_command_line():
@@ -98,7 +140,7 @@ def exec_command_line():
 
     latitude = args[0]
     longitude = args[1]
-    get_forecast(latitude, longitude, options.include_hourly, options.grib2_dir)
+    print(get_forecast(latitude, longitude, options.include_hourly, options.grib2_dir))
 
 def process_xml(xml, include_hourly = False):
     """
@@ -110,117 +152,244 @@ def process_xml(xml, include_hourly = False):
 
     returns: dictionary, see README
     """
-    # Parse DWML into python object
-    xml_data = dwml.parse_xml(xml)
+    return process_xml_batch([xml], include_hourly)[0]
 
-    return forecastData({'daily': _daily(xml_data), 'hourly': _hourly(xml_data)})
-    #self._cleanup()
+def process_xml_batch(xmls, include_hourly = False):
+    """
+    Process XML strings for many points, aggregating all of them at once
+
+    args:
+        xmls - list of XML strings
+        include_hourly - Include hourly forecast
+
+    returns: list of dictionaries, see README
+    """
+    # Parse DWML into python objects, keeping only the parameters we use
+    codes = set(_daily_plan)
+    if include_hourly:
+        codes.update(_hourly_plan)
+    with metrics.timed('pysky_stage_seconds', stage='parse'):
+        xml_datas = [dwml.parse_xml(xml, codes) for xml in xmls]
+
+    with metrics.timed('pysky_stage_seconds', stage='aggregate'):
+        daily = _daily_batch(xml_datas)
+        hourly = _hourly_batch(xml_datas) if include_hourly else [[] for _ in xml_datas]
+    return [forecastData({'daily': d, 'hourly': h}) for d, h in zip(daily, hourly)]
 
 def _daily(xml_data):
     """
     Get daily forecast data
 
     args:
-        xml_data - dictionary returned from process_xml, see README
+        xml_data - dictionary returned from dwml.parse_xml
     returns: list, see README
     """
-    daily_data = []
-    # Organize data by date
-    #   Format will be tmp_data with date as keys
-    #       tmp_data[*date*][*code*] = {values: [*vals*], startDate: *startDate*, endDate: *endDate*}
-    tmp_data = {}
-    for code in xml_data:
-        for val_data in xml_data[code]['values']:
-            date = val_data['startDate'] # Use start date as daily date
-            if date not in tmp_data:
-                tmp_data[date] = {}
-                #daily_data[date] = {}
-            if code not in tmp_data[date]:
-                tmp_data[date][code] = []
-            tmp_data[date][code].append(val_data)
-
-    # Loop over tmp_data
-    config = _daily_config
-    dates = tmp_data.keys()
-    dates.sort()
-    for date in dates: # date
-        date_data = {'date': date}
-        for key in config: # key
-            code = config[key]['code']
-            if code in tmp_data[date]:
-                date_data[key] = _aggregate_values(
-                    tmp_data[date][code], 
-                    config[key]['aggregator'],
-                    config[key]['pre_filter'] if 'pre_filter' in config[key] else None,
-                    config[key]['formatter'] if 'formatter' in config[key] else None
-                )
-
-        daily_data.append(date_data)
-
-    return daily_data
+    return _daily_batch([xml_data])[0]
 
 def _hourly(xml_data):
     """
     Get hourly forecast data
 
     args:
-        xml_data - dictionary returned from process_xml, see README
+        xml_data - dictionary returned from dwml.parse_xml
     returns: list, see README
     """
-    # Organize data by date/time
-    #       tmp_data[*date*][*time*][*code*] = *value*
-    tmp_data = {}
-    for code in _hourly_params.itervalues():
-        for val_data in xml_data[code]['values']:
-            date = val_data['startDate']
-            time = val_data['startTime']
-            if date not in tmp_data:
-                tmp_data[date] = {}
-            if time not in tmp_data[date]:
-                tmp_data[date][time] = {}
-            tmp_data[date][time][code] = val_data['value']
-    config = _hourly_config
-    
-    # Sort into correct order
-    date_times = []
-    for date in tmp_data:
-        for time in tmp_data[date]:
-            date_times.append("{0} {1}".format(date, time))
-
-    date_times.sort()
+    return _hourly_batch([xml_data])[0]
 
-    # Add to hourly data list
-    hourly_data = []
-    for dt in date_times:
-        date, time = dt.split(' ')
-        time_data = {'date': date, 'time': time}
-        for key in config:
-            code = config[key]['code']
-            if code in tmp_data[date][time]:
-                val = tmp_data[date][time][code] if 'formatter' not in config[key] else config[key]['formatter'](tmp_data[date][time][code])
-                time_data[key] = val 
-        hourly_data.append(time_data)
-    return hourly_data
-
-def _first(values):
+def _daily_batch(xml_datas):
     """
-    Aggregate by first value
-    Arg: values - list of values
-    Returns: first value
+    Get daily forecast data for many points. Values of every point are
+    grouped by (point, start date) and each configured aggregate is computed
+    for all groups in one reduction.
+
+    args:
+        xml_datas - list of dictionaries returned from dwml.parse_xml
+    returns: list with a daily forecast list per point, see README
     """
-    return values[0] if len(values) else None
+    columns = dict((code, _columns(xml_datas, code)) for code in _daily_plan)
 
-def _average(values):
+    # Use start date as daily date
+    dates = np.unique(np.concatenate([c['startDate'] for c in columns.itervalues()]))
+    ngroups = len(xml_datas) * len(dates)
+    present = np.zeros(ngroups, dtype=bool)
+    daily_data = [{} for _ in range(ngroups)]
 
+    for code, steps in _daily_plan.iteritems():
+        column = columns[code]
+        if not len(column['point']):
+            continue
+        group = column['point'] * len(dates) + np.searchsorted(dates, column['startDate'])
+        groups = np.unique(group)
+        present[groups] = True
+        slot = np.searchsorted(groups, group)
+
+        for key, step in steps:
+            rows = np.nonzero(step['mask'](column))[0] if step['mask'] else np.arange(len(slot))
+            values = _reduce(step, column, rows, slot[rows], len(groups))
+            for g, val in zip(groups.tolist(), values.tolist()):
+                daily_data[g][key] = step['formatter'](val) if step['formatter'] else val
+
+    results = [[] for _ in xml_datas]
+    for g in np.nonzero(present)[0].tolist():
+        p, d = divmod(g, len(dates))
+        daily_data[g]['date'] = str(dates[d])
+        results[p].append(daily_data[g])
+    return results
+
+def _hourly_batch(xml_datas):
     """
-    Aggregate by average value
-    Arg: values - list of values
-    Returns: average value
-    """
-    if not len(values):
-     return None
+    Get hourly forecast data for many points
+
+    args:
+        xml_datas - list of dictionaries returned from dwml.parse_xml
+    returns: list with an hourly forecast list per point, see README
+    """
+    columns = dict((code, _columns(xml_datas, code)) for code in _hourly_plan)
+
+    # Number each (date, time) pair in sorted order
+    dates = np.unique(np.concatenate([c['startDate'] for c in columns.itervalues()]))
+    times = np.unique(np.concatenate([c['startTime'] for c in columns.itervalues()]))
+    for column in columns.itervalues():
+        column['dateTime'] = np.searchsorted(dates, column['startDate']) * len(times) + np.searchsorted(times, column['startTime'])
+    date_times = np.unique(np.concatenate([c['dateTime'] for c in columns.itervalues()]))
+    nslots = len(xml_datas) * len(date_times)
+    present = np.zeros(nslots, dtype=bool)
+
+    # Per key, the formatted value of every (point, date/time) slot
+    keys = []
+    for code, steps in _hourly_plan.iteritems():
+        column = columns[code]
+        if not len(column['point']):
+            continue
+        slot = column['point'] * len(date_times) + np.searchsorted(date_times, column['dateTime'])
+        present[slot] = True
+        for key, step in steps:
+            if step['formatter'] is _format_wind:
+                values = _format_wind_array(_numbers(column))
+            elif step['formatter']:
+                values = [step['formatter'](val) for val in column['values']]
+            else:
+                values = column['values']
+            key_values = np.empty(nslots, dtype=object)
+            key_present = np.zeros(nslots, dtype=bool)
+            key_values[slot] = values
+            key_present[slot] = True
+            keys.append((key, key_values, key_present))
+
+    labels = [(str(dates[dt // len(times)]), str(times[dt % len(times)])) for dt in date_times]
+    keys = [(key, key_values.tolist(), key_present.tolist()) for key, key_values, key_present in keys]
+    results = [[] for _ in xml_datas]
+    for s in np.nonzero(present)[0].tolist():
+        p, t = divmod(s, len(date_times))
+        time_data = {'date': labels[t][0], 'time': labels[t][1]}
+        for key, key_values, key_present in keys:
+            if key_present[s]:
+                time_data[key] = key_values[s]
+        results[p].append(time_data)
+    return results
+
+def _columns(xml_datas, code):
+    """
+    Concatenate a parameter's values and times across points
+
+    args:
+        xml_datas - list of dictionaries returned from dwml.parse_xml
+        code - parameter code
+    returns: dictionary of parallel arrays: 'point' index, 'values' (object
+        array of strings), 'startDate', 'startTime' and 'endDate'
+    """
+    points, values, start_dates, start_times, end_dates = [], [], [], [], []
+    for p, xml_data in enumerate(xml_datas):
+        if code not in xml_data:
+            continue
+        parameter = xml_data[code]
+        times = parameter['times']
+        n = min(len(parameter['values']), len(times['start']))
+        points.extend([p] * n)
+        values.extend(parameter['values'][:n])
+        start_dates.extend(times['startDate'][:n])
+        start_times.extend(times['startTime'][:n])
+        end_dates.extend(times['endDate'][:n])
+
+    column_values = np.empty(len(values), dtype=object)
+    column_values[:] = values
+    return {
+        'point': np.array(points, dtype=int),
+        'values': column_values,
+        'startDate': np.array(start_dates, dtype=str),
+        'startTime': np.array(start_times, dtype=str),
+        'endDate': np.array(end_dates, dtype=str)
+    }
+
+def _numbers(column):
+    """ Values of a column as floats, NaN where empty """
+    if 'numbers' not in column:
+        values = column['values'].astype(str)
+        column['numbers'] = np.where(values == '', 'nan', values).astype(np.float64)
+    return column['numbers']
+
+def _reduce(step, column, rows, slot, ngroups):
+    """
+    Apply an aggregate to the selected rows of a column
 
-    return sum([float(x) for x in values])/len(values)
+    args:
+        step - compiled plan step
+        column - parameter columns, see _columns
+        rows - indexes of the rows to aggregate
+        slot - group of each row, 0 <= slot < ngroups
+        ngroups - number of groups
+    returns: object array of the aggregated value per group, None where a
+        group has no values
+    """
+    aggregator = step['aggregator']
+    result = np.empty(ngroups, dtype=object)
+
+    if aggregator == 'first':
+        groups, first = np.unique(slot, return_index=True)
+        result[groups] = column['values'][rows[first]]
+
+    elif aggregator in ('sum', 'average', 'max'):
+        numbers = _numbers(column)[rows]
+        if step['decimals'] is not None:
+            numbers = np.round(numbers, step['decimals'])
+        valid = ~np.isnan(numbers)
+        slot, numbers = slot[valid], numbers[valid]
+        counts = np.bincount(slot, minlength=ngroups)
+        found = counts > 0
+        if aggregator == 'max':
+            maxima = np.full(ngroups, -np.inf)
+            np.maximum.at(maxima, slot, numbers)
+            result[found] = maxima[found].tolist()
+        else:
+            totals = np.bincount(slot, weights=numbers, minlength=ngroups)
+            if aggregator == 'sum':
+                result[:] = totals.tolist()
+            else:
+                result[found] = (totals[found] / counts[found]).tolist()
+
+    else: # aggregate string values in order with a python function
+        order = np.argsort(slot, kind='mergesort')
+        bounds = np.searchsorted(slot[order], np.arange(ngroups + 1))
+        values = column['values'][rows[order]]
+        for g in range(ngroups):
+            result[g] = aggregator(list(values[bounds[g]:bounds[g + 1]]))
+
+    return result
+
+def _compile_plan(config):
+    """
+    Compile a parsing configuration into a plan: a dictionary keyed by code
+    of the (output key, step) pairs computed from that code's values
+    """
+    plan = {}
+    for key, entry in sorted(config.items()):
+        plan.setdefault(entry['code'], []).append((key, {
+            'aggregator': entry.get('aggregator'),
+            'mask': entry.get('mask'),
+            'decimals': entry.get('decimals'),
+            'formatter': entry.get('formatter')
+        }))
+    return plan
 
 def _first_nonempty(values):
     """
@@ -259,83 +428,47 @@ def _frequent_sym(values):
             maxCount = v
     return val
 
-def _aggregate_values(value_data, aggregator, pre_filter=None, formatter=None):
-    """
-    Aggregate values using optional filter and format functions
-
-    args:
-        values - list of values to aggregate
-        pre_filter - filter function
-        formatter - format function
-    """
-    # Apply filter
-    values = pre_filter(value_data) if pre_filter else _pre_values(value_data)
-
-    # Aggregate
-    val = aggregator(values)
-
-    # Apply formatter
-    if formatter:
-        val = formatter(val)
-
-    return val
-
-def _pre_values(value_data):
-    """
-    Convert extra values from value data, which also contains date/time information.  Default pre- filter
-    args:
-        value_data - array of dictionaries containing value and date data
-    returns:
-        values - list of values
-    """
-    return [val['value'] for val in value_data]
-       
-def _pre_precip_day(value_data):
+def _mask_same_date(column):
     """
-    Pre- filter function for daily precipitation % that excludes 12-hour precipitation data
+    Mask for daily precipitation % that excludes 12-hour precipitation data
         that crosses a date (e.g., start=1/1/12 end=1/2/12)
     """
-    return [val['value'] for val in value_data if val['startDate'] == val['endDate']]
-
-def _pre_precip_night(value_data):
+    return column['startDate'] == column['endDate']
 
+def _mask_other_date(column):
     """
-    Pre- filter function for nightly precipitation % that excludes 12-hour precipitation data
+    Mask for nightly precipitation % that excludes 12-hour precipitation data
         that is on the same date (e.g., start=1/1/12 end=1/2/12)
     """
-    return [val['value'] for val in value_data if val['startDate'] != val['endDate']]
-
-def _pre_rain_amount(value_data):
-    """
-    Pre- filter for rain amount
-      Removes zero-length values and converts remaining to float and rounds to 2 decimals
-    """
-    return [round(float(val['value']), 2) for val in value_data if len(val['value'])]
+    return column['startDate'] != column['endDate']
 
-def _pre_snow_amount(value_data):
+def _mask_daytime(column):
     """
-    Pre- filter for snow amount
-        Removes zero-length values and converts remaining to float and rounds to 1 decimal
+    Mask for weather that skips weather between 6PM and 6AM so we get daytime conditions
     """
-    return [round(float(val['value']), 1) for val in value_data if len(val['value'])]
+    return (column['startTime'] >= '06:00:00') & (column['startTime'] <= '18:00:00')
 
-def _pre_weather(value_data):
+def _mask_wsym(column):
     """
-    Pre- filter for weather that skips weather between 6PM and 6AM so we get daytime conditions
+    Mask for weather symbols, skips if empty or does not contain path
     """
-    return [val['value'] for val in value_data if val['startTime'] >= '06:00:00' and val['startTime'] <= '18:00:00']
+    return np.char.find(column['values'].astype(str), '/') != -1
 
-def _pre_wsym(value_data):
+def _format_wind(value):
     """
-    Pre- filter for weather symbols, skips if empty or does not contain path
+    Format function for wind, convert from knots to MPH
     """
-    return [val['value'] for val in value_data if len(val['value']) and val['value'].find('/') != -1]
+    if value is None or value == '':
+        return ''
+    return "%.1f" % round(float(value) * 1.15077945, 1) # convert from knots to MPH
 
-def _format_wind(value):
+def _format_wind_array(numbers):
     """
-    Format function for wind, convert from knots to MPH
+    Format an array of wind speeds in knots as MPH strings, see _format_wind
     """
-    return "%.1f" % round(float(value) * 1.15077945, 1) if value else '' # convert from knots to MPH
+    formatted = np.char.mod("%.1f", np.round(numbers * 1.15077945, 1)).astype(object)
+    formatted[np.isnan(numbers)] = ''
+    return formatted
 
 def _format_weather(value):
     """
@@ -380,21 +513,25 @@ def _format_wsym(value):
 # Parsing configuration
 # Includes:
 #   DWML NOAA code - required
-#   aggregator: determines how to aggregate the data - required
-#   pre-filter: method that takes values as arguments and returns values that should be aggregated
+#   aggregator: how to aggregate the values of a day - required for daily data.
+#       'first', 'sum', 'average' and 'max' are computed as vectorized grouped
+#       reductions; a function is applied to each day's list of values
+#   mask: method that takes a parameter's columns and returns a boolean array
+#       of the values that should be aggregated
+#   decimals: round numeric values to this many decimals before aggregating
 #   formatter: method that applies formatting to resulting aggregated value
 _daily_config = {
-    'high': {'code': 'maxt', 'aggregator': _first},
-    'low': {'code': 'mint', 'aggregator': _first},
-    'precip_day': {'code': 'pop12', 'aggregator': _first, 'pre_filter': _pre_precip_day},
-    'precip_night': {'code': 'pop12', 'aggregator': _first, 'pre_filter': _pre_precip_night},
-    'rain_amount': {'code': 'qpf', 'aggregator': sum, 'pre_filter': _pre_rain_amount},
-    'snow_amount': {'code': 'snow', 'aggregator': sum, 'pre_filter': _pre_snow_amount},
-    'humidity': {'code': 'rhm', 'aggregator': _average},
-    'wind_gust': {'code': 'wgust', 'aggregator': max, 'formatter': _format_wind},
-    'wind_sustained': {'code': 'wspd', 'aggregator': _average, 'formatter': _format_wind},
-    'weather': {'code': 'wx', 'aggregator': _first_nonempty, 'pre_filter': _pre_weather, 'formatter': _format_weather},
-    'symbol': {'code': 'sym', 'aggregator': _frequent_sym, 'pre_filter': _pre_wsym, 'formatter': _format_wsym}
+    'high': {'code': 'maxt', 'aggregator': 'first'},
+    'low': {'code': 'mint', 'aggregator': 'first'},
+    'precip_day': {'code': 'pop12', 'aggregator': 'first', 'mask': _mask_same_date},
+    'precip_night': {'code': 'pop12', 'aggregator': 'first', 'mask': _mask_other_date},
+    'rain_amount': {'code': 'qpf', 'aggregator': 'sum', 'decimals': 2},
+    'snow_amount': {'code': 'snow', 'aggregator': 'sum', 'decimals': 1},
+    'humidity': {'code': 'rhm', 'aggregator': 'average'},
+    'wind_gust': {'code': 'wgust', 'aggregator': 'max', 'formatter': _format_wind},
+    'wind_sustained': {'code': 'wspd', 'aggregator': 'average', 'formatter': _format_wind},
+    'weather': {'code': 'wx', 'aggregator': _first_nonempty, 'mask': _mask_daytime, 'formatter': _format_weather},
+    'symbol': {'code': 'sym', 'aggregator': _frequent_sym, 'mask': _mask_wsym, 'formatter': _format_wsym}
 }
 
 _hourly_config = {
@@ -410,6 +547,9 @@ _hourly_config = {
     'symbol': {'code': 'sym', 'formatter': _format_wsym}
 }
 
+_daily_plan = _compile_plan(_daily_config)
+_hourly_plan = _compile_plan(_hourly_config)
+
 
 
 # Aggregate 3-hour values using a function
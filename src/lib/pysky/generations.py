@@ -0,0 +1,238 @@
+import errno
+import fcntl
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from pysky import metrics
+from pysky import utils
+
+# Lock file in each generation directory that processes sharing it hold a
+# shared lock on while pinned to it. It is created before the generation is
+# swapped in and only opened afterwards, so once removal has unlinked it no
+# process can pin the generation again.
+_pin_name = '.pins'
+
+class Generations(object):
+    """
+    Track the cube directory generations served through an ``active`` symlink
+
+    Readers pin the directory the symlink currently points at and run without
+    holding any lock. Swapping in a new generation only blocks for the
+    symlink replacement; the old generation is removed once the last reader
+    pinned to it has released it.
+
+    When several processes serve the same symlink, each pinned generation is
+    also locked with flock() for the other processes to see. The process that
+    swaps then only removes an old generation once no process holds it, and
+    retries the ones still held in sweep().
+    """
+
+    def __init__(self, active_path, shared=False):
+        """
+        args:
+            active_path - path of the ``active`` symlink
+            shared - whether other processes pin and swap generations of the
+                same symlink
+        """
+        self.active_path = active_path
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._readers = {} # pinned directory -> number of readers
+        self._pin_files = {} # pinned directory -> locked pin file descriptor, when shared
+        self._retired = {} # pinned directory -> path to remove once unpinned
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """
+        Register a function called with the new cube directory after every
+        swap
+        """
+        self._listeners.append(callback)
+
+    def current(self):
+        """ Directory the active symlink currently points at """
+        return os.path.realpath(self.active_path)
+
+    def acquire(self):
+        """
+        Pin the current generation. Every call must be matched by a call to
+        release() with the returned directory.
+
+        returns - pinned cube directory
+        """
+        start = time.time()
+        with self._lock:
+            while True:
+                data_dir = os.path.realpath(self.active_path)
+                count = self._readers.get(data_dir, 0)
+                if count or not self.shared or self._lock_pin(data_dir):
+                    break
+            metrics.observe('pysky_stage_seconds', time.time() - start, stage='pin_wait')
+            self._readers[data_dir] = count + 1
+        return data_dir
+
+    def release(self, data_dir):
+        """
+        Release a generation pinned with acquire(), removing it if it has been
+        retired and this was its last reader.
+
+        args:
+            data_dir - directory returned by acquire()
+        """
+        with self._lock:
+            count = self._readers.get(data_dir, 0) - 1
+            if count > 0:
+                self._readers[data_dir] = count
+                return
+            self._readers.pop(data_dir, None)
+            pin_fd = self._pin_files.pop(data_dir, None)
+            if pin_fd is not None:
+                os.close(pin_fd) # releases the shared lock
+        self._remove_retired(data_dir)
+
+    @contextmanager
+    def pin(self):
+        """ Context manager yielding the pinned cube directory """
+        data_dir = self.acquire()
+        try:
+            yield data_dir
+        finally:
+            self.release(data_dir)
+
+    def swap(self, new_data_dir):
+        """
+        Point the active symlink at a new generation and retire the old one
+
+        args:
+            new_data_dir - directory containing the new cube
+        """
+        self.prepare(new_data_dir)
+        with self._lock:
+            old_data_dir = os.path.realpath(self.active_path)
+            retired_path = old_data_dir
+            if os.path.isdir(self.active_path) and not os.path.islink(self.active_path):
+                # A plain directory is in the way of the symlink; move it
+                # aside so readers of it can finish before it is removed.
+                retired_path = '{0}.{1}'.format(self.active_path, os.getpid())
+                os.rename(self.active_path, retired_path)
+
+            tmp_link = '{0}.{1}.tmp'.format(self.active_path, os.getpid())
+            if os.path.lexists(tmp_link):
+                os.unlink(tmp_link)
+            os.symlink(new_data_dir, tmp_link)
+            os.rename(tmp_link, self.active_path) # atomic replace
+
+            if os.path.exists(retired_path) and retired_path != os.path.realpath(new_data_dir):
+                self._retired[old_data_dir] = retired_path
+        self._remove_retired(old_data_dir)
+        self.notify(new_data_dir)
+
+    def prepare(self, data_dir):
+        """
+        Create the pin file of a generation before processes sharing the
+        symlink can pin it. swap() does this for the new generation; call it
+        for a generation served before any swap, while no other process can
+        have retired it, e.g. before starting them.
+        """
+        if not self.shared:
+            return
+        try:
+            os.close(os.open(os.path.join(data_dir, _pin_name), os.O_RDONLY | os.O_CREAT, 0o644))
+        except OSError as e:
+            # Only pinned within each process, see _lock_pin()
+            utils.info("Cannot create the pin file of {0}: {1}".format(data_dir, e))
+
+    def notify(self, new_data_dir):
+        """
+        Call the subscribed functions with a new cube directory. swap() does
+        this; processes sharing the symlink call it when told of a swap made
+        by another process.
+        """
+        for callback in self._listeners:
+            callback(new_data_dir)
+
+    def sweep(self):
+        """
+        Remove retired generations that are no longer pinned. Only needed
+        when shared, as a generation still pinned by another process when it
+        is retired or released here is left in place.
+        """
+        with self._lock:
+            retired = list(self._retired)
+        for data_dir in retired:
+            self._remove_retired(data_dir)
+
+    def _remove_retired(self, data_dir):
+        """ Remove a retired generation unless a reader is pinned to it """
+        with self._lock:
+            path = self._retired.get(data_dir)
+            if path is None or self._readers.get(data_dir, 0):
+                return
+            if self.shared and not _unpin(path):
+                return
+            del self._retired[data_dir]
+        _remove(path)
+
+    def _lock_pin(self, data_dir):
+        """
+        Take a shared lock on the pin file of a generation for this process
+
+        returns - False if the generation was retired meanwhile, so the
+            active symlink has to be read again
+        """
+        path = os.path.join(data_dir, _pin_name)
+        try:
+            pin_fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                return True # e.g. unreadable; only pinned within this process
+            # Unpinned by its removal, unless the symlink still points here
+            # at a generation that was never prepared
+            return os.path.realpath(self.active_path) == data_dir
+        fcntl.flock(pin_fd, fcntl.LOCK_SH)
+        try:
+            # Removal unlinks the pin file under an exclusive lock first
+            if os.fstat(pin_fd).st_ino == os.stat(path).st_ino:
+                self._pin_files[data_dir] = pin_fd
+                return True
+        except OSError:
+            pass
+        os.close(pin_fd)
+        return False
+
+def generation(data_dir):
+    """
+    Identifier of the generation a cube directory belongs to: the name of the
+    directory the path resolves to
+    """
+    return os.path.basename(os.path.realpath(data_dir))
+
+def _unpin(path):
+    """
+    Make sure no process holds a generation directory, and that none can pin
+    it from now on
+
+    returns - False if a process still holds it
+    """
+    pin_path = os.path.join(path, _pin_name)
+    try:
+        pin_fd = os.open(pin_path, os.O_RDONLY)
+    except OSError:
+        return True # already unpinned, or never swapped in
+    try:
+        try:
+            fcntl.flock(pin_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return False
+        os.unlink(pin_path)
+        return True
+    finally:
+        os.close(pin_fd)
+
+def _remove(path):
+    """ Remove a retired generation directory """
+    utils.info("Removing retired generation {0}".format(path))
+    shutil.rmtree(path, ignore_errors=True)
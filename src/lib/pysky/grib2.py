@@ -1,12 +1,84 @@
+import threading
+from collections import OrderedDict
+
+from pysky import metrics
 from pysky import utils
 
-# Base URL for downloading grib2 files
+# Base URL for downloading grib2 files and the params downloaded, by default;
+# download() takes them per call, see sectors.Sector
 base_url = 'http://weather.noaa.gov/pub/SL.us008001/ST.opnl/DF.gr2/DC.ndfd/AR.conus'
 noaa_params = ['maxt', 'temp', 'mint', 'pop12', 'sky', 'wspd', 'apt', 'qpf', 'snow', 'wx', 'wgust', 'icons', 'rhm']
 
-# Degrib path
-degrib_path = '/usr/local/bin/degrib'
-geodata_path = None
+# Elements included in the glance product
+_glance_elements = ['maxt', 'mint', 'sky', 'wx']
+
+# Name of the manifest of downloaded files kept in each data directory
+_manifest_name = 'manifest.json'
+
+# Directory of degrib's per-param cubes in each data directory
+cubes_name = 'cubes'
+
+# Projection and bounds of a generation's grids, see grid_info()
+grid_info_name = 'grid.json'
+
+# ioctl request to clone a file's extents (linux/fs.h)
+_FICLONE = 0x40049409
+
+# Set in threads running queries for prewarm(), which are not counted
+_prewarming = threading.local()
+
+# Grids read in-process by pinned generation directory, None for those
+# without them, and degrib's cube indexes, so each generation is only looked
+# at once, see _grids() and cube_indexes()
+_grids_by_dir = OrderedDict()
+_indexes_by_dir = OrderedDict()
+_grids_lock = threading.Lock()
+_max_grids = 4
+
+class Config(object):
+    """
+    How degrib is run and point queries are served. Functions that run
+    degrib or serve point queries take one explicitly; the sectors of a
+    server share one, see sectors.Sector.
+    """
+
+    def __init__(self, degrib_path='/usr/local/bin/degrib', geodata_path=None, download_threads=4,
+            convert_threads=4, pool=None, cache=None, flights=None, flight_timeout=30, hotspots=None,
+            max_shared=4 * 1024 * 1024):
+        """
+        args:
+            degrib_path - degrib executable
+            geodata_path - degrib geodata directory, or None for geodata/ in
+                each data directory
+            download_threads - number of files downloaded concurrently, each
+                over its own keep-alive connection
+            convert_threads - number of degrib runs at once while converting
+                grids for the in-process reader, see cube.convert()
+            pool - optional degrib_pool.DegribPool used to run point queries.
+                When None, each query starts its own degrib process.
+            cache - optional cache.ResponseCache of point query responses,
+                keyed by generation and grid cell
+            flights - optional singleflight.SingleFlight coalescing identical
+                concurrent point queries
+            flight_timeout - seconds a coalesced query waits for the one
+                running
+            hotspots - optional hotspots.Hotspots counting point queries by
+                cache key, so the most requested ones can be computed for a
+                new generation before it is served, see prewarm()
+            max_shared - bytes of a cacheable point query response collected
+                for the cache and for identical queries, past which the rest
+                is passed through, see _stream()
+        """
+        self.degrib_path = degrib_path
+        self.geodata_path = geodata_path
+        self.download_threads = download_threads
+        self.convert_threads = convert_threads
+        self.pool = pool
+        self.cache = cache
+        self.flights = flights
+        self.flight_timeout = flight_timeout
+        self.hotspots = hotspots
+        self.max_shared = max_shared
 
 def download_command_line():
     """ Handle download from command-line """
@@ -29,7 +101,33 @@ def download_command_line():
     utils.verbose = options.verbose
     download(options.grib2_dir)
 
-def download(data_dir, new_data_dir=None):
+class Progress(dict):
+    """
+    Progress of a download, updated in place while it runs: the current
+    phase, bytes fetched, files checked and changed, seconds spent per phase
+    and the results of the last recent_files remote file checks (path, HTTP
+    status, bytes and seconds), oldest first
+    """
+
+    recent_files = 20
+
+    def __init__(self):
+        dict.__init__(self, phase=None, bytes=0, files_checked=0, files_changed=0, timings={}, files=[])
+        self._phase_started = None
+
+    def phase(self, name):
+        """ Enter a new phase, adding the time spent in the previous one """
+        import time
+
+        now = time.time()
+        if self['phase']:
+            timings = self['timings']
+            timings[self['phase']] = round(timings.get(self['phase'], 0) + now - self._phase_started, 3)
+            metrics.observe('pysky_refresh_phase_seconds', now - self._phase_started, phase=self['phase'])
+        self['phase'] = name
+        self._phase_started = now
+
+def download(data_dir, new_data_dir=None, progress=None, source_url=None, params=None, grids=True, config=None):
     """
     Download grib2 files to data directory
 
@@ -39,128 +137,321 @@ def download(data_dir, new_data_dir=None):
                      created if files are downloaded. You may remove the
                      old data_dir after calling this function. Pass
                      None to indicate files shall be updated in-place.
+        progress     Optional Progress, updated in place as the download
+                     runs
+        source_url   URL of the sector directory to download from, or None
+                     for base_url
+        params       List of params to download, 'ALL', or None for
+                     noaa_params
+        grids        Whether to convert the grids for the in-process
+                     reader. Grids that are not Lambert conformal are
+                     never converted, see _cube().
+        config       Config, or None for the defaults
     returns:
         True if new files were downloaded, False otherwise
     """
-    import urllib2, re, os, sys, time, urllib2, dateutil, shutil
-    from datetime import datetime
-    from dateutil import tz
-    from dateutil.parser import parse
+    import re, os, shutil
+    from pysky import fetch
 
     if not new_data_dir:
         new_data_dir = data_dir
+    if progress is None:
+        progress = Progress()
+    if config is None:
+        config = Config()
+    if params is None:
+        params = noaa_params
 
     files_downloaded = False # whether files have been downloaded
 
     files_to_copy = []
+    changed_params = set() # params with a downloaded .bin file
+
+    connections = fetch.ConnectionPool(source_url or base_url, config.download_threads)
 
     # Loop over directories that have forecast data files
+    new_listings = [] # (new, old) ls-l paths of listings that changed
     for dir in ['VP.001-003','VP.004-007']: # loop over remote directories
 
-        new_data_subdir = "{0}/{1}".format(new_data_dir, dir)
-
+        progress.phase('checking')
         utils.info('\nChecking directory {0}'.format(dir))
 
         # To save time, first check to see whether the directory listing file
-        # itself was updated.
+        # itself was updated. It is only sent if it was, and then saved to the
+        # new directory.
         check_local_path = "{0}/{1}/{2}".format(data_dir, dir, "ls-l")
         save_local_path = "{0}/{1}/{2}".format(new_data_dir, dir, "ls-l")
-        ls_local_time = os.stat(check_local_path).st_mtime if os.path.exists(check_local_path) else 0
+        ls_local_time = os.stat(check_local_path).st_mtime if os.path.exists(check_local_path) else None
         utils.info("Local: {0} last modified {1}".format(check_local_path, ls_local_time))
 
-        ls_request = urllib2.urlopen("{0}/{1}/ls-l".format(base_url, dir))
-        last_modified_str = ls_request.info()['Last-Modified']
-        ls_remote_time = _utc2local(parse(last_modified_str))
-        utils.info("Remote: {0} last modified {1}".format("ls-l", ls_remote_time))
-
-        # If it was, download it and save it to the new directory
-        ls_downloaded = False
-        if not os.path.exists(check_local_path) or ls_local_time < ls_remote_time:
-            ls_downloaded = True
-            utils.info("Saving new ls-l file")
-            if not os.path.exists(new_data_subdir):
-                os.makedirs(new_data_subdir)
-            _download_file(ls_request, save_local_path)
-            os.utime(save_local_path, (ls_remote_time, ls_remote_time))
+        result = connections.fetch("{0}/ls-l".format(dir), save_local_path, ls_local_time)
+        _report(progress, result)
+
+        # The manifest of files we have locally, from the previous listing
+        old_manifest = _load_manifest("{0}/{1}".format(data_dir, dir))
+
+        if result['status'] != 200:
+            # If not updated, remember the listing and all files to be copied
+            # into new directory later if needed
+            utils.info('Listing is up-to-date, skipping directory')
+            names = ['ls-l'] + [name for name in sorted(old_manifest) if _wanted(name, params)]
+            if os.path.exists("{0}/{1}/{2}".format(data_dir, dir, _manifest_name)):
+                names.append(_manifest_name)
+            for name in names:
+                files_to_copy.append(("{0}/{1}/{2}".format(data_dir, dir, name), "{0}/{1}/{2}".format(new_data_dir, dir, name)))
+            continue
+
+        utils.info("Saved new ls-l file")
+        _set_mtime(save_local_path, result['last_modified'])
+        new_listings.append((save_local_path, check_local_path))
+
+        # Diff the new listing against the manifest: only files whose size or
+        # timestamp changed are downloaded
+        manifest = {}
+        jobs = []
+        for filename, entry in sorted(_parse_listing(save_local_path).items()):
+
+            # Only download files if we are interested in this parameter
+            if _wanted(filename, params):
+                manifest[filename] = entry
+                check_local_path = "{0}/{1}/{2}".format(data_dir, dir, filename)
+                save_local_path = "{0}/{1}/{2}".format(new_data_dir, dir, filename)
+                if old_manifest.get(filename) == entry and os.path.exists(check_local_path):
+                    files_to_copy.append((check_local_path, save_local_path))
+                    utils.info('Local file {0} is up-to-date, skipping download'.format(filename))
+                else:
+                    jobs.append(("{0}/{1}".format(dir, filename), save_local_path, None))
+
+        progress.phase('downloading')
+        for (path, save_local_path, _), result in zip(jobs, fetch.fetch_all(connections, jobs)):
+            _report(progress, result)
+            _set_mtime(save_local_path, result['last_modified'])
+            changed_params.add(_param(path))
+            progress['files_changed'] += 1
             files_downloaded = True
-            ls_file = save_local_path
-        else: # If not, remember it to be copied into new directory later if needed
-            files_to_copy.append((check_local_path, save_local_path))
-            ls_file = check_local_path
-
-        # Loop over each file in the directory listing
-        for line in open(ls_file):
-            # Check file modified date if this is a .bin file
-            if line.find(".bin") != -1:
- 
-                # Split line to get date and filename
-                month, day, rtime, filename = re.split("\s+", line)[5:9]
- 
-                # Split filename to get noaa param name
-                param = filename.split('.')[1]
- 
-                # Only download files if we are interested in this parameter
-                if noaa_params == 'ALL' or param in noaa_params:
- 
-                    # Local path and time
-                    check_local_path = "{0}/{1}/{2}".format(data_dir, dir, filename)
-                    save_local_path = "{0}/{1}/{2}".format(new_data_dir, dir, filename)
-
-                    if ls_downloaded: # Only bother checking if we downloaded a new ls file
-                        local_time = os.stat(check_local_path).st_mtime if os.path.exists(check_local_path) else 0
-                        utils.info("Local: {0} last modified {1}".format(check_local_path, local_time))
- 
-                        # Remote path and time
-                        remote_path = "{0}/{1}/{2}".format(base_url, dir, filename)
-                        request = urllib2.urlopen(remote_path)
-                        last_modified_str = request.info()['Last-Modified']
-                        remote_time = _utc2local(parse(last_modified_str))
-                        utils.info("Remote: {0} last modified {1}".format(remote_path, remote_time))
- 
-		        # If file does not exist or the local file is older than the remote file, download
-                        if not os.path.exists(check_local_path) or local_time < remote_time:
-                            utils.info('Downloading remote file {0}'.format(remote_path))
-                            _download_file(request, save_local_path)
-                            os.utime(save_local_path, (remote_time, remote_time))
-                            files_downloaded = True
-                        else: # Otherwise, remember this file for if it needs to be copied later
-                            files_to_copy.append((check_local_path, save_local_path))
-                            utils.info('Local file is up-to-date, skipping download')
-                    else: # ls was not downloaded, so just remember the files for later copying if needed
-                        files_to_copy.append((check_local_path, save_local_path))
-                        utils.info('Local file is up-to-date, skipping download')
-                    
+
+        _write_manifest("{0}/{1}".format(new_data_dir, dir), manifest)
+
+    connections.close()
+
+    if not files_downloaded and new_listings and data_dir != new_data_dir:
+        # Only the listings changed: keep them with the current data so the
+        # next check is conditional on them, and drop the new directory
+        for new_path, old_path in new_listings:
+            new_dir, old_dir = os.path.dirname(new_path), os.path.dirname(old_path)
+            if os.path.isdir(old_dir):
+                os.rename(new_path, old_path)
+                os.rename("{0}/{1}".format(new_dir, _manifest_name), "{0}/{1}".format(old_dir, _manifest_name))
+        shutil.rmtree(new_data_dir, ignore_errors=True)
+
     # Cube data files if any were downloaded
     if files_downloaded:
         if data_dir != new_data_dir:
-            # Copy the files remembered earlier into the new data directory
+            # Link the files remembered earlier into the new data directory
+            progress.phase('linking')
             for src, dst in files_to_copy:
                 dst_dir = os.path.dirname(dst)
                 if not os.path.exists(dst_dir):
                     os.makedirs(dst_dir)
-                shutil.copy2(src, dst)
-                utils.info("copied {0} to {1}".format(src, dst))
-
-        cmd = "{degrib} {data_dir}/VP.001-003/*.bin {data_dir}/VP.004-007/*.bin -Data -Index {data_dir}/all.ind -out {data_dir}/all.dat".format(
-            degrib = degrib_path,
-            data_dir = new_data_dir
-        )
-        utils.info(cmd)
-        output = ""
-        for line in os.popen(cmd).readlines():
-            output += line
-        utils.info(output)
+                method = _link_or_copy(src, dst)
+                utils.info("{0} {1} to {2}".format(method, src, dst))
+
+        progress.phase('cubing')
+        _cube(config, data_dir, new_data_dir, changed_params, grids)
     else:
         utils.info('No files downloaded - skipping cube')
+    progress.phase('done')
     return files_downloaded
 
-def xml(data_dir, latitude, longitude, elements=None, product='time-series', begin=None, end=None):
+def _cube(config, data_dir, new_data_dir, changed_params, grids=True):
+    """
+    Cube the .bin files of a data directory for degrib, and convert them for
+    the in-process reader. degrib probes its own cubes, one per param in
+    cubes/{param}.ind and cubes/{param}.dat, see cube_indexes(). Only the
+    cubes of params whose .bin files changed are built again, by one degrib
+    -Data run each; the others are carried over from the old data
+    directory. The grids read in-process are converted per param meanwhile,
+    see _convert(), if they are Lambert conformal; other projections are
+    detected from degrib's metadata of the first .bin file and only cubed
+    for degrib. The projection and bounds of the grids are saved with them,
+    see grid_info().
+
+    args:
+        config - Config
+        data_dir - Old directory containing existing data files and cubes
+        new_data_dir - Directory to cube, may be the same as data_dir
+        changed_params - set of params whose .bin files were downloaded
+        grids - whether to convert the grids for the in-process reader too
+    raises - DegribError if degrib fails
+    """
+    import glob, os
+    from pysky import cube
+
+    bin_paths = sorted(glob.glob("{0}/VP.*/ds.*.bin".format(new_data_dir)))
+    params = sorted(set(_param(path) for path in bin_paths))
+    cubes_dir = "{0}/{1}".format(new_data_dir, cubes_name)
+    if not os.path.exists(cubes_dir):
+        os.makedirs(cubes_dir)
+
+    builds = []
+    for param in params:
+        old_cube = "{0}/{1}/{2}".format(data_dir, cubes_name, param)
+        cube_files = [old_cube + '.ind', old_cube + '.dat']
+        if param not in changed_params and all(os.path.exists(path) for path in cube_files):
+            if data_dir != new_data_dir:
+                for path in cube_files:
+                    _link_or_copy(path, "{0}/{1}{2}".format(cubes_dir, param, path[-4:]))
+            utils.info("Cube of {0} is up-to-date, skipping".format(param))
+            continue
+        # Named relative to the cubes directory, so each index refers to
+        # its data file by name and both can be carried over as they are
+        args = [config.degrib_path] + [os.path.relpath(path, cubes_dir) for path in bin_paths if _param(path) == param]
+        args += ["-Data", "-Index", param + ".ind", "-out", param + ".dat"]
+        builds.append(args)
+    errors = []
+
+    def build():
+        try:
+            for args in builds:
+                utils.info(" ".join(args))
+                utils.info(cube.run_degrib(args, cubes_dir))
+        except Exception as e:
+            errors.append(e)
+
+    builder = threading.Thread(target=build)
+    builder.daemon = True
+    builder.start()
+    try:
+        if bin_paths:
+            fields = cube.grid_metadata(bin_paths[0], config.degrib_path)
+            try:
+                _save_grid_info(new_data_dir, fields)
+            except ValueError as e:
+                utils.info("Not saving the bounds of {0}: {1}".format(new_data_dir, e))
+            if grids and cube.metadata_grid(fields) is None:
+                utils.info("Grids of {0} are {1}, not Lambert conformal; not converting them".format(
+                    new_data_dir, fields.get('Projection Type', 'of unknown projection')))
+                grids = False
+        if grids:
+            _convert(config, data_dir, new_data_dir, params, changed_params)
+    finally:
+        builder.join()
+    if errors:
+        raise errors[0]
+
+def grid_info(config, data_dir):
+    """
+    Projection and bounds of the grids of a generation, saved when it was
+    cubed. Generations cubed before they were saved are read from degrib's
+    metadata of their first .bin file, and saved then.
+
+    returns - dictionary of 'projection', the GDS projection type, and
+        'bounds', the (south, west, north, east) box covering the grids, see
+        cube.metadata_bounds(); None if the generation has no .bin files
+    raises - DegribError if degrib fails, ValueError if the projection has
+        no bounds
+    """
+    import glob, json, os
+    from pysky import cube
+
+    path = "{0}/{1}".format(data_dir, grid_info_name)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    bin_paths = sorted(glob.glob("{0}/VP.*/ds.*.bin".format(data_dir)))
+    if not bin_paths:
+        return None
+    return _save_grid_info(data_dir, cube.grid_metadata(bin_paths[0], config.degrib_path))
+
+def _save_grid_info(data_dir, fields):
+    """ Save the grid_info() of a generation from its degrib grid metadata """
+    import json, os
+    from pysky import cube
+
+    info = {'projection': fields.get('Projection Type'), 'bounds': list(cube.metadata_bounds(fields))}
+    path = "{0}/{1}".format(data_dir, grid_info_name)
+    tmp_path = '{0}.{1}.part'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        utils.info("Cannot save {0}: {1}".format(path, e))
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return info
+
+def cube_indexes(data_dir):
+    """
+    degrib's cube indexes of a pinned generation directory, one per param,
+    which point probes read together. Generations cubed before cubes were
+    built per param have a single all.ind. Looked up once per generation.
+
+    returns - list of index paths, [] if the generation has not been cubed
+    """
+    import glob, os
+
+    with _grids_lock:
+        if data_dir in _indexes_by_dir:
+            return _indexes_by_dir[data_dir]
+    indexes = sorted(glob.glob("{0}/{1}/*.ind".format(data_dir, cubes_name)))
+    if not indexes and os.path.exists("{0}/all.ind".format(data_dir)):
+        indexes = ["{0}/all.ind".format(data_dir)]
+    if indexes:
+        with _grids_lock:
+            _indexes_by_dir[data_dir] = indexes
+            while len(_indexes_by_dir) > _max_grids:
+                _indexes_by_dir.popitem(last=False)
+    return indexes
+
+def _convert(config, data_dir, new_data_dir, params, changed_params):
+    """
+    Convert the .bin files of a data directory into the grids read
+    in-process, see cube.convert(). Each param is converted into its own
+    segment, rasters/{param}.idx and rasters/{param}.f32, and rasters.idx
+    unions the segments. Only segments whose .bin files changed are
+    converted again; the others are carried over from the old data
+    directory.
+
+    args:
+        config - Config
+        data_dir - Old directory containing existing data files and segments
+        new_data_dir - Directory to convert, may be the same as data_dir
+        params - params to convert
+        changed_params - set of params whose .bin files were downloaded
+    """
+    import glob, os
+    from pysky import cube
+
+    segment_dir = "{0}/{1}".format(new_data_dir, cube.segments_name)
+    if not os.path.exists(segment_dir):
+        os.makedirs(segment_dir)
+
+    for param in params:
+        old_segment = "{0}/{1}/{2}".format(data_dir, cube.segments_name, param)
+        new_segment = "{0}/{1}".format(segment_dir, param)
+        segment_files = [old_segment + '.idx', old_segment + '.f32']
+        if param not in changed_params and all(os.path.exists(path) for path in segment_files):
+            if data_dir != new_data_dir:
+                for path in segment_files:
+                    _link_or_copy(path, new_segment + path[-4:])
+            utils.info("Grids of {0} are up-to-date, skipping conversion".format(param))
+            continue
+        utils.info("Converting grids of {0}".format(param))
+        cube.convert(sorted(glob.glob("{0}/VP.*/ds.{1}.bin".format(new_data_dir, param))),
+            new_segment + '.idx', new_segment + '.f32', config.degrib_path, config.convert_threads)
+
+    cube.merge_indexes("{0}/{1}".format(new_data_dir, cube.index_name),
+        ["{0}/{1}.idx".format(segment_dir, param) for param in params])
+
+def xml(config, data_dir, latitude, longitude, elements=None, product='time-series', begin=None, end=None):
     """
     Generate XML file from grib2 data cube. Arguments are similar to what is
     expected in the NWS NDFD REST API for the ndfdXMLclient.php interface:
     http://graphical.weather.gov/xml/rest.php
 
     args:
+        config - Config (required)
         data_dir - Directory where grib2 data cube is located (required)
         latitude - Latitude (required)
         longitude - Longitude (required)
@@ -171,44 +462,43 @@ def xml(data_dir, latitude, longitude, elements=None, product='time-series', beg
 
     returns - xml string
     """
+    return b''.join(xml_stream(config, data_dir, latitude, longitude, elements, product, begin, end))
 
-    import os
+def xml_stream(config, data_dir, latitude, longitude, elements=None, product='time-series', begin=None, end=None):
+    """
+    Generate XML from grib2 data cube as it is produced. Arguments are the
+    same as for xml().
 
-    geodata = geodata_path if geodata_path else data_dir + '/geodata'
+    returns - generator of xml string chunks
+    """
+    key = cache_key(config, data_dir, latitude, longitude, product,
+        tuple(elements) if elements else None, begin, end, None)
+    track(config, key, ('xml', latitude, longitude, elements, product, begin, end))
 
-    # build and execute command
-    cmd = "{degrib_path} {data_dir}/all.ind -DP -pnt {latitude},{longitude} -geoData {geodata}".format(
-        degrib_path=degrib_path, data_dir=data_dir,
-        latitude=latitude, longitude=longitude,
-        geodata=geodata)
+    # build command
+    args = _point_args(config, data_dir, latitude, longitude)
     if product == "time-series":
-        cmd += " -XML 1"
+        args += ["-XML", "1"]
         if elements:
-            cmd += " -ndfdConven 1 -ndfdVars " + ",".join(elements)
+            args += ["-ndfdConven", "1", "-ndfdVars", ",".join(elements)]
     elif product == "glance":
-        cmd += " -XML 2"
+        args += ["-XML", "2"]
 
     if begin:
-        cmd += " -startTime " + begin
+        args += ["-startTime", begin]
     if end:
-        cmd += " -endTime " + end
-
-    utils.info(cmd)
-    xml = ""
-    for line in os.popen(cmd).readlines():
+        args += ["-endTime", end]
 
-        xml += line
+    return _stream(config, args, key)
 
-    # return output
-    return xml
-
-def xml_byday(data_dir, latitude, longitude, format='12 hourly'):
+def xml_byday(config, data_dir, latitude, longitude, format='12 hourly'):
     """
     Generate XML file from grib2 data cube. Arguments are similar to what is
     expected in the NWS NDFD REST API for the ndfdBrowserClientByDay.php interface:
     http://graphical.weather.gov/xml/rest.php
 
     args:
+        config - Config (required)
         data_dir - Directory where grib2 data cube is located (required)
         latitude - Latitude (required)
         longitude - Longitude (required)
@@ -216,57 +506,636 @@ def xml_byday(data_dir, latitude, longitude, format='12 hourly'):
 
     returns - xml string
     """
+    return b''.join(xml_byday_stream(config, data_dir, latitude, longitude, format))
 
-    import os
+def xml_byday_stream(config, data_dir, latitude, longitude, format='12 hourly'):
+    """
+    Generate XML from grib2 data cube as it is produced. Arguments are the
+    same as for xml_byday().
 
-    geodata = geodata_path if geodata_path else data_dir + '/geodata'
+    returns - generator of xml string chunks
+    """
+    key = cache_key(config, data_dir, latitude, longitude, 'byday', None, None, None, format)
+    track(config, key, ('byday', latitude, longitude, format))
 
-    # build and execute command
-    cmd = "{degrib_path} {data_dir}/all.ind -DP -pnt {latitude},{longitude} -geoData {geodata}".format(
-        degrib_path=degrib_path, data_dir=data_dir,
-        latitude=latitude, longitude=longitude,
-        geodata=geodata)
+    # build command
+    args = _point_args(config, data_dir, latitude, longitude)
     if format == "12 hourly":
-        cmd += " -XML 3"
+        args += ["-XML", "3"]
     elif format == "24 hourly":
-        cmd += " -XML 4"
+        args += ["-XML", "4"]
+
+    return _stream(config, args, key)
+
+def _point_args(config, data_dir, latitude, longitude):
+    """ degrib argument list for a point probe of the data cubes """
+    geodata = config.geodata_path if config.geodata_path else data_dir + '/geodata'
+    return [config.degrib_path] + cube_indexes(data_dir) + ["-DP",
+        "-pnt", "{0},{1}".format(latitude, longitude), "-geoData", geodata]
+
+def batch(data_dir, points, elements=None, product='time-series', begin=None, end=None, chunk_size=1024):
+    """
+    Read value time series for many points straight from the grib2 data
+    cube. Points falling in the same grid cell are read once, and each chunk
+    of distinct cells is read in a single pass over the cube.
+
+    args:
+        data_dir - Directory where grib2 data cube is located (required)
+        points - list of (latitude, longitude) tuples (required)
+        elements - List of NDFD element codes, or None to return all params
+        product - time-series or glance
+        begin - begin time (YYYY-MM-DDTHH:MM, UTC), or None
+        end - end time (YYYY-MM-DDTHH:MM, UTC), or None
+        chunk_size - number of distinct cells read per pass
+
+    returns - generator of (point index, latitude, longitude, cell, data)
+        tuples, where cell is the (i, j) grid cell or None if the point is
+        outside the grid and data is a values() dictionary or None. Points
+        are produced as soon as their chunk has been read, grouped by cell.
+    raises - IOError or ValueError if the cube cannot be read, before the
+        generator is returned
+    """
+    import calendar, time
+    from pysky import cube
+
+    data_cube = cube.open_cube(data_dir)
+    if product == 'glance':
+        elements = [e for e in (elements or _glance_elements) if e in _glance_elements]
+    begin = calendar.timegm(time.strptime(begin, '%Y-%m-%dT%H:%M')) if begin else None
+    end = calendar.timegm(time.strptime(end, '%Y-%m-%dT%H:%M')) if end else None
+
+    def generate():
+        # Snap all points at once, then group point indexes by grid cell
+        cell_points = {}
+        cells = []
+        if points:
+            latitudes, longitudes = zip(*points)
+            columns, rows, inside = data_cube.grid.cells(latitudes, longitudes)
+        for n, (latitude, longitude) in enumerate(points):
+            if not inside[n]:
+                yield n, latitude, longitude, None, None
+                continue
+            cell = (int(columns[n]), int(rows[n]))
+            if cell not in cell_points:
+                cell_points[cell] = []
+                cells.append(cell)
+            cell_points[cell].append(n)
+
+        for start in range(0, len(cells), chunk_size):
+            chunk = cells[start:start + chunk_size]
+            for cell, data in zip(chunk, data_cube.cells_series(chunk, elements, begin, end)):
+                for n in cell_points[cell]:
+                    yield n, points[n][0], points[n][1], cell, data
+
+    return generate()
+
+def subgrid(data_dir, bbox, elements=None, begin=None, end=None, step=1, format='raw'):
+    """
+    Read dense grids over a latitude/longitude box straight from the grib2
+    data cube, one per record, encoded for transfer
+
+    Formats:
+        raw - uint32 little-endian header length, the JSON header, then each
+              record's grid as little-endian float32 in header order
+        npy - a single NPY array shaped (records, rows, columns); the JSON
+              header is returned for the caller to send alongside
+
+    The JSON header describes the full grid, the window (first cell, size
+    and step), the records (element, unit, valid start and end as UTC epoch
+    seconds) and the value marking cells without data. Rows run south to
+    north.
+
+    args:
+        data_dir - Directory where grib2 data cube is located (required)
+        bbox - (south, west, north, east) in degrees (required)
+        elements - List of NDFD element codes, or None to return all params
+        begin - begin time (YYYY-MM-DDTHH:MM, UTC), or None
+        end - end time (YYYY-MM-DDTHH:MM, UTC), or None
+        step - read every step-th cell in both directions
+        format - raw or npy
+
+    returns - (header, generator of byte strings, total length in bytes), or
+        None if the box does not overlap the grid
+    """
+    import calendar, io, json, struct, time
+    import numpy as np
+    from pysky import cube
+
+    data_cube = cube.open_cube(data_dir)
+    grid = data_cube.grid
+    window = grid.window(*bbox)
+    if window is None:
+        return None
+    i0, j0, i1, j1 = window
+    step = max(int(step), 1)
+    nx = (i1 - i0) // step + 1
+    ny = (j1 - j0) // step + 1
 
-    utils.info(cmd)
-    xml = ""
-    for line in os.popen(cmd).readlines():
+    begin = calendar.timegm(time.strptime(begin, '%Y-%m-%dT%H:%M')) if begin else None
+    end = calendar.timegm(time.strptime(end, '%Y-%m-%dT%H:%M')) if end else None
+    records = data_cube.select(elements, begin, end)
 
-        xml += line
+    header = {
+        'grid': dict(zip(('nx', 'ny', 'lat1', 'lon1', 'orient_lon', 'latin1', 'latin2', 'dx', 'radius'),
+            grid.definition())),
+        'window': {'i': i0, 'j': j0, 'nx': nx, 'ny': ny, 'step': step},
+        'dtype': '<f4',
+        'missing': cube.MISSING,
+        'records': [{'element': r.element, 'unit': r.unit, 'start': r.start, 'end': r.end} for r in records]
+    }
+    if format == 'npy':
+        prefix = io.BytesIO()
+        np.lib.format.write_array_header_1_0(prefix,
+            {'descr': '<f4', 'fortran_order': False, 'shape': (len(records), ny, nx)})
+        prefix = prefix.getvalue()
+    else:
+        encoded = json.dumps(header).encode('utf-8')
+        prefix = struct.pack('<I', len(encoded)) + encoded
+
+    def generate():
+        yield prefix
+        for record in records:
+            values = data_cube.grid_values(record)[j0:j1 + 1:step, i0:i1 + 1:step]
+            yield np.ascontiguousarray(values).tobytes()
+
+    return header, generate(), len(prefix) + len(records) * ny * nx * 4
+
+def cache_key(config, data_dir, latitude, longitude, product, elements, begin, end, format):
+    """
+    Response cache key for a point query: the generation and grid cell the
+    point falls in, followed by the query parameters. Identical concurrent
+    queries are coalesced by the same key. Returns None when neither caching
+    nor coalescing is enabled or the point is outside the grid.
+
+    Generations without grids read in-process, as for sectors that are not
+    Lambert conformal, are keyed by the point itself instead of its cell.
+    So are generations whose grids cannot be read, see _grids().
+    """
+    from pysky.generations import generation
+
+    if config.cache is None and config.flights is None:
+        return None
+    query = (product, elements, begin, end, format)
+    grids = _grids(data_dir)
+    if grids is None:
+        return (generation(data_dir), 'point', latitude, longitude) + query
+    cell = grids.cell(latitude, longitude)
+    if cell is None:
+        return None
+    return (generation(data_dir), cell[0], cell[1]) + query
+
+def _grids(data_dir):
+    """
+    Grids read in-process of a pinned generation directory, or None if it
+    has none or they cannot be read. Each generation is looked at once;
+    grids that exist but cannot be read are reported then.
+
+    returns - cube.Cube or None
+    """
+    import errno
+    from pysky import cube
+
+    with _grids_lock:
+        if data_dir in _grids_by_dir:
+            return _grids_by_dir[data_dir]
+    try:
+        grids = cube.open_cube(data_dir)
+    except (IOError, OSError, ValueError) as e:
+        grids = None
+        if getattr(e, 'errno', None) != errno.ENOENT:
+            metrics.inc('pysky_grid_errors_total')
+            utils.info("Cannot read the grids of {0}, keying point queries by location: {1}".format(data_dir, e))
+    with _grids_lock:
+        _grids_by_dir[data_dir] = grids
+        while len(_grids_by_dir) > _max_grids:
+            _grids_by_dir.popitem(last=False)
+    return grids
+
+def track(config, key, query):
+    """
+    Count a point query in hotspots, by its cache key without the generation
+
+    args:
+        config - Config
+        key - cache key of the query, or None
+        query - tuple of the query kind, 'xml', 'byday' or 'forecast', and
+            the arguments after data_dir to run it again with
+    """
+    if key and config.hotspots is not None and not getattr(_prewarming, 'active', False):
+        config.hotspots.record(key[1:], query)
+
+def prewarm(config, data_dir, count, workers=2, group=None, where=None):
+    """
+    Run the most requested point queries against a new data cube, so their
+    responses are in the cache before it is served
+
+    args:
+        config - Config
+        data_dir - directory of the new grib2 data cube
+        count - number of queries to run, most requested first
+        workers - queries run at once, leaving the rest of the degrib pool
+            to requests meanwhile
+        group - cache group of the generation, see ResponseCache.invalidate()
+        where - optional function(latitude, longitude) selecting the queries
+            the data cube serves, e.g. those of its sector
+    returns - number of queries run
+    """
+    from collections import deque
+    from pysky.generations import generation
+
+    hotspots = config.hotspots
+    if hotspots is None or config.cache is None or count <= 0:
+        return 0
+    config.cache.allow(generation(data_dir), group)
+    queries = hotspots.top(hotspots.capacity if where else count)
+    if where:
+        queries = [query for query in queries if where(query[1], query[2])][:count]
+    queries = deque(queries)
+    total = len(queries)
+
+    def work():
+        _prewarming.active = True
+        while True:
+            try:
+                query = queries.popleft()
+            except IndexError:
+                return
+            try:
+                _replay(config, data_dir, query)
+            except Exception as e:
+                utils.info("Prewarming {0} failed: {1}".format(query, e))
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, total))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.inc('pysky_prewarmed_total', total)
+    return total
+
+def _replay(config, data_dir, query):
+    """ Run a query recorded by track() against a data cube """
+    from pysky import forecast
+
+    kind, query_args = query[0], query[1:]
+    if kind == 'xml':
+        xml(config, data_dir, *query_args)
+    elif kind == 'byday':
+        xml_byday(config, data_dir, *query_args)
+    elif kind == 'forecast':
+        forecast.forecast_json(config, data_dir, *query_args)
+
+def _stream(config, args, key):
+    """
+    Generator of degrib output chunks for a point query, served from the
+    response cache when possible. A complete response is added to the cache.
+    While an identical query is running, its response is waited for and
+    shared instead of running degrib again, unless that takes longer than
+    the config's flight_timeout.
+
+    A cacheable query is run to completion in a thread of its own, which
+    publishes the response whether or not the client reads it all; the
+    client is sent the chunks as that thread collects them. Responses are
+    only collected like this while the cache is enabled, and only up to
+    config.max_shared bytes; past that the rest is passed through to the client
+    and identical queries waiting on it run their own.
+
+    args:
+        config - Config
+        args - degrib argument list
+        key - response cache key, or None
+    """
+    from pysky import singleflight
+
+    cache, flights = config.cache, config.flights
+    if not key or cache is None:
+        for chunk in _run(config, args):
+            yield chunk
+        return
+
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    call = None
+    if flights is not None:
+        while True:
+            call, leader = flights.begin(key)
+            if leader:
+                break
+            try:
+                response = flights.wait(call, config.flight_timeout)
+            except singleflight.Abandoned:
+                continue # the query failed to complete; run it ourselves
+            except singleflight.Timeout:
+                utils.info("Identical query still running after {0}s, running it again".format(config.flight_timeout))
+                call = None
+                break
+            metrics.inc('pysky_coalesced_total')
+            yield response
+            return
+
+    tee = _Tee(config.max_shared)
+    thread = threading.Thread(target=_lead, args=(config, args, key, call, tee))
+    thread.daemon = True
+    thread.start()
+    for chunk in tee:
+        yield chunk
+
+def _lead(config, args, key, call, tee):
+    """
+    Run a cacheable query for _stream(), adding its output to a _Tee and
+    publishing the complete response to the cache and to followers. Once
+    the output outgrows the tee, followers are let go to run the query
+    themselves, and the query is stopped if its client has gone too.
+    """
+    from pysky import singleflight
+
+    flights = config.flights
+    chunks = _run(config, args)
+    try:
+        for chunk in chunks:
+            if not tee.put(chunk):
+                break
+            if tee.overflowed and call:
+                flights.finish(key, call, error=singleflight.Abandoned('Response too large to share'))
+                call = None
+    except Exception as e:
+        if call:
+            flights.finish(key, call, error=e)
+        tee.close(e)
+        return
+    except BaseException:
+        if call:
+            flights.finish(key, call, error=singleflight.Abandoned('Query was abandoned'))
+        tee.close(singleflight.Abandoned('Query was abandoned'))
+        raise
+    finally:
+        chunks.close()
+    if tee.overflowed:
+        tee.close()
+        return
+    response = b''.join(tee.chunks)
+    config.cache.put(key, response)
+    if call:
+        flights.finish(key, call, response)
+    tee.close()
+
+class _Tee(object):
+    """
+    Output chunks written by one thread and read, as they arrive, by another
+    that may stop reading at any time. All chunks are kept until they add up
+    to more than limit bytes; after that, chunks are dropped once read.
+    """
+
+    def __init__(self, limit):
+        self.chunks = []
+        self.overflowed = False
+        self._limit = limit
+        self._size = 0
+        self._read = 0 # chunks read, counting dropped ones
+        self._dropped = 0
+        self._reading = True
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
 
-    # return output
-    return xml
+    def put(self, chunk):
+        """ Add a chunk. Returns False once it is of no use to anyone. """
+        with self._cond:
+            self._size += len(chunk)
+            if self._size > self._limit:
+                self.overflowed = True
+            if self.overflowed:
+                if not self._reading:
+                    return False
+                del self.chunks[:self._read - self._dropped]
+                self._dropped = self._read
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+            return True
 
-def _utc2local(utc):
-    """ Convert utc datetime object to local datetime """
-    from dateutil import tz
+    def close(self, error=None):
+        """ Mark the output complete, or failed with an exception """
+        with self._cond:
+            self._error = error
+            self._closed = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._read - self._dropped == len(self.chunks) and not self._closed:
+                        self._cond.wait()
+                    if self._read - self._dropped < len(self.chunks):
+                        chunk = self.chunks[self._read - self._dropped]
+                        self._read += 1
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield chunk
+        finally:
+            with self._cond:
+                self._reading = False
+
+def _run(config, args):
+    """
+    Run degrib with an argument list, through the config's worker pool when
+    it has one
+
+    returns - generator of output chunks as degrib writes them
+    raises - DegribError, once the output has been read, if degrib failed or
+        wrote nothing
+    """
     import time
-    from_zone = tz.tzutc()
-    to_zone = tz.tzlocal()
-    utc = utc.replace(tzinfo = from_zone)
-    return time.mktime(utc.astimezone(to_zone).timetuple())
-
-def _download_file(request, local_path):
-    """ Download file given a urllib2 urlopen from remote path to local path """
-    import sys
-    content_length = int(request.info()['Content-Length'])
-    chunk_size = 8192
-
-    with open(local_path, 'wb') as f:
-        #next_percentage = 5.0
-        chunk = request.read(chunk_size)
-        downloaded = 0
-        while chunk:
-            f.write(chunk)
-            downloaded += chunk_size
-            #if (float(downloaded) / float(content_length)) * 100.0 > next_percentage:
-            #    sys.stdout.write("\r")
-            #    sys.stdout.write("{1}% complete {0}".format('#' * (int(next_percentage) / 5), int(next_percentage)))
-            #    next_percentage += 5.0
-            #    #sys.stdout.write('#')
-            #    sys.stdout.flush()
-            chunk = request.read(chunk_size)
-        #print('')
+    from pysky.degrib_pool import DegribError
+
+    utils.info(" ".join(args))
+    chunks = config.pool.stream(args) if config.pool else _spawn(args)
+
+    # Only time spent waiting on degrib is measured, not the time the
+    # consumer takes with each chunk
+    waited = 0.0
+    first_chunk = None
+    outcome = 'failed'
+    try:
+        while True:
+            now = time.time()
+            chunk = next(chunks, None)
+            waited += time.time() - now
+            if chunk is None:
+                break
+            if first_chunk is None:
+                first_chunk = waited
+            yield chunk
+        if first_chunk is None:
+            raise DegribError('{0} produced no output'.format(' '.join(args)))
+        outcome = 'ok'
+    except GeneratorExit:
+        outcome = 'abandoned'
+        raise
+    finally:
+        chunks.close()
+        if first_chunk is None:
+            first_chunk = waited
+        metrics.observe('pysky_stage_seconds', first_chunk, stage='degrib_spawn')
+        metrics.observe('pysky_stage_seconds', waited - first_chunk, stage='degrib_read')
+        metrics.observe('pysky_stage_seconds', waited, stage='degrib_run')
+        metrics.inc('pysky_degrib_runs_total', outcome=outcome)
+
+def _spawn(args):
+    """
+    Run degrib in a new process, yielding its output chunks
+
+    raises - DegribError once the output has been read if degrib exited with
+        an error or was killed by a signal
+    """
+    import os, subprocess
+    from pysky.degrib_pool import DegribError
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, close_fds=True)
+    try:
+        while True:
+            chunk = os.read(process.stdout.fileno(), 65536)
+            if not chunk:
+                break
+            yield chunk
+        status = process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+    if status:
+        raise DegribError('{0} exited with status {1}'.format(' '.join(args), status))
+
+def values(data_dir, latitude, longitude, elements=None):
+    """
+    Read the value time series for a point straight from the grib2 data cube,
+    without running degrib
+
+    args:
+        data_dir - Directory where grib2 data cube is located (required)
+        latitude - Latitude (required)
+        longitude - Longitude (required)
+        elements - List of NDFD element codes, or None to return all params
+
+    returns - dictionary keyed by degrib element name of lists of
+        (valid start, valid end, value) tuples, or None if the point is
+        outside the grid
+    """
+    from pysky import cube
+
+    return cube.open_cube(data_dir).point(latitude, longitude, elements)
+
+def _link_or_copy(src, dst):
+    """
+    Carry an unchanged file over into a new data directory without copying
+    its bytes where the filesystem allows: hard link it, or failing that
+    reflink it, and only copy as a last resort. Downloads always replace
+    files rather than writing into them, so sharing data between
+    generations is safe.
+
+    returns - "linked", "reflinked" or "copied"
+    """
+    import os, shutil
+
+    try:
+        os.link(src, dst)
+        return "linked"
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return "reflinked"
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.unlink(dst)
+    shutil.copy2(src, dst)
+    return "copied"
+
+def _reflink(src, dst):
+    """ Clone a file's extents into a new file (FICLONE, e.g. on btrfs or xfs) """
+    import fcntl, shutil
+
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+def _param(filename):
+    """ noaa param name of a .bin file, e.g. temp for ds.temp.bin """
+    return filename.split('/')[-1].split('.')[1]
+
+def _wanted(filename, params):
+    """ Whether a .bin file holds one of the params we download """
+    param = _param(filename)
+    return params == 'ALL' or param in params
+
+def _parse_listing(ls_file):
+    """
+    Parse an ls-l directory listing into a manifest
+
+    returns - dictionary keyed by .bin filename of [size, timestamp] lists
+    """
+    import re
+
+    manifest = {}
+    for line in open(ls_file):
+        if line.find(".bin") != -1:
+            # Split line to get size, date and filename
+            fields = re.split("\s+", line)
+            size, month, day, rtime, filename = fields[4:9]
+            manifest[filename] = [int(size), "{0} {1} {2}".format(month, day, rtime)]
+    return manifest
+
+def _load_manifest(dir):
+    """
+    Load the manifest of a local data directory, falling back to parsing its
+    ls-l listing
+
+    returns - manifest dictionary, empty if the directory has neither
+    """
+    import json, os
+
+    manifest_path = "{0}/{1}".format(dir, _manifest_name)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    if os.path.exists("{0}/ls-l".format(dir)):
+        return _parse_listing("{0}/ls-l".format(dir))
+    return {}
+
+def _write_manifest(dir, manifest):
+    """ Save the manifest of a local data directory """
+    import json, os
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    manifest_path = "{0}/{1}".format(dir, _manifest_name)
+    with open(manifest_path + '.part', 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.rename(manifest_path + '.part', manifest_path)
+
+def _report(progress, result):
+    """ Record and log the outcome of a remote file check """
+    files = progress['files']
+    files.append(dict((k, result[k]) for k in ('path', 'status', 'bytes', 'seconds')))
+    del files[:-progress.recent_files]
+    progress['files_checked'] += 1
+    progress['bytes'] += result['bytes']
+    if result['status'] == 200 and result['bytes']:
+        metrics.inc('pysky_download_bytes_total', result['bytes'])
+        metrics.inc('pysky_download_files_total')
+    utils.info("{0}: HTTP {1}, {2} bytes in {3:.3f}s".format(
+        result['path'], result['status'], result['bytes'], result['seconds']))
+
+def _set_mtime(local_path, remote_time):
+    """ Set a downloaded file's modified time to the remote Last-Modified time """
+    import os
+    if remote_time:
+        os.utime(local_path, (remote_time, remote_time))
@@ -0,0 +1,73 @@
+"""
+Decaying frequency sketch of the most requested point queries
+
+Each request adds a weight that grows exponentially with time (forward
+decay), which is the same as decaying all older counts by half every
+half_life seconds without touching them. The sketch keeps at most a fixed
+number of queries, dropping the least popular when it overflows, so it stays
+small however many distinct points are requested.
+"""
+import threading
+import time
+
+class Hotspots(object):
+    """ Thread-safe top-N sketch of requested queries """
+
+    def __init__(self, capacity=1000, half_life=3600.0):
+        """
+        args:
+            capacity - number of queries tracked
+            half_life - seconds after which a request counts half as much
+        """
+        self.capacity = capacity
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._epoch = time.time()
+        self._entries = {} # key -> [score, query]
+
+    def record(self, key, query):
+        """
+        Count a request
+
+        args:
+            key - hashable identity of the query, e.g. its cache key without
+                the generation, so requests for the same cell and variant add
+                up
+            query - description of the query to replay, see top(); the most
+                recent one is kept
+        """
+        with self._lock:
+            weight = self._weight(time.time())
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [weight, query]
+                if len(self._entries) > 2 * self.capacity:
+                    self._prune()
+            else:
+                entry[0] += weight
+                entry[1] = query
+
+    def top(self, count):
+        """
+        Most requested queries
+
+        returns - list of the queries passed to record(), most popular first
+        """
+        with self._lock:
+            ranked = sorted(self._entries.values(), key=lambda entry: entry[0], reverse=True)
+        return [query for _, query in ranked[:count]]
+
+    def _weight(self, now):
+        exponent = (now - self._epoch) / self.half_life
+        if exponent > 500:
+            # Rescale before weights overflow
+            scale = 2.0 ** -exponent
+            for entry in self._entries.values():
+                entry[0] *= scale
+            self._epoch = now
+            exponent = 0.0
+        return 2.0 ** exponent
+
+    def _prune(self):
+        ranked = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)
+        self._entries = dict(ranked[:self.capacity])
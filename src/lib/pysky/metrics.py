@@ -0,0 +1,281 @@
+"""
+Process-wide counters, gauges and latency histograms, rendered in the
+Prometheus text exposition format
+
+Metrics are declared once with counter(), gauge() or histogram() and
+updated by name with labels given as keyword arguments. Updates take one
+short lock, so instrumenting a request stage costs a few microseconds.
+
+When several processes serve requests, each keeps its own values;
+snapshot() exports them and render() can combine the snapshots of all
+processes into one exposition.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_lock = threading.Lock()
+_metrics = {} # name -> metric
+_order = [] # names in declaration order
+
+class _Metric(object):
+    """ A metric family: one value per combination of label values """
+
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {} # sorted label items -> value
+
+    def copy(self):
+        """ Snapshot of the values, taken while holding the lock """
+        return dict(self.values)
+
+    def combine(self, value, other):
+        """ Value of a sample combined from two processes """
+        return value + other
+
+    def samples(self, values):
+        """ List of (name suffix, label items, value) to render from a snapshot of the values """
+        return [('', labels, value) for labels, value in sorted(values.items())]
+
+class _Counter(_Metric):
+    type = 'counter'
+
+class _Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None, combine='sum'):
+        _Metric.__init__(self, name, help)
+        self.function = function
+        self.combination = combine
+
+    def evaluate(self, values):
+        """ Values of a function gauge, called without holding the lock """
+        if self.function is None:
+            return values
+        value = self.function()
+        if isinstance(value, dict): # label value -> value, for the single label 'name'
+            return dict(((('name', str(k)),), v) for k, v in value.items())
+        return {(): value} if value is not None else {}
+
+    def combine(self, value, other):
+        if self.combination == 'max':
+            return max(value, other)
+        return value + other
+
+class _Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=default_buckets):
+        _Metric.__init__(self, name, help)
+        self.buckets = tuple(buckets)
+
+    def copy(self):
+        return dict((k, [list(v[0]), v[1], v[2]]) for k, v in self.values.items())
+
+    def combine(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    def observe(self, labels, value):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0, 0.0]
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][n] += 1
+                break
+        entry[1] += 1
+        entry[2] += value
+
+    def samples(self, values):
+        samples = []
+        for labels, (counts, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', labels + (('le', repr(bound)),), cumulative))
+            samples.append(('_bucket', labels + (('le', '+Inf'),), count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+def _declare(metric):
+    with _lock:
+        if metric.name not in _metrics:
+            _order.append(metric.name)
+        _metrics[metric.name] = metric
+    return metric
+
+def counter(name, help):
+    """ Declare a counter """
+    return _declare(_Counter(name, help))
+
+def gauge(name, help, function=None, combine='sum'):
+    """
+    Declare a gauge
+
+    args:
+        name - metric name
+        help - description
+        function - optional function called when rendering, returning the
+            value, None to omit it, or a dictionary of values labelled by
+            name
+        combine - how the values of several processes are combined, 'sum'
+            or 'max' for values every process sees the same
+    """
+    return _declare(_Gauge(name, help, function, combine))
+
+def histogram(name, help, buckets=default_buckets):
+    """ Declare a histogram with the given bucket upper bounds """
+    return _declare(_Histogram(name, help, buckets))
+
+def inc(name, amount=1, **labels):
+    """ Add to a counter or gauge """
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        metric = _metrics[name]
+        metric.values[key] = metric.values.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """ Add an observation to a histogram """
+    with _lock:
+        _metrics[name].observe(tuple(sorted(labels.items())), value)
+
+@contextmanager
+def timed(name, **labels):
+    """ Context manager observing the seconds its block takes in a histogram """
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, **labels)
+
+def _snapshot():
+    """ List of (metric, values) of all metrics, in declaration order """
+    with _lock:
+        metrics = [_metrics[name] for name in _order]
+        # Copy the values so rendering does not hold up updates
+        snapshots = [metric.copy() for metric in metrics]
+    return [(metric, metric.evaluate(values) if isinstance(metric, _Gauge) else values)
+        for metric, values in zip(metrics, snapshots)]
+
+def snapshot():
+    """
+    Current values of all metrics of this process, to pass to render() in
+    another process
+
+    returns - JSON-serializable dictionary by metric name of lists of
+        [label items, value]
+    """
+    return dict((metric.name, [[list(labels), value] for labels, value in values.items()])
+        for metric, values in _snapshot())
+
+def render(snapshots=None):
+    """
+    All metrics in the Prometheus text exposition format
+
+    args:
+        snapshots - list of snapshot() results of processes to combine, or
+            None to render the values of this process
+    """
+    if snapshots is None:
+        metric_values = _snapshot()
+    else:
+        with _lock:
+            metrics = [_metrics[name] for name in _order]
+        metric_values = []
+        for metric in metrics:
+            values = {}
+            for snapshot in snapshots:
+                for labels, value in snapshot.get(metric.name, []):
+                    labels = tuple(tuple(item) for item in labels)
+                    values[labels] = metric.combine(values[labels], value) if labels in values else value
+            metric_values.append((metric, values))
+
+    lines = []
+    for metric, values in metric_values:
+        samples = metric.samples(values)
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+        for suffix, labels, value in samples:
+            label_text = ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in labels)
+            lines.append('{0}{1}{2} {3}'.format(metric.name, suffix,
+                '{' + label_text + '}' if label_text else '', _number(value)))
+    return '\n'.join(lines) + '\n'
+
+def track_requests(wsgi_app):
+    """
+    Wrap a WSGI application to count in-flight requests and observe their
+    latency, until streamed responses have been closed
+
+    Uses the pysky_requests_in_flight gauge and the pysky_request_seconds
+    histogram, labelled by the first path segment.
+    """
+    def application(environ, start_response):
+        path = '/' + environ.get('PATH_INFO', '/').lstrip('/').split('/', 1)[0]
+        start = time.time()
+        inc('pysky_requests_in_flight', 1)
+        try:
+            result = wsgi_app(environ, start_response)
+        except:
+            inc('pysky_requests_in_flight', -1)
+            observe('pysky_request_seconds', time.time() - start, path=path)
+            raise
+        return _ClosingIterator(result, start, path)
+    return application
+
+class _ClosingIterator(object):
+    """ Response iterable that finishes the request's metrics when closed """
+
+    def __init__(self, result, start, path):
+        self._result = result
+        self._iterator = iter(result)
+        self._start = start
+        self._path = path
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._iterator)
+
+    __next__ = next
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                inc('pysky_requests_in_flight', -1)
+                observe('pysky_request_seconds', time.time() - self._start, path=self._path)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+# Metrics updated by pysky modules
+histogram('pysky_stage_seconds', 'Seconds spent in each stage of serving a request')
+histogram('pysky_refresh_phase_seconds', 'Seconds spent in each phase of a cache refresh')
+histogram('pysky_request_seconds', 'Seconds from receiving a request until its response is closed')
+counter('pysky_degrib_runs_total', 'degrib jobs run, by outcome')
+counter('pysky_refreshes_total', 'Cache refreshes, by outcome')
+counter('pysky_download_bytes_total', 'Bytes of grib2 files downloaded')
+counter('pysky_download_files_total', 'grib2 files downloaded')
+counter('pysky_coalesced_total', 'Point queries answered by waiting for an identical query')
+counter('pysky_prewarmed_total', 'Point queries computed for a new generation before it was served')
+counter('pysky_grid_errors_total', 'Generations whose grids could not be read in-process')
+counter('pysky_daily_errors_total', 'Generations whose daily summaries could not be built')
+gauge('pysky_requests_in_flight', 'Requests being served')
@@ -0,0 +1,283 @@
+"""
+Serving from several processes sharing one listening socket
+
+The master process binds the socket and starts the workers, which accept
+connections from it, run their own threads and degrib pool, and share the
+cube through the page cache. Each worker is a fresh interpreter started with
+the socket and its end of a control channel as inherited file descriptors,
+so none inherits the master's threads or locks; workers that exit are
+restarted.
+
+The control channel carries calls in both directions, one JSON object per
+line: workers hand requests that need the master's state to it, and the
+master notifies or queries all workers with broadcast().
+"""
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from pysky import utils
+
+_closed = object() # error of calls cut short by the channel closing
+
+class ChannelClosed(Exception):
+    """ Raised to callers when the process at the other end has gone """
+    pass
+
+class Channel(object):
+    """ Call functions of the process at the other end of a stream socket """
+
+    def __init__(self, sock, handler, on_close=None):
+        """
+        args:
+            sock - connected stream socket
+            handler - function(op, arg) run in a new thread for each call
+                received, returning a JSON-serializable reply
+            on_close - function called once the other end has closed
+        """
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        self._handler = handler
+        self._on_close = on_close
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._pending = {} # call id -> [Event, reply, error]
+        self.closed = False
+
+    def start(self):
+        """ Start reading calls and replies in a background thread """
+        thread = threading.Thread(target=self._read)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def call(self, op, arg=None, timeout=None):
+        """
+        Call the handler at the other end and wait for its reply
+
+        args:
+            op - operation name
+            arg - JSON-serializable argument
+            timeout - seconds to wait, or None to wait indefinitely
+        returns - the reply
+        raises - ChannelClosed, or RuntimeError if the handler failed or
+            did not reply in time
+        """
+        event = threading.Event()
+        with self._lock:
+            if self.closed:
+                raise ChannelClosed('Control channel is closed')
+            self._next_id += 1
+            call_id = self._next_id
+            pending = self._pending[call_id] = [event, None, None]
+        try:
+            self._send({'id': call_id, 'op': op, 'arg': arg})
+            if not event.wait(timeout):
+                raise RuntimeError('No reply to {0} in {1}s'.format(op, timeout))
+        finally:
+            with self._lock:
+                self._pending.pop(call_id, None)
+        if pending[2] is _closed:
+            raise ChannelClosed('Control channel closed during {0}'.format(op))
+        if pending[2] is not None:
+            raise RuntimeError(pending[2])
+        return pending[1]
+
+    def close(self):
+        """ Close the channel; the other end sees it closed """
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _send(self, message):
+        data = json.dumps(message) + '\n'
+        with self._write_lock:
+            try:
+                self._sock.sendall(data)
+            except socket.error:
+                raise ChannelClosed('Control channel is closed')
+
+    def _read(self):
+        try:
+            for line in iter(self._file.readline, ''):
+                message = json.loads(line)
+                if 'op' in message:
+                    thread = threading.Thread(target=self._handle, args=(message,))
+                    thread.daemon = True
+                    thread.start()
+                else:
+                    with self._lock:
+                        pending = self._pending.get(message['id'])
+                    if pending:
+                        pending[1] = message.get('reply')
+                        pending[2] = message.get('error')
+                        pending[0].set()
+        except (IOError, socket.error, ValueError):
+            pass
+        with self._lock:
+            self.closed = True
+            pending = list(self._pending.values())
+        for entry in pending:
+            entry[2] = _closed
+            entry[0].set()
+        self._sock.close()
+        if self._on_close:
+            self._on_close()
+
+    def _handle(self, message):
+        try:
+            reply = {'id': message['id'], 'reply': self._handler(message['op'], message['arg'])}
+        except Exception as e:
+            reply = {'id': message['id'], 'error': '{0}: {1}'.format(type(e).__name__, e)}
+        try:
+            self._send(reply)
+        except ChannelClosed:
+            pass
+
+class Master(object):
+    """ Starts and restarts the worker processes and talks to them """
+
+    def __init__(self, processes, command, handler):
+        """
+        args:
+            processes - number of worker processes
+            command - argument list starting a worker; the file descriptors
+                of the listening socket and the control channel are appended
+                as "LISTENER,CHANNEL", see connect()
+            handler - function(op, arg) answering calls from workers
+        """
+        self.processes = processes
+        self.command = command
+        self.handler = handler
+        self.listener = None
+        self._lock = threading.Lock()
+        self._workers = {} # pid -> (Channel, start time)
+        self._stopping = False
+
+    def listen(self, host, port, backlog=128):
+        """ Bind the socket the workers accept connections from """
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        return self
+
+    def start(self):
+        """ Start the worker processes """
+        for _ in range(self.processes):
+            self._spawn()
+        return self
+
+    def run(self):
+        """
+        Restart workers as they exit, until interrupted or terminated, then
+        stop them
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                time.sleep(1)
+                # Wait for the workers only, not for degrib runs of the master
+                with self._lock:
+                    pids = list(self._workers)
+                for pid in pids:
+                    try:
+                        pid, status = os.waitpid(pid, os.WNOHANG)
+                    except OSError:
+                        status = None
+                    if not pid:
+                        continue
+                    with self._lock:
+                        channel, _ = self._workers.pop(pid)
+                    channel.close()
+                    print "Worker {0} exited with status {1}, restarting.".format(pid, status)
+                    self._spawn()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Terminate the workers and wait for them to exit """
+        self._stopping = True
+        with self._lock:
+            workers = list(self._workers)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+    def broadcast(self, op, arg=None, timeout=None):
+        """
+        Call a handler in every worker at once
+
+        returns - list of the workers' replies, None for workers that failed
+            or did not reply in time
+        """
+        with self._lock:
+            channels = [channel for channel, _ in self._workers.values()]
+        replies = [None] * len(channels)
+
+        def call(n, channel):
+            try:
+                replies[n] = channel.call(op, arg, timeout)
+            except (ChannelClosed, RuntimeError) as e:
+                utils.info("Worker call {0} failed: {1}".format(op, e))
+
+        threads = [threading.Thread(target=call, args=(n, channel)) for n, channel in enumerate(channels)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return replies
+
+    def _spawn(self):
+        if self._stopping:
+            return
+        master_end, worker_end = socket.socketpair()
+        keep = sorted([self.listener.fileno(), worker_end.fileno()])
+        args = self.command + ['{0},{1}'.format(self.listener.fileno(), worker_end.fileno())]
+        pid = os.fork()
+        if pid == 0:
+            # Only async-signal-safe calls until exec, as other threads of
+            # the master may have held locks when it forked
+            try:
+                os.closerange(3, keep[0])
+                os.closerange(keep[0] + 1, keep[1])
+                os.closerange(keep[1] + 1, os.sysconf('SC_OPEN_MAX'))
+                os.execv(args[0], args)
+            finally:
+                os._exit(127)
+        worker_end.close()
+        channel = Channel(master_end, self.handler)
+        with self._lock:
+            self._workers[pid] = (channel, time.time())
+        channel.start()
+
+def connect(descriptors, handler):
+    """
+    Take over the file descriptors a worker was started with
+
+    args:
+        descriptors - "LISTENER,CHANNEL" as appended to the worker command
+        handler - function(op, arg) answering calls from the master
+    returns - (listening socket file descriptor, Channel to the master). The
+        worker exits when the master goes away.
+    """
+    listener, channel = [int(fd) for fd in descriptors.split(',')]
+    sock = socket.fromfd(channel, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(channel)
+    return listener, Channel(sock, handler, lambda: os._exit(0)).start()
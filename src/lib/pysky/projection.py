@@ -0,0 +1,197 @@
+"""
+Lambert conformal projection of the NDFD grids
+
+Points are snapped to grid cells with the forward transform, vectorized over
+arrays of coordinates. The inverse, the latitude/longitude of every cell
+centre, is computed once per grid and kept as a table on disk, so the
+cache, batch, tile and summary code all agree on which cell a point is in.
+
+Polar stereographic grids, such as Alaska's, are only read by degrib; their
+projection is only used to bound the sector they cover.
+"""
+import hashlib
+import math
+import os
+import threading
+
+import numpy as np
+
+from pysky import utils
+
+# Directories tried in turn to persist inverse tables, normally one next to
+# the degrib geodata directory followed by the data directory
+table_dirs = []
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+class LambertConformal(object):
+    """ Lambert conformal conic projection of a grid with square cells """
+
+    def __init__(self, lat1, lon1, orient_lon, latin1, latin2, dx, radius):
+        """
+        args:
+            lat1, lon1 - centre of the south-west cell
+            orient_lon - longitude parallel to the grid columns
+            latin1, latin2 - standard parallels
+            dx - cell size in meters
+            radius - earth radius in meters
+        """
+        self.orient_lon = orient_lon
+        self.dx = dx
+        self.radius = radius
+
+        phi1 = math.radians(latin1)
+        phi2 = math.radians(latin2)
+        if abs(latin1 - latin2) < 1e-9:
+            self._n = math.sin(phi1)
+        else:
+            self._n = (math.log(math.cos(phi1) / math.cos(phi2)) /
+                math.log(math.tan(math.pi / 4 + phi2 / 2) / math.tan(math.pi / 4 + phi1 / 2)))
+        self._f = math.cos(phi1) * math.tan(math.pi / 4 + phi1 / 2) ** self._n / self._n
+        self._x1, self._y1 = self._xy(lat1, lon1)
+
+    def _xy(self, latitude, longitude):
+        """ Project a latitude/longitude to meters on the cone """
+        rho = self.radius * self._f / math.tan(math.pi / 4 + math.radians(latitude) / 2) ** self._n
+        dlon = (longitude - self.orient_lon + 180.0) % 360.0 - 180.0
+        theta = self._n * math.radians(dlon)
+        return rho * math.sin(theta), -rho * math.cos(theta)
+
+    def point(self, latitude, longitude):
+        """ Fractional grid position (x, y) of a point, in cells from the south-west cell """
+        x, y = self._xy(float(latitude), float(longitude))
+        return (x - self._x1) / self.dx, (y - self._y1) / self.dx
+
+    def forward(self, latitudes, longitudes):
+        """
+        Fractional grid positions of arrays of points, see point()
+
+        returns - (x, y) tuple of float arrays
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        rho = self.radius * self._f / np.tan(math.pi / 4 + np.radians(latitudes) / 2) ** self._n
+        theta = self._n * np.radians((longitudes - self.orient_lon + 180.0) % 360.0 - 180.0)
+        return ((rho * np.sin(theta) - self._x1) / self.dx,
+            (-rho * np.cos(theta) - self._y1) / self.dx)
+
+    def inverse(self, x, y):
+        """
+        Latitude/longitude of fractional grid positions, the inverse of
+        forward()
+
+        returns - (latitudes, longitudes) tuple of float arrays
+        """
+        x = self._x1 + self.dx * np.asarray(x, dtype=np.float64)
+        y = self._y1 + self.dx * np.asarray(y, dtype=np.float64)
+        sign = math.copysign(1.0, self._n)
+        rho = sign * np.hypot(x, y)
+        theta = np.arctan2(sign * x, -sign * y)
+        longitudes = (self.orient_lon + np.degrees(theta / self._n) + 180.0) % 360.0 - 180.0
+        latitudes = np.degrees(2 * np.arctan((self.radius * self._f / rho) ** (1 / self._n)) - math.pi / 2)
+        return latitudes, longitudes
+
+class PolarStereographic(object):
+    """ North polar stereographic projection of a grid with square cells """
+
+    def __init__(self, lat1, lon1, orient_lon, lat_d, dx, radius):
+        """
+        args:
+            lat1, lon1 - centre of the south-west cell
+            orient_lon - longitude parallel to the grid columns
+            lat_d - latitude where cells are dx wide
+            dx - cell size in meters
+            radius - earth radius in meters
+        """
+        self.orient_lon = orient_lon
+        self.dx = dx
+        self.radius = radius
+        self._scale = radius * (1 + math.sin(math.radians(lat_d)))
+        x1, y1 = self._xy(np.array([lat1], dtype=np.float64), np.array([lon1], dtype=np.float64))
+        self._x1, self._y1 = float(x1[0]), float(y1[0])
+
+    def _xy(self, latitudes, longitudes):
+        """ Project arrays of latitudes/longitudes to meters on the plane """
+        rho = self._scale * np.tan(math.pi / 4 - np.radians(latitudes) / 2)
+        theta = np.radians((longitudes - self.orient_lon + 180.0) % 360.0 - 180.0)
+        return rho * np.sin(theta), -rho * np.cos(theta)
+
+    def forward(self, latitudes, longitudes):
+        """
+        Fractional grid positions of arrays of points, in cells from the
+        south-west cell
+
+        returns - (x, y) tuple of float arrays
+        """
+        x, y = self._xy(np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64))
+        return (x - self._x1) / self.dx, (y - self._y1) / self.dx
+
+    def inverse(self, x, y):
+        """
+        Latitude/longitude of fractional grid positions, the inverse of
+        forward()
+
+        returns - (latitudes, longitudes) tuple of float arrays
+        """
+        x = self._x1 + self.dx * np.asarray(x, dtype=np.float64)
+        y = self._y1 + self.dx * np.asarray(y, dtype=np.float64)
+        latitudes = 90.0 - np.degrees(2 * np.arctan(np.hypot(x, y) / self._scale))
+        longitudes = (self.orient_lon + np.degrees(np.arctan2(x, -y)) + 180.0) % 360.0 - 180.0
+        return latitudes, longitudes
+
+def snap(x, y):
+    """ Nearest cell index of fractional grid positions, scalars or arrays """
+    if np.ndim(x):
+        return np.floor(np.asarray(x) + 0.5).astype(int), np.floor(np.asarray(y) + 0.5).astype(int)
+    return int(math.floor(x + 0.5)), int(math.floor(y + 0.5))
+
+def coordinates(grid):
+    """
+    Inverse table of a grid: latitude and longitude of every cell centre.
+    Tables are shared in memory and persisted in the first writable
+    directory of table_dirs, so they are only computed once per grid.
+
+    args:
+        grid - cube.Grid
+    returns - (latitudes, longitudes) tuple of float32 arrays shaped (ny, nx)
+    """
+    name = 'grid-{0}.npy'.format(hashlib.sha1(repr(grid.definition()).encode('ascii')).hexdigest()[:16])
+    with _tables_lock:
+        table = _tables.get(name)
+        if table is None:
+            table = _load_table(name)
+            if table is None:
+                j, i = np.mgrid[0:grid.ny, 0:grid.nx]
+                table = np.array(grid.projection.inverse(i, j), dtype=np.float32)
+                _save_table(name, table)
+            _tables[name] = table
+    return table[0], table[1]
+
+def _load_table(name):
+    """ Memory-map a persisted inverse table, or None """
+    for table_dir in table_dirs:
+        path = os.path.join(table_dir, name)
+        if os.path.exists(path):
+            try:
+                return np.load(path, mmap_mode='r')
+            except (IOError, ValueError):
+                pass
+    return None
+
+def _save_table(name, table):
+    """ Persist an inverse table in the first directory that accepts it """
+    for table_dir in table_dirs:
+        path = os.path.join(table_dir, name)
+        tmp_path = '{0}.{1}.part'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(table_dir):
+                os.makedirs(table_dir)
+            with open(tmp_path, 'wb') as f:
+                np.save(f, table)
+            os.rename(tmp_path, path)
+            utils.info("Saved grid table {0}".format(path))
+            return
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
@@ -36,7 +36,7 @@ def get_forecast(latitude, longitude,
     # If grib2 directory is provided, use grib2 files
     if grib2_dir:
         grib2.verbose = verbose
-        xml = grib2.xml(grib2_dir, latitude, longitude)
+        xml = grib2.xml(grib2.Config(), grib2_dir, latitude, longitude)
         info(xml)
     # Otherwise, use SOAP web service
     else:
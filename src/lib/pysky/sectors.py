@@ -0,0 +1,180 @@
+"""
+NDFD sectors served side by side, each from its own data directory
+
+A sector is a directory of the NDFD server, e.g. conus, alaska or one of the
+conus sub-sectors such as pacnwest, which hold the same 2.5km grids cut to a
+region. Each sector has its own download source, cube generations and
+refresh schedule. Points are routed to the smallest sector covering them, so
+a sub-sector is preferred over conus where both are served.
+
+The grid and bounding box of each sector are read once per generation, when
+it is first served and after every swap, so routing a point only tests it
+against boxes and grids held in memory. The box comes from the grid
+definition of the generation, whatever its projection, see grib2.grid_info().
+Only Lambert conformal grids are read in-process; points in other sectors are
+probed by degrib.
+"""
+import errno
+import os
+import random
+import string
+import threading
+
+from pysky import grib2
+from pysky.generations import Generations, generation
+
+# NDFD server directory of a sector
+default_url = 'http://weather.noaa.gov/pub/SL.us008001/ST.opnl/DF.gr2/DC.ndfd/AR.{sector}/'
+
+class Sector(object):
+    """ One sector: where it is downloaded from and the generations served """
+
+    def __init__(self, name, data_dir, url=None, params='ALL', interval=300, shared=False, config=None):
+        """
+        args:
+            name - NDFD sector name, e.g. conus
+            data_dir - directory holding the sector's generations and its
+                ``active`` symlink
+            url - URL of the sector directory to download from, or None for
+                the NOAA server
+            params - list of params to download, or 'ALL'
+            interval - seconds between scheduled refreshes
+            shared - whether other processes serve the same data directory,
+                see Generations
+            config - grib2.Config used to build and query its cubes, or None
+                for the defaults
+        """
+        self.name = name
+        self.data_dir = data_dir
+        self.url = url or default_url.format(sector=name)
+        self.params = params
+        self.interval = interval
+        self.config = config or grib2.Config()
+        self.generations = Generations(os.path.join(data_dir, 'active'), shared)
+        self.mutex = threading.Lock() # held while refreshing
+        self._lock = threading.Lock()
+        self._area = None # (generation, Grid, bounds) of the generation served
+        self.generations.subscribe(self._load)
+
+    def new_data_dir(self):
+        """ Path of a new generation directory """
+        rnd = ''.join(random.choice(string.ascii_letters + string.digits) for i in range(10))
+        return os.path.join(self.data_dir, rnd)
+
+    def download(self, new_data_dir, progress=None):
+        """ Download changes into a new generation, see grib2.download() """
+        return grib2.download(self.generations.active_path, new_data_dir, progress, self.url, self.params, config=self.config)
+
+    @property
+    def gridded(self):
+        """ Whether the generation served has grids read in-process, see cube.open_cube() """
+        return self._served()[1] is not None
+
+    def bounds(self):
+        """
+        (south, west, north, east) box covering the sector, from the grid
+        definition of the generation being served, or None before it has one
+        """
+        return self._served()[2]
+
+    def contains(self, latitude, longitude):
+        """ Whether a point falls in the sector's grid """
+        _, grid, bounds = self._served()
+        if bounds is None or not _inside(bounds, latitude, longitude):
+            return False
+        return grid is None or grid.cell(latitude, longitude) is not None
+
+    def _served(self):
+        area = self._area
+        if area is None:
+            with self._lock:
+                if self._area is None:
+                    self._read_area(self.generations.current())
+                area = self._area
+        return area
+
+    def _load(self, data_dir):
+        """ Read the grid of a generation swapped in, see Generations.subscribe() """
+        with self._lock:
+            self._read_area(data_dir)
+
+    def _read_area(self, data_dir):
+        from pysky import cube
+        from pysky.degrib_pool import DegribError
+        try:
+            info = grib2.grid_info(self.config, data_dir)
+        except (DegribError, IOError, OSError, ValueError) as e:
+            print "Cannot read the grid definition of {0}, not routing points to {1}: {2}".format(data_dir, self.name, e)
+            info = None
+        grid = None
+        if info is not None:
+            try:
+                grid = cube.open_cube(data_dir).grid
+            except (IOError, OSError, ValueError) as e:
+                if getattr(e, 'errno', None) != errno.ENOENT:
+                    print "Cannot read the grids of {0}, probing {1} with degrib: {2}".format(data_dir, self.name, e)
+        self._area = (generation(data_dir), grid, tuple(info['bounds']) if info else None)
+
+class Sectors(object):
+    """ The sectors of a server, by name and by location """
+
+    def __init__(self, sectors):
+        self._sectors = list(sectors)
+        self._lock = threading.Lock()
+        self._index = None # [(area, n, bounds, Sector)], smallest box first
+        for sector in self._sectors:
+            sector.generations.subscribe(self._reindex)
+
+    def __iter__(self):
+        return iter(self._sectors)
+
+    def __len__(self):
+        return len(self._sectors)
+
+    def get(self, name):
+        """ Sector by name, or None """
+        for sector in self._sectors:
+            if sector.name == name:
+                return sector
+        return None
+
+    def route(self, latitude, longitude):
+        """
+        Sector serving a point: the smallest one covering it, or None. With a
+        single sector, that sector, so points outside it are left to degrib
+        as before.
+        """
+        if len(self._sectors) == 1:
+            return self._sectors[0]
+        index = self._index
+        if index is None:
+            index = self._reindex()
+        for _, _, bounds, sector in index:
+            if _inside(bounds, latitude, longitude) and sector.contains(latitude, longitude):
+                return sector
+        return None
+
+    def _reindex(self, data_dir=None):
+        """
+        Rebuild the box index from the sectors' bounds, once at first use and
+        after every swap, which has updated the swapped sector's bounds
+        """
+        with self._lock:
+            self._index = sorted((_area(bounds), n, bounds, sector)
+                for n, (sector, bounds) in enumerate((sector, sector.bounds()) for sector in self._sectors)
+                if bounds is not None)
+            return self._index
+
+def _inside(bounds, latitude, longitude):
+    south, west, north, east = bounds
+    if not south <= latitude <= north:
+        return False
+    longitude = (longitude + 180.0) % 360.0 - 180.0
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+def _area(bounds):
+    """ Size of a box in square degrees, for preferring smaller sectors """
+    south, west, north, east = bounds
+    return (north - south) * ((east - west) % 360.0)
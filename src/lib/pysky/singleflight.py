@@ -0,0 +1,128 @@
+"""
+Coalescing of identical concurrent computations
+
+The first caller of a key becomes the leader and computes the result; callers
+arriving while it runs become followers and wait for the leader's result
+instead of repeating the work. Nothing is kept once the leader has finished,
+caching is left to cache.ResponseCache.
+"""
+import threading
+
+class Timeout(Exception):
+    """ Raised to a follower when the leader does not finish in time """
+    pass
+
+class Abandoned(Exception):
+    """ Raised to a follower when the leader gave up without a result """
+    pass
+
+class _Call(object):
+    """ One in-flight computation """
+
+    __slots__ = ('done', 'value', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight(object):
+    """ Registry of in-flight computations by key, shared by all threads """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """
+        Join the computation of a key, starting it if none is in flight. A
+        leader must call finish(); a follower calls wait().
+
+        returns - (call, True if the caller is the leader)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.followers += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, value=None, error=None):
+        """
+        Publish the leader's result, or the exception it failed with, to its
+        followers
+
+        args:
+            key - key passed to begin()
+            call - call returned by begin()
+            value - result
+            error - exception raised to followers instead of a result
+        """
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.value = value
+        call.error = error
+        call.done.set()
+
+    def wait(self, call, timeout=None):
+        """
+        Wait for the leader of a call to finish
+
+        args:
+            call - call returned by begin()
+            timeout - seconds to wait, or None to wait indefinitely
+        returns - the leader's result
+        raises - Timeout, or the leader's error
+        """
+        if not call.done.wait(timeout):
+            raise Timeout('Timed out waiting for an identical query')
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def do(self, key, function, timeout=None):
+        """
+        Compute function() once for all concurrent callers of a key
+
+        args:
+            key - hashable key identifying the computation
+            function - function computing the result
+            timeout - seconds a follower waits before computing the result
+                itself, or None to wait indefinitely
+        returns - the result
+        """
+        while True:
+            call, leader = self.begin(key)
+            if not leader:
+                try:
+                    return self.wait(call, timeout)
+                except Abandoned:
+                    continue # the leader gave up; compute it ourselves
+                except Timeout:
+                    return function()
+            try:
+                value = function()
+            except Exception as e:
+                self.finish(key, call, error=e)
+                raise
+            except BaseException:
+                self.finish(key, call, error=Abandoned('Leader was interrupted'))
+                raise
+            self.finish(key, call, value)
+            return value
+
+    def stats(self):
+        """ Dictionary of in-flight keys and leader/follower counts """
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers
+            }
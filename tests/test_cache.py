@@ -0,0 +1,118 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+from pysky import cube, grib2
+from pysky.cache import ResponseCache
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(10)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get(('gen', 1)))
+        self.cache.put(('gen', 1), b'abc')
+        self.assertEqual(self.cache.get(('gen', 1)), b'abc')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['bytes']), (1, 1, 1, 3))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put(('gen', 1), b'aaaa')
+        self.cache.put(('gen', 2), b'bbbb')
+        self.cache.get(('gen', 1))
+        self.cache.put(('gen', 3), b'cccc')
+        self.assertIsNone(self.cache.get(('gen', 2)))
+        self.assertEqual(self.cache.get(('gen', 1)), b'aaaa')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 8)
+
+    def test_replacing_a_value_keeps_the_size(self):
+        self.cache.put(('gen', 1), b'aaaa')
+        self.cache.put(('gen', 1), b'bb')
+        self.assertEqual(self.cache.stats()['bytes'], 2)
+
+    def test_value_larger_than_cache_is_not_kept(self):
+        self.cache.put(('gen', 1), b'x' * 11)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_invalidate_keeps_the_served_generation(self):
+        self.cache.put(('old', 1), b'a')
+        self.cache.put(('new', 1), b'b')
+        self.cache.invalidate('new')
+        self.assertIsNone(self.cache.get(('old', 1)))
+        self.assertEqual(self.cache.get(('new', 1)), b'b')
+        self.assertEqual(self.cache.stats()['bytes'], 1)
+
+    def test_swapped_out_generation_is_not_added(self):
+        # A query that started before the swap finishes after it
+        self.cache.invalidate('new')
+        self.cache.put(('old', 1), b'a')
+        self.assertIsNone(self.cache.get(('old', 1)))
+
+    def test_allowed_generation_is_added_before_the_swap(self):
+        self.cache.invalidate('old')
+        self.cache.allow('new')
+        self.cache.put(('new', 1), b'a')
+        self.cache.invalidate('new')
+        self.assertEqual(self.cache.get(('new', 1)), b'a')
+
+    def test_groups_are_served_side_by_side(self):
+        self.cache.invalidate('conus-1', 'conus')
+        self.cache.invalidate('alaska-1', 'alaska')
+        self.cache.put(('conus-1', 1), b'a')
+        self.cache.put(('alaska-1', 1), b'b')
+        self.cache.invalidate('alaska-2', 'alaska')
+        self.assertEqual(self.cache.get(('conus-1', 1)), b'a')
+        self.assertIsNone(self.cache.get(('alaska-1', 1)))
+
+class CachedQueryTest(unittest.TestCase):
+    """ Point queries of a generation cubed with fake_degrib.py, through the cache """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.realpath(common.make_data_dir(self.base_dir))
+        self.config = grib2.Config(common.fake_degrib, cache=ResponseCache(1024 * 1024))
+        self.runs = []
+        self.saved = grib2._run
+
+        def run(config, args):
+            self.runs.append(args)
+            return self.saved(config, args)
+
+        grib2._run = run
+
+    def tearDown(self):
+        grib2._run = self.saved
+        grib2._grids_by_dir.clear()
+        grib2._indexes_by_dir.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_points_in_one_cell_share_a_response(self):
+        grid = cube.open_cube(self.data_dir).grid
+        latitudes, longitudes = grid.projection.inverse(np.array([50.0, 50.3]), np.array([40.0, 39.8]))
+        first = grib2.xml(self.config, self.data_dir, float(latitudes[0]), float(longitudes[0]))
+        second = grib2.xml(self.config, self.data_dir, float(latitudes[1]), float(longitudes[1]))
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual(self.config.cache.stats()['hits'], 1)
+
+    def test_other_cells_and_products_are_queried(self):
+        grib2.xml(self.config, self.data_dir, 21.5, -119.5)
+        grib2.xml(self.config, self.data_dir, 21.5, -119.5, ['maxt'])
+        grib2.xml_byday(self.config, self.data_dir, 21.5, -119.5)
+        grib2.xml(self.config, self.data_dir, 22.0, -118.0)
+        self.assertEqual(len(self.runs), 4)
+
+if __name__ == '__main__':
+    unittest.main()
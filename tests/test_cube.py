@@ -0,0 +1,146 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+import fake_degrib
+from pysky import cube
+
+GRID = cube.Grid(4, 3, 20.192, -121.554, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+
+def write_segment(segment_dir, name, element, values, start):
+    """ Write a segment index and data file holding one grid per array of values """
+    with open(os.path.join(segment_dir, name + '.f32'), 'wb') as f:
+        for grid_values in values:
+            f.write(np.asarray(grid_values, dtype='<f4').tobytes())
+    size = 4 * GRID.nx * GRID.ny
+    records = [cube.Record(element, cube.units[element], start, start + n * 3600, start + (n + 1) * 3600, 0, n * size)
+        for n in range(len(values))]
+    index_path = os.path.join(segment_dir, name + '.idx')
+    cube.write_index(index_path, [name + '.f32'], GRID, records)
+    return index_path
+
+class IndexTest(unittest.TestCase):
+    """ A generation of two segments, Temp and MaxT, unioned into rasters.idx """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        segment_dir = os.path.join(self.data_dir, cube.segments_name)
+        os.mkdir(segment_dir)
+        cells = GRID.nx * GRID.ny
+        self.temp = [np.arange(cells, dtype='<f4'), np.arange(cells, dtype='<f4') + 100]
+        self.temp[0][5] = cube.MISSING
+        self.maxt = [np.full(cells, 70.0, dtype='<f4')]
+        self.segments = [
+            write_segment(segment_dir, 'temp', 'Temp', self.temp, 1435708800),
+            write_segment(segment_dir, 'maxt', 'MaxT', self.maxt, 1435708800)]
+        self.index_path = os.path.join(self.data_dir, cube.index_name)
+        cube.merge_indexes(self.index_path, self.segments)
+
+    def tearDown(self):
+        cube._cubes.clear()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_index_round_trip(self):
+        with open(self.segments[0], 'rb') as f:
+            files, grid, records = cube._parse_index(f.read())
+        self.assertEqual(files, ['temp.f32'])
+        self.assertEqual(grid.definition(), GRID.definition())
+        self.assertEqual([(r.element, r.unit, r.start, r.offset) for r in records],
+            [('Temp', '[F]', 1435708800, 0), ('Temp', '[F]', 1435712400, 48)])
+
+    def test_merged_index_refers_to_segment_files(self):
+        data_cube = cube.open_cube(self.data_dir)
+        self.assertEqual(data_cube.files, ['rasters/temp.f32', 'rasters/maxt.f32'])
+        self.assertEqual([(r.element, r.file) for r in data_cube.records], [('Temp', 0), ('Temp', 0), ('MaxT', 1)])
+
+    def test_values(self):
+        data_cube = cube.open_cube(self.data_dir)
+        temp = data_cube.select(['temp'])
+        self.assertEqual(data_cube.value(temp[0], 2, 1), 6.0)
+        self.assertEqual(data_cube.value(temp[1], 2, 1), 106.0)
+        self.assertIsNone(data_cube.value(temp[0], 1, 1))
+        self.assertEqual(data_cube.grid_values(temp[1]).shape, (GRID.ny, GRID.nx))
+        self.assertEqual(data_cube.grid_values(temp[1])[2, 3], 111.0)
+
+    def test_series_of_a_point(self):
+        latitude, longitude = GRID.projection.inverse(np.array([2.0]), np.array([1.0]))
+        series = cube.open_cube(self.data_dir).point(float(latitude[0]), float(longitude[0]))
+        self.assertEqual(series['Temp'], [(1435708800, 1435712400, 6.0), (1435712400, 1435716000, 106.0)])
+        self.assertEqual(series['MaxT'], [(1435708800, 1435712400, 70.0)])
+
+    def test_cell_lookup(self):
+        latitudes, longitudes = GRID.projection.inverse(np.array([0.0, 3.0, 3.4]), np.array([0.0, 2.0, 1.6]))
+        self.assertEqual(GRID.cell(latitudes[0], longitudes[0]), (0, 0))
+        self.assertEqual(GRID.cell(latitudes[1], longitudes[1]), (3, 2))
+        self.assertEqual(GRID.cell(latitudes[2], longitudes[2]), (3, 2))
+        self.assertIsNone(GRID.cell(45.0, -100.0))
+        i, j, inside = GRID.cells(np.append(latitudes, 45.0), np.append(longitudes, -100.0))
+        self.assertEqual(list(inside), [True, True, True, False])
+        self.assertEqual(list(i[:3]), [0, 3, 3])
+
+    def test_segments_on_other_grids_are_not_merged(self):
+        other = cube.Grid(5, 3, 20.192, -121.554, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+        other_path = os.path.join(self.data_dir, 'other.idx')
+        cube.write_index(other_path, [], other, [])
+        self.assertRaises(ValueError, cube.merge_indexes, self.index_path, self.segments + [other_path])
+        self.assertRaises(ValueError, cube.merge_indexes, self.index_path, [])
+
+    def test_truncated_index(self):
+        with open(self.index_path, 'rb') as f:
+            index = f.read()
+        for size in (2, len(index) // 2, len(index) - 1):
+            with open(self.index_path, 'wb') as f:
+                f.write(index[:size])
+            self.assertRaises(ValueError, cube.Cube, self.index_path)
+
+    def test_truncated_data(self):
+        with open(os.path.join(self.data_dir, cube.segments_name, 'temp.f32'), 'r+b') as f:
+            f.truncate(4 * GRID.nx * GRID.ny + 8)
+        self.assertRaises(ValueError, cube.Cube, self.index_path)
+
+    def test_other_index_layout(self):
+        with open(self.index_path, 'wb') as f:
+            f.write(b'degrib cube index')
+        self.assertRaises(ValueError, cube.Cube, self.index_path)
+
+class ConvertTest(unittest.TestCase):
+    """ Segments converted from .bin files with fake_degrib.py """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.bin_paths = common.make_bins(self.data_dir, names=['VP.001-003/ds.temp.bin', 'VP.004-007/ds.temp.bin'])
+        self.index_path = os.path.join(self.data_dir, 'temp.idx')
+        cube.convert(self.bin_paths, self.index_path, os.path.join(self.data_dir, 'temp.f32'), common.fake_degrib, 2)
+        cube.merge_indexes(os.path.join(self.data_dir, cube.index_name), [self.index_path])
+
+    def tearDown(self):
+        cube._cubes.clear()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_every_message_in_inventory_order(self):
+        messages = fake_degrib.messages(self.bin_paths[0]) + fake_degrib.messages(self.bin_paths[1])
+        data_cube = cube.open_cube(self.data_dir)
+        self.assertEqual([(r.element, r.reference, r.start) for r in data_cube.records],
+            [(element, reference, start) for element, _, reference, start, _, _ in messages])
+        self.assertEqual(data_cube.grid.definition()[:2], tuple(fake_degrib.grid[:2]))
+
+    def test_rows_run_south_to_north(self):
+        element, _, reference, start, _, base = fake_degrib.messages(self.bin_paths[0])[1]
+        data_cube = cube.open_cube(self.data_dir)
+        expected = np.array(fake_degrib.values(start, reference, base), dtype='<f4')
+        self.assertTrue(np.array_equal(data_cube.grid_values(data_cube.records[1]), expected))
+
+    def test_rasters_are_removed(self):
+        self.assertEqual(sorted(os.listdir(self.data_dir)), sorted([cube.index_name, 'VP.001-003', 'VP.004-007', 'temp.f32', 'temp.idx']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import calendar
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+from pysky import cube, daily, forecast
+
+def utc(*fields):
+    return calendar.timegm(fields + (0,) * (6 - len(fields)))
+
+class DaylightSavingTest(unittest.TestCase):
+
+    def test_begins_at_2am_standard_time(self):
+        # 2015-03-08 2 AM PST is 10:00 UTC
+        self.assertFalse(daily._daylight_saving(utc(2015, 3, 8, 9, 59), -8))
+        self.assertTrue(daily._daylight_saving(utc(2015, 3, 8, 10), -8))
+
+    def test_ends_at_2am_daylight_time(self):
+        # 2015-11-01 2 AM PDT is 09:00 UTC
+        self.assertTrue(daily._daylight_saving(utc(2015, 11, 1, 8, 59), -8))
+        self.assertFalse(daily._daylight_saving(utc(2015, 11, 1, 9), -8))
+
+    def test_local_day(self):
+        # 00:30 PDT on July 1st, 23:30 PST on June 30th
+        start = utc(2015, 7, 1, 7, 30)
+        self.assertEqual(daily._local_day(start, -8, True), utc(2015, 7, 1) // 86400)
+        self.assertEqual(daily._local_day(start, -8, False), utc(2015, 6, 30) // 86400)
+
+class SummaryTest(unittest.TestCase):
+    """ Daily summaries of a 3 by 2 cube with one MaxT grid """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.grid = cube.Grid(3, 2, 40.0, -120.0, -120.0, 40.0, 40.0, 2500.0, 6371200.0)
+        values = np.array([[71.0, 72.0, cube.MISSING], [74.0, 75.0, 76.0]], dtype='<f4')
+        with open(os.path.join(self.data_dir, 'maxt.f32'), 'wb') as f:
+            f.write(values.tobytes())
+        # Valid from 00:30 PDT on July 1st
+        start = utc(2015, 7, 1, 7, 30)
+        records = [cube.Record('MaxT', '[F]', start, start, start + 12 * 3600, 0, 0)]
+        cube.write_index(os.path.join(self.data_dir, cube.index_name), ['maxt.f32'], self.grid, records)
+
+    def tearDown(self):
+        daily._summaries.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_days_follow_daylight_saving_time(self):
+        self.assertEqual(daily.build(self.data_dir, -8), 1)
+        self.assertEqual(daily.open_summary(self.data_dir)['days'], ['2015-07-01'])
+
+    def test_days_in_standard_time(self):
+        daily.build(self.data_dir, -8, daylight=False)
+        self.assertEqual(daily.open_summary(self.data_dir)['days'], ['2015-06-30'])
+
+    def test_lookup_has_every_field(self):
+        daily.build(self.data_dir, -8)
+        days = daily.lookup(self.data_dir, 40.0, -120.0)
+        self.assertEqual(len(days), 1)
+        self.assertEqual(sorted(days[0]), sorted(list(daily._config) + ['date']))
+        self.assertEqual(days[0]['high'], '71')
+        self.assertIsNone(days[0]['low'])
+
+    def test_lookup_skips_days_without_values(self):
+        daily.build(self.data_dir, -8)
+        latitude, longitude = self.grid.projection.inverse(np.array([2.0]), np.array([0.0]))
+        self.assertEqual(daily.lookup(self.data_dir, float(latitude[0]), float(longitude[0])), [])
+
+    def test_lookup_before_build(self):
+        self.assertIsNone(daily.lookup(self.data_dir, 40.0, -120.0))
+
+class AggregateTest(unittest.TestCase):
+    """ Daily aggregates of a 3 by 2 cube with several records per field, in PDT """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.grid = cube.Grid(3, 2, 40.0, -120.0, -120.0, 40.0, 40.0, 2500.0, 6371200.0)
+        # 01:00, 07:00 and 19:00 PDT on July 1st
+        night, morning, evening = utc(2015, 7, 1, 8), utc(2015, 7, 1, 14), utc(2015, 7, 2, 2)
+        grids = [
+            ('QPF', night, night + 6 * 3600, 0.114),
+            ('QPF', morning, morning + 6 * 3600, 0.226),
+            ('RH', night, night + 3 * 3600, 40.0),
+            ('RH', morning, morning + 3 * 3600, 60.0),
+            ('WindGust', night, night + 3 * 3600, 10.0),
+            ('WindGust', morning, morning + 3 * 3600, 20.0),
+            ('PoP12', morning, morning + 12 * 3600, 30.0),
+            ('PoP12', evening, evening + 12 * 3600, 10.0)]
+        records = []
+        with open(os.path.join(self.data_dir, 'grids.f32'), 'wb') as f:
+            for n, (element, start, end, value) in enumerate(grids):
+                values = np.full(6, value, dtype='<f4')
+                if n == 1:
+                    values[1] = cube.MISSING
+                f.write(values.tobytes())
+                records.append(cube.Record(element, cube.units[element], night, start, end, 0, n * 24))
+        cube.write_index(os.path.join(self.data_dir, cube.index_name), ['grids.f32'], self.grid, records)
+        daily.build(self.data_dir, -8)
+
+    def tearDown(self):
+        daily._summaries.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def lookup(self, i, j):
+        latitude, longitude = self.grid.projection.inverse(np.array([float(i)]), np.array([float(j)]))
+        return daily.lookup(self.data_dir, float(latitude[0]), float(longitude[0]))[0]
+
+    def test_aggregates(self):
+        day = self.lookup(0, 0)
+        self.assertEqual(day['date'], '2015-07-01')
+        self.assertAlmostEqual(day['rain_amount'], 0.34)
+        self.assertAlmostEqual(day['humidity'], 50.0)
+        self.assertEqual(day['wind_gust'], forecast._format_wind(20.0))
+        self.assertEqual(day['precip_day'], '30')
+        self.assertEqual(day['precip_night'], '10')
+
+    def test_missing_values_are_skipped(self):
+        self.assertAlmostEqual(self.lookup(1, 0)['rain_amount'], 0.11)
+
+class GenerationTest(unittest.TestCase):
+    """ Daily summaries of a generation cubed with fake_degrib.py """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.realpath(common.make_data_dir(self.base_dir))
+
+    def tearDown(self):
+        daily._summaries.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def test_summaries_match_the_cell_series(self):
+        self.assertFalse(daily.ready(self.data_dir))
+        days = daily.build(self.data_dir, 0, daylight=False)
+        self.assertTrue(daily.ready(self.data_dir))
+        summary = daily.lookup(self.data_dir, 21.5, -119.5)
+        self.assertEqual(len(summary), days)
+        series = cube.open_cube(self.data_dir).point(21.5, -119.5, ['maxt'])['MaxT']
+        highs = {}
+        for start, end, value in series:
+            highs.setdefault(time.strftime('%Y-%m-%d', time.gmtime(start)), daily._format_integer(value))
+        self.assertEqual(dict((day['date'], day['high']) for day in summary if day['high']), highs)
+
+class FromForecastTest(unittest.TestCase):
+
+    def test_every_field(self):
+        days = daily.from_forecast([{'date': '2015-07-01', 'high': '71', 'rain_amount': 0.123, 'weather': 'Sunny'}])
+        self.assertEqual(sorted(days[0]), sorted(list(daily._config) + ['date']))
+        self.assertEqual(days[0]['high'], '71')
+        self.assertEqual(days[0]['rain_amount'], 0.12)
+        self.assertIsNone(days[0]['low'])
+
+    def test_days_without_fields_are_dropped(self):
+        self.assertEqual(daily.from_forecast([{'date': '2015-07-01', 'weather': 'Sunny'}]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lib'))
+
+from pysky.degrib_pool import DegribError, DegribPool
+
+class DegribPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = DegribPool(1, 5)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_output(self):
+        self.assertEqual(self.pool.run(['/bin/echo', 'probe']), b'probe\n')
+
+    def test_exit_status_raises_and_keeps_helper(self):
+        self.assertRaises(DegribError, self.pool.run, ['/bin/sh', '-c', 'echo partial; exit 3'])
+        self.assertEqual(self.pool._idle.qsize(), 1)
+        self.assertEqual(self.pool.run(['/bin/echo', 'next']), b'next\n')
+
+    def test_signal_raises(self):
+        self.assertRaises(DegribError, self.pool.run, ['/bin/sh', '-c', 'kill -9 $$'])
+
+    def test_missing_executable_raises(self):
+        self.assertRaises(DegribError, self.pool.run, ['/nonexistent/degrib'])
+
+    def test_timeout_replaces_helper(self):
+        self.assertRaises(DegribError, self.pool.run, ['/bin/sleep', '5'], 0.2)
+        self.assertEqual(self.pool.run(['/bin/echo', 'again']), b'again\n')
+
+if __name__ == '__main__':
+    unittest.main()
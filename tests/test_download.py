@@ -0,0 +1,119 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+from noaa_mirror import Mirror
+from pysky import grib2
+
+class DownloadTest(unittest.TestCase):
+    """ Generations downloaded from a local mirror and cubed with fake_degrib.py """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.mirror = Mirror(file_size=1024).start()
+        self.config = grib2.Config(common.fake_degrib)
+        self.first = self.download(os.path.join(self.base_dir, 'none'), 'first')
+
+    def tearDown(self):
+        self.mirror.stop()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def download(self, data_dir, name, progress=None):
+        new_data_dir = os.path.join(self.base_dir, name)
+        grib2.download(data_dir, new_data_dir, progress, self.mirror.url, 'ALL', False, self.config)
+        return new_data_dir
+
+    def test_first_download_fetches_every_file(self):
+        for path in self.mirror.paths:
+            with open(os.path.join(self.first, path), 'rb') as f, open(os.path.join(self.mirror.root, path), 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+        self.assertTrue(grib2.cube_indexes(self.first))
+
+    def test_manifest_is_the_listing(self):
+        for period in common.periods:
+            period_dir = os.path.join(self.first, period)
+            self.assertEqual(grib2._load_manifest(period_dir), grib2._parse_listing(os.path.join(period_dir, 'ls-l')))
+            self.assertTrue(os.path.exists(os.path.join(period_dir, grib2._manifest_name)))
+
+    def test_only_changed_files_are_downloaded(self):
+        changed = self.mirror.update(2)
+        progress = grib2.Progress()
+        second = self.download(self.first, 'second', progress)
+        self.assertEqual(progress['files_changed'], 2)
+        for path in self.mirror.paths:
+            same = os.stat(os.path.join(self.first, path)).st_ino == os.stat(os.path.join(second, path)).st_ino
+            self.assertEqual(same, path not in changed, path)
+            with open(os.path.join(second, path), 'rb') as f, open(os.path.join(self.mirror.root, path), 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_listing_without_manifest(self):
+        # Generations downloaded before manifests were kept
+        for period in common.periods:
+            os.unlink(os.path.join(self.first, period, grib2._manifest_name))
+        self.mirror.update(1)
+        progress = grib2.Progress()
+        self.download(self.first, 'second', progress)
+        self.assertEqual(progress['files_changed'], 1)
+
+    def test_unchanged_listing_downloads_nothing(self):
+        progress = grib2.Progress()
+        self.assertFalse(grib2.download(self.first, os.path.join(self.base_dir, 'second'), progress,
+            self.mirror.url, 'ALL', False, self.config))
+        self.assertEqual(progress['files_changed'], 0)
+        self.assertEqual(progress['files_checked'], len(common.periods))
+
+    def test_params_not_wanted_are_dropped(self):
+        self.mirror.update(len(self.mirror.paths))
+        second = os.path.join(self.base_dir, 'second')
+        grib2.download(self.first, second, None, self.mirror.url, ['temp'], False, self.config)
+        self.assertEqual(sorted(name for name in os.listdir(os.path.join(second, 'VP.001-003')) if name.endswith('.bin')),
+            ['ds.temp.bin'])
+
+class LinkOrCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.base_dir, 'src')
+        self.dst = os.path.join(self.base_dir, 'dst')
+        with open(self.src, 'w') as f:
+            f.write('grib')
+        self.saved = (os.link, grib2._reflink)
+
+    def tearDown(self):
+        os.link, grib2._reflink = self.saved
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def cross_device(self, src, dst):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    def test_linked(self):
+        self.assertEqual(grib2._link_or_copy(self.src, self.dst), 'linked')
+        self.assertEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+
+    def test_reflinked_across_devices(self):
+        os.link = self.cross_device
+        grib2._reflink = shutil.copyfile
+        self.assertEqual(grib2._link_or_copy(self.src, self.dst), 'reflinked')
+
+    def test_copied_without_reflinks(self):
+        def unsupported(src, dst):
+            open(dst, 'w').close()
+            raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+
+        os.link = self.cross_device
+        grib2._reflink = unsupported
+        self.assertEqual(grib2._link_or_copy(self.src, self.dst), 'copied')
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), 'grib')
+        self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+from pysky import dwml, forecast
+
+# The per-date loops process_xml ran before its reductions were vectorized,
+# with daily wind gusts compared as numbers instead of strings
+
+def _average(values):
+    values = [float(x) for x in values if len(x)]
+    return sum(values) / len(values) if values else None
+
+def _max(values):
+    values = [float(x) for x in values if len(x)]
+    return max(values) if values else None
+
+_loop_daily_config = {
+    'high': ('maxt', lambda values: values[0] if values else None, None, None),
+    'low': ('mint', lambda values: values[0] if values else None, None, None),
+    'precip_day': ('pop12', lambda values: values[0] if values else None,
+        lambda times, n: times['startDate'][n] == times['endDate'][n], None),
+    'precip_night': ('pop12', lambda values: values[0] if values else None,
+        lambda times, n: times['startDate'][n] != times['endDate'][n], None),
+    'rain_amount': ('qpf', lambda values: sum(round(float(x), 2) for x in values if len(x)), None, None),
+    'snow_amount': ('snow', lambda values: sum(round(float(x), 1) for x in values if len(x)), None, None),
+    'humidity': ('rhm', _average, None, None),
+    'wind_gust': ('wgust', _max, None, forecast._format_wind),
+    'wind_sustained': ('wspd', _average, None, forecast._format_wind),
+    'weather': ('wx', forecast._first_nonempty,
+        lambda times, n: '06:00:00' <= times['startTime'][n] <= '18:00:00', forecast._format_weather),
+    'symbol': ('sym', forecast._frequent_sym, None, forecast._format_wsym)
+}
+
+def loop_daily(xml_data):
+    by_date = {}
+    for code in xml_data:
+        for n, date in enumerate(xml_data[code]['times']['startDate']):
+            by_date.setdefault(date, {}).setdefault(code, []).append(n)
+    daily = []
+    for date in sorted(by_date):
+        date_data = {'date': date}
+        for key, (code, aggregator, keep, formatter) in _loop_daily_config.items():
+            if code not in by_date[date]:
+                continue
+            parameter = xml_data[code]
+            values = [parameter['values'][n] for n in by_date[date][code]
+                if not keep or keep(parameter['times'], n)]
+            if key == 'symbol':
+                values = [value for value in values if '/' in value]
+            value = aggregator(values)
+            date_data[key] = formatter(value) if formatter else value
+        daily.append(date_data)
+    return daily
+
+def loop_hourly(xml_data):
+    by_time = {}
+    for code in forecast._hourly_params.values():
+        if code not in xml_data:
+            continue
+        times = xml_data[code]['times']
+        for date, time, value in zip(times['startDate'], times['startTime'], xml_data[code]['values']):
+            by_time.setdefault((date, time), {})[code] = value
+    hourly = []
+    for date, time in sorted(by_time):
+        time_data = {'date': date, 'time': time}
+        for key, entry in forecast._hourly_config.items():
+            if entry['code'] in by_time[(date, time)]:
+                value = by_time[(date, time)][entry['code']]
+                time_data[key] = entry['formatter'](value) if 'formatter' in entry else value
+        hourly.append(time_data)
+    return hourly
+
+def rounded(value):
+    """ A forecast with floats rounded, as sums and averages are reduced in another order """
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return dict((k, rounded(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [rounded(v) for v in value]
+    return value
+
+class AggregationTest(unittest.TestCase):
+    """ Vectorized daily and hourly aggregation of the DWML fixtures, against the loops """
+
+    def setUp(self):
+        self.xmls = [common.fixture(name) for name in ('time-series-1day.xml', 'time-series-3day.xml', 'time-series-7day.xml')]
+        codes = set(entry['code'] for entry in forecast._daily_config.values())
+        codes.update(entry['code'] for entry in forecast._hourly_config.values())
+        self.xml_datas = [dwml.parse_xml(xml, codes) for xml in self.xmls]
+
+    def test_daily_matches_loops(self):
+        for xml_data in self.xml_datas:
+            daily = forecast._daily(xml_data)
+            self.assertTrue(daily)
+            self.assertEqual(rounded(daily), rounded(loop_daily(xml_data)))
+
+    def test_hourly_matches_loops(self):
+        for xml_data in self.xml_datas:
+            hourly = forecast._hourly(xml_data)
+            self.assertTrue(hourly)
+            self.assertEqual(hourly, loop_hourly(xml_data))
+
+    def test_batch_matches_single_points(self):
+        batch = forecast.process_xml_batch(self.xmls, True)
+        self.assertEqual(batch, [forecast.process_xml(xml, True) for xml in self.xmls])
+
+    def test_hourly_only_when_requested(self):
+        self.assertEqual(forecast.process_xml(self.xmls[0])['hourly'], [])
+
+if __name__ == '__main__':
+    unittest.main()
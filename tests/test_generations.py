@@ -0,0 +1,130 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lib'))
+
+from pysky import generations
+from pysky.generations import Generations
+
+class GenerationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.active_path = os.path.join(self.base_dir, 'active')
+        self.first = self.make_generation('first')
+        os.symlink(self.first, self.active_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def make_generation(self, name):
+        path = os.path.join(self.base_dir, name)
+        os.mkdir(path)
+        with open(os.path.join(path, 'all.ind'), 'w') as f:
+            f.write(name)
+        return path
+
+    def pins(self, data_dir):
+        return os.path.join(data_dir, generations._pin_name)
+
+    def test_release_removes_retired_generation(self):
+        gens = Generations(self.active_path)
+        data_dir = gens.acquire()
+        second = self.make_generation('second')
+        gens.swap(second)
+        self.assertEqual(gens.current(), second)
+        self.assertTrue(os.path.isdir(data_dir))
+        gens.release(data_dir)
+        self.assertFalse(os.path.exists(data_dir))
+
+    def test_swap_does_not_wait_for_readers(self):
+        gens = Generations(self.active_path)
+        pinned = threading.Semaphore(0)
+        swapped = threading.Event()
+        seen = []
+
+        def read():
+            with gens.pin() as data_dir:
+                pinned.release()
+                swapped.wait(5)
+                with open(os.path.join(data_dir, 'all.ind')) as f:
+                    seen.append(f.read())
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            pinned.acquire()
+        gens.swap(self.make_generation('second'))
+        swapped.set()
+        for reader in readers:
+            reader.join(5)
+        self.assertEqual(seen, ['first'] * 4)
+        self.assertFalse(os.path.exists(self.first))
+        with gens.pin() as data_dir:
+            self.assertEqual(os.path.basename(data_dir), 'second')
+
+    def test_swap_creates_pin_file_before_serving(self):
+        gens = Generations(self.active_path, shared=True)
+        second = self.make_generation('second')
+        swapped = []
+        gens.subscribe(lambda data_dir: swapped.append(os.path.exists(self.pins(data_dir))))
+        gens.swap(second)
+        self.assertEqual(swapped, [True])
+
+    def test_pinning_does_not_create_pin_file(self):
+        gens = Generations(self.active_path, shared=True)
+        with gens.pin() as data_dir:
+            self.assertEqual(data_dir, self.first)
+        self.assertFalse(os.path.exists(self.pins(self.first)))
+
+    def test_retired_generation_cannot_be_pinned_again(self):
+        # A reader resolved the old generation just before the swap and
+        # locks it only after its pin file has been unlinked
+        gens = Generations(self.active_path, shared=True)
+        gens.prepare(self.first)
+        second = self.make_generation('second')
+        gens.prepare(second)
+        os.unlink(self.active_path)
+        os.symlink(second, self.active_path)
+        self.assertTrue(generations._unpin(self.first))
+        self.assertFalse(gens._lock_pin(self.first))
+        self.assertFalse(os.path.exists(self.pins(self.first)))
+        data_dir = gens.acquire()
+        self.assertEqual(data_dir, second)
+        gens.release(data_dir)
+
+    def test_generation_pinned_by_other_process_is_kept(self):
+        gens = Generations(self.active_path, shared=True)
+        gens.prepare(self.first)
+        pinned_r, pinned_w = os.pipe()
+        release_r, release_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                other = Generations(self.active_path, shared=True)
+                data_dir = other.acquire()
+                os.write(pinned_w, data_dir + '\n')
+                os.read(release_r, 1)
+                other.release(data_dir)
+            finally:
+                os._exit(0)
+        try:
+            self.assertEqual(os.read(pinned_r, 4096).strip(), self.first)
+            second = self.make_generation('second')
+            gens.swap(second)
+            gens.sweep()
+            self.assertTrue(os.path.isdir(self.first))
+        finally:
+            os.write(release_w, 'x')
+            os.waitpid(pid, 0)
+        gens.sweep()
+        self.assertFalse(os.path.exists(self.first))
+        self.assertTrue(os.path.exists(self.pins(second)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+import fake_degrib
+from pysky import cube, grib2
+from pysky.cache import ResponseCache
+from pysky.degrib_pool import DegribError
+
+class RunTest(unittest.TestCase):
+    """ degrib runs without a pool, with shell commands standing in for degrib """
+
+    def setUp(self):
+        self.config = grib2.Config(cache=ResponseCache(1024 * 1024))
+
+    def test_output(self):
+        self.assertEqual(b''.join(grib2._run(self.config, ['/bin/echo', 'probe'])), b'probe\n')
+
+    def test_exit_status_raises(self):
+        self.assertRaises(DegribError, b''.join, grib2._run(self.config, ['/bin/sh', '-c', 'echo partial; exit 2']))
+
+    def test_no_output_raises(self):
+        self.assertRaises(DegribError, b''.join, grib2._run(self.config, ['/bin/true']))
+
+    def test_failed_output_is_not_cached(self):
+        key = ('gen', 1, 2)
+        self.assertRaises(DegribError, b''.join, grib2._stream(self.config, ['/bin/sh', '-c', 'echo partial; exit 2'], key))
+        self.assertIsNone(self.config.cache.get(key))
+
+class CacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.config = grib2.Config(cache=ResponseCache(1024 * 1024))
+        self.saved = cube.open_cube
+        self.opened = []
+
+        def open_cube(data_dir):
+            self.opened.append(data_dir)
+            return self.saved(data_dir)
+
+        cube.open_cube = open_cube
+
+    def tearDown(self):
+        cube.open_cube = self.saved
+        grib2._grids_by_dir.clear()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_no_cache_no_key(self):
+        self.assertIsNone(grib2.cache_key(grib2.Config(), self.data_dir, 45.0, -122.0, 'glance', None, None, None, None))
+
+    def test_generation_without_grids_is_keyed_by_point(self):
+        for _ in range(3):
+            key = grib2.cache_key(self.config, self.data_dir, 45.0, -122.0, 'glance', None, None, None, None)
+            self.assertEqual(key, (os.path.basename(self.data_dir), 'point', 45.0, -122.0, 'glance', None, None, None, None))
+        self.assertEqual(self.opened, [self.data_dir])
+
+    def test_unreadable_grids_are_keyed_by_point(self):
+        with open(os.path.join(self.data_dir, cube.index_name), 'wb') as f:
+            f.write(b'PSKY')
+        key = grib2.cache_key(self.config, self.data_dir, 45.0, -122.0, 'glance', None, None, None, None)
+        self.assertEqual(key[1], 'point')
+
+class CubeTest(unittest.TestCase):
+    """ degrib cubes and in-process grids built with fake_degrib.py """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.old_dir = os.path.join(self.base_dir, 'old')
+        self.new_dir = os.path.join(self.base_dir, 'new')
+        self.config = grib2.Config(common.fake_degrib)
+        common.make_bins(self.old_dir, names=['VP.001-003/ds.temp.bin', 'VP.004-007/ds.temp.bin', 'VP.001-003/ds.maxt.bin'])
+        grib2._cube(self.config, self.old_dir, self.old_dir, set(['temp', 'maxt']))
+
+    def tearDown(self):
+        grib2._indexes_by_dir.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def cube_file(self, data_dir, name):
+        return os.path.join(data_dir, grib2.cubes_name, name)
+
+    def test_cubes_per_param(self):
+        self.assertEqual(grib2.cube_indexes(self.old_dir),
+            [self.cube_file(self.old_dir, 'maxt.ind'), self.cube_file(self.old_dir, 'temp.ind')])
+        count = sum(len(fake_degrib.messages(os.path.join(self.old_dir, name)))
+            for name in ('VP.001-003/ds.temp.bin', 'VP.004-007/ds.temp.bin'))
+        with open(self.cube_file(self.old_dir, 'temp.dat')) as f:
+            self.assertIn('cube of {0} grids'.format(count), f.read())
+
+    def test_only_changed_params_are_cubed(self):
+        for name in ('VP.001-003', 'VP.004-007'):
+            shutil.copytree(os.path.join(self.old_dir, name), os.path.join(self.new_dir, name))
+        grib2._cube(self.config, self.old_dir, self.new_dir, set(['temp']))
+        for name in ('maxt.ind', 'maxt.dat'):
+            self.assertEqual(os.stat(self.cube_file(self.old_dir, name)).st_ino, os.stat(self.cube_file(self.new_dir, name)).st_ino)
+        for name in ('temp.ind', 'temp.dat'):
+            self.assertNotEqual(os.stat(self.cube_file(self.old_dir, name)).st_ino, os.stat(self.cube_file(self.new_dir, name)).st_ino)
+        self.assertEqual(len(cube.open_cube(self.new_dir).records), len(cube.open_cube(self.old_dir).records))
+
+    def test_probe_reads_every_cube(self):
+        args = grib2._point_args(self.config, self.old_dir, 21.5, -119.5)
+        self.assertEqual(args[1:3], grib2.cube_indexes(self.old_dir))
+        self.assertTrue(b''.join(grib2._run(self.config, args + ['-XML', '1'])).startswith(b'<?xml'))
+
+    def test_grids_that_are_not_lambert_are_only_cubed(self):
+        data_dir = os.path.join(self.base_dir, 'mercator')
+        common.make_bins(data_dir, names=['VP.001-003/ds.temp.bin'])
+        os.environ['BENCH_PROJECTION'] = 'mercator'
+        try:
+            grib2._cube(self.config, data_dir, data_dir, set(['temp']))
+        finally:
+            del os.environ['BENCH_PROJECTION']
+        self.assertEqual(grib2.cube_indexes(data_dir), [self.cube_file(data_dir, 'temp.ind')])
+        self.assertFalse(os.path.exists(os.path.join(data_dir, cube.index_name)))
+
+    def test_generation_with_single_cube(self):
+        data_dir = os.path.join(self.base_dir, 'single')
+        os.makedirs(data_dir)
+        open(os.path.join(data_dir, 'all.ind'), 'w').close()
+        self.assertEqual(grib2.cube_indexes(data_dir), [os.path.join(data_dir, 'all.ind')])
+
+    def test_generation_not_cubed(self):
+        self.assertEqual(grib2.cube_indexes(self.base_dir), [])
+
+class ProgressTest(unittest.TestCase):
+
+    def test_recent_files_are_kept(self):
+        progress = grib2.Progress()
+        for i in range(grib2.Progress.recent_files + 5):
+            grib2._report(progress, {'path': str(i), 'status': 200, 'bytes': 10, 'seconds': 0.5, 'last_modified': None})
+        self.assertEqual(progress['files_checked'], grib2.Progress.recent_files + 5)
+        self.assertEqual(progress['bytes'], 10 * (grib2.Progress.recent_files + 5))
+        self.assertEqual(len(progress['files']), grib2.Progress.recent_files)
+        self.assertEqual(progress['files'][0], {'path': '5', 'status': 200, 'bytes': 10, 'seconds': 0.5})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import socket
+import sys
+import threading
+import unittest
+
+lib_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lib')
+sys.path.insert(0, lib_dir)
+
+from pysky.prefork import Channel, ChannelClosed, Master
+
+# Worker answering every call from the master with its pid and the argument
+worker_script = '''
+import os, sys, time
+sys.path.insert(0, {0!r})
+from pysky import prefork
+prefork.connect(sys.argv[1], lambda op, arg: [os.getpid(), op, arg])
+while True:
+    time.sleep(1)
+'''.format(lib_dir)
+
+class ChannelTest(unittest.TestCase):
+    """ Both ends of a channel in one process """
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.closed = threading.Event()
+        left, right = socket.socketpair()
+        self.master = Channel(left, self.handle).start()
+        self.worker = Channel(right, self.handle, self.closed.set).start()
+
+    def tearDown(self):
+        self.release.set()
+        self.master.close()
+        self.worker.close()
+
+    def handle(self, op, arg):
+        if op == 'fail':
+            raise ValueError('bad argument')
+        if op == 'wait':
+            self.release.wait(5)
+        return {'op': op, 'arg': arg}
+
+    def test_calls_in_both_directions(self):
+        self.assertEqual(self.master.call('swap', {'dir': '/data/a'}, 5), {'op': 'swap', 'arg': {'dir': '/data/a'}})
+        self.assertEqual(self.worker.call('refresh', None, 5), {'op': 'refresh', 'arg': None})
+
+    def test_handler_error_is_raised_to_caller(self):
+        try:
+            self.master.call('fail', 1, 5)
+            self.fail('No error')
+        except RuntimeError as e:
+            self.assertEqual(str(e), 'ValueError: bad argument')
+
+    def test_timeout(self):
+        self.assertRaises(RuntimeError, self.master.call, 'wait', None, 0.05)
+        self.assertEqual(self.master._pending, {})
+
+    def test_concurrent_calls_get_their_own_replies(self):
+        replies = {}
+
+        def call(n):
+            replies[n] = self.master.call('echo', n, 5)
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(replies, dict((n, {'op': 'echo', 'arg': n}) for n in range(10)))
+
+    def test_pending_call_ends_when_other_end_closes(self):
+        errors = []
+
+        def call():
+            try:
+                self.worker.call('wait', None, 5)
+            except ChannelClosed as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=call)
+        thread.start()
+        while not self.worker._pending:
+            pass
+        self.master.close()
+        thread.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(self.closed.wait(5))
+        self.assertRaises(ChannelClosed, self.worker.call, 'swap', None, 5)
+
+class MasterTest(unittest.TestCase):
+    """ A master with two worker processes """
+
+    def setUp(self):
+        self.master = Master(2, [sys.executable, '-c', worker_script], lambda op, arg: None)
+        self.master.listen('127.0.0.1', 0).start()
+
+    def tearDown(self):
+        self.master.stop()
+        self.master.listener.close()
+
+    def test_broadcast_reaches_every_worker(self):
+        replies = self.master.broadcast('swap', {'dir': '/data/a'}, 10)
+        self.assertEqual(sorted(pid for pid, _, _ in replies), sorted(self.master._workers))
+        self.assertEqual([reply[1:] for reply in replies], [['swap', {'dir': '/data/a'}]] * 2)
+
+    def test_stop_terminates_workers(self):
+        pids = list(self.master._workers)
+        self.master.stop()
+        for pid in pids:
+            self.assertRaises(OSError, os.kill, pid, 0)
+
+if __name__ == '__main__':
+    unittest.main()
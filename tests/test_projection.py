@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lib'))
+
+from pysky import cube, projection
+
+# The NDFD conus grid
+CONUS = cube.Grid(2145, 1377, 20.191999, -121.554001, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+
+class LambertConformalTest(unittest.TestCase):
+
+    def test_south_west_cell(self):
+        self.assertEqual(CONUS.cell(20.191999, -121.554001), (0, 0))
+
+    def test_round_trip(self):
+        x, y = np.meshgrid(np.linspace(0, CONUS.nx - 1, 7), np.linspace(0, CONUS.ny - 1, 5))
+        latitudes, longitudes = CONUS.projection.inverse(x, y)
+        x2, y2 = CONUS.projection.forward(latitudes, longitudes)
+        self.assertTrue(np.allclose(x, x2, atol=1e-6) and np.allclose(y, y2, atol=1e-6))
+
+    def test_forward_matches_point(self):
+        latitudes, longitudes = np.array([45.0, 30.0, 38.5]), np.array([-122.0, -90.0, -100.25])
+        x, y = CONUS.projection.forward(latitudes, longitudes)
+        for n in range(3):
+            self.assertEqual((x[n], y[n]), CONUS.projection.point(latitudes[n], longitudes[n]))
+
+    def test_snap(self):
+        self.assertEqual(projection.snap(1.49, 2.5), (1, 3))
+        i, j = projection.snap(np.array([-0.6, 0.4]), np.array([0.5, 1.6]))
+        self.assertEqual((list(i), list(j)), ([-1, 0], [1, 2]))
+
+class PolarStereographicTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        alaska = projection.PolarStereographic(40.530101, -178.571, -150.0, 60.0, 2976.563, 6371200.0)
+        x, y = np.meshgrid(np.linspace(0, 1648, 5), np.linspace(0, 1104, 5))
+        latitudes, longitudes = alaska.inverse(x, y)
+        self.assertAlmostEqual(latitudes[0, 0], 40.530101)
+        self.assertAlmostEqual(longitudes[0, 0], -178.571)
+        x2, y2 = alaska.forward(latitudes, longitudes)
+        self.assertTrue(np.allclose(x, x2, atol=1e-6) and np.allclose(y, y2, atol=1e-6))
+
+class CoordinatesTest(unittest.TestCase):
+    """ Inverse tables of a small grid, persisted in temporary directories """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.saved = projection.table_dirs
+        self.grid = cube.Grid(30, 20, 20.191999, -121.554001, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+        projection._tables.clear()
+
+    def tearDown(self):
+        projection.table_dirs = self.saved
+        projection._tables.clear()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def table_files(self, table_dir):
+        return [name for name in os.listdir(table_dir) if name.endswith('.npy')] if os.path.isdir(table_dir) else []
+
+    def test_table_is_the_inverse_of_every_cell(self):
+        projection.table_dirs = [self.base_dir]
+        latitudes, longitudes = self.grid.coordinates()
+        self.assertEqual(latitudes.shape, (self.grid.ny, self.grid.nx))
+        self.assertEqual(self.grid.cell(float(latitudes[7, 3]), float(longitudes[7, 3])), (3, 7))
+        i, j, inside = self.grid.cells(latitudes.ravel(), longitudes.ravel())
+        self.assertTrue(inside.all())
+        self.assertEqual(list(j * self.grid.nx + i), list(range(self.grid.nx * self.grid.ny)))
+
+    def test_table_is_persisted_and_shared(self):
+        projection.table_dirs = [self.base_dir]
+        first = self.grid.coordinates()
+        self.assertTrue(np.shares_memory(self.grid.coordinates()[0], first[0]))
+        self.assertEqual(len(self.table_files(self.base_dir)), 1)
+        projection._tables.clear()
+        loaded = self.grid.coordinates()
+        self.assertIsInstance(loaded[0].base, np.memmap)
+        self.assertTrue(np.array_equal(loaded[0], first[0]))
+
+    def test_first_writable_directory_is_used(self):
+        unwritable = os.path.join(self.base_dir, 'file')
+        open(unwritable, 'w').close()
+        other = os.path.join(self.base_dir, 'grids')
+        projection.table_dirs = [os.path.join(unwritable, 'grids'), other]
+        self.grid.coordinates()
+        self.assertEqual(len(self.table_files(other)), 1)
+
+    def test_other_grids_have_their_own_tables(self):
+        projection.table_dirs = [self.base_dir]
+        other = cube.Grid(30, 21, 20.191999, -121.554001, -95.0, 25.0, 25.0, 2539.703, 6371200.0)
+        self.grid.coordinates()
+        self.assertEqual(other.coordinates()[0].shape, (21, 30))
+        self.assertEqual(len(self.table_files(self.base_dir)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
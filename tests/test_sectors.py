@@ -0,0 +1,102 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, 'src', 'lib'))
+sys.path.insert(0, os.path.join(repo_dir, 'bench'))
+
+import common
+from pysky import cube, grib2
+from pysky.sectors import Sector, Sectors
+
+class RoutingTest(unittest.TestCase):
+    """
+    Sectors cubed with fake_degrib.py: conus, a Lambert conformal grid of
+    200 by 100 cells, and pacific, a Mercator grid of 20 by 10 cells in its
+    south-west corner
+    """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.config = grib2.Config(common.fake_degrib)
+        self.conus = self.make_sector('conus', {})
+        self.pacific = self.make_sector('pacific', {'BENCH_PROJECTION': 'mercator', 'BENCH_GRID': '20,10'})
+        self.sectors = Sectors([self.conus, self.pacific])
+
+    def tearDown(self):
+        grib2._indexes_by_dir.clear()
+        cube._cubes.clear()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def make_sector(self, name, environ):
+        data_dir = os.path.join(self.base_dir, name)
+        generation_dir = os.path.join(data_dir, 'first')
+        common.make_bins(generation_dir, names=['VP.001-003/ds.temp.bin'])
+        saved = dict(os.environ)
+        os.environ.update(environ)
+        try:
+            grib2._cube(self.config, generation_dir, generation_dir, set(['temp']))
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        os.symlink(generation_dir, os.path.join(data_dir, 'active'))
+        return Sector(name, data_dir, config=self.config)
+
+    def test_bounds_from_grid_metadata(self):
+        south, west, north, east = self.pacific.bounds()
+        self.assertAlmostEqual(south, 20.192)
+        self.assertAlmostEqual(west, -121.554)
+        self.assertAlmostEqual(north, 20.192 + 9 * 0.025)
+        self.assertAlmostEqual(east, -121.554 + 19 * 0.025)
+        south, west, north, east = self.conus.bounds()
+        self.assertTrue(south < 20.192 < north and west < -121.554 < east)
+
+    def test_only_lambert_grids_are_read_in_process(self):
+        self.assertTrue(self.conus.gridded)
+        self.assertFalse(self.pacific.gridded)
+
+    def test_smallest_sector_covering_a_point(self):
+        self.assertIs(self.sectors.route(20.3, -121.5), self.pacific)
+        self.assertIs(self.sectors.route(21.5, -119.5), self.conus)
+        self.assertIsNone(self.sectors.route(45.0, -100.0))
+
+    def test_bounds_saved_with_generation(self):
+        # A generation cubed before bounds were saved is read with degrib once
+        generation_dir = os.path.join(self.base_dir, 'conus', 'first')
+        bounds = self.conus.bounds()
+        os.unlink(os.path.join(generation_dir, grib2.grid_info_name))
+        self.conus._load(generation_dir)
+        self.assertEqual(self.conus.bounds(), bounds)
+        self.assertTrue(os.path.exists(os.path.join(generation_dir, grib2.grid_info_name)))
+
+class BoundsTest(unittest.TestCase):
+    """ cube.metadata_bounds() of the NDFD grids outside conus """
+
+    def test_polar_stereographic_across_the_antimeridian(self):
+        south, west, north, east = cube.metadata_bounds({
+            'Projection Type': '20 (Polar Stereographic)', 'Nx': '1649', 'Ny': '1105',
+            'Lat1': '40.530101', 'Lon1': '181.429000', 'Orientation Lon': '210.000000',
+            'Lat_D': '60.000000', 'Dx': '2976.563000 (m)', 'Radius': '6371.200000 (km)'})
+        self.assertTrue(40.0 < south < 41.0 and 70.0 < north < 90.0)
+        self.assertTrue(west > 0 > east)
+
+    def test_polar_stereographic_around_the_pole(self):
+        bounds = cube.metadata_bounds({
+            'Projection Type': '20 (Polar Stereographic)', 'Nx': '100', 'Ny': '100',
+            'Lat1': '60.000000', 'Lon1': '210.000000', 'Orientation Lon': '255.000000',
+            'Lat_D': '60.000000', 'Dx': '100000.000000 (m)', 'Radius': '6371.200000 (km)'})
+        self.assertEqual(bounds[1:], (-180.0, 90.0, 180.0))
+
+    def test_mercator(self):
+        self.assertEqual(cube.metadata_bounds({
+            'Projection Type': '10 (Mercator)', 'Lat1': '18.072699', 'Lon1': '198.475000',
+            'Lat2': '23.087799', 'Lon2': '206.131000'}), (18.072699, -161.525, 23.087799, -153.869))
+
+    def test_unknown_projection(self):
+        self.assertRaises(ValueError, cube.metadata_bounds, {'Projection Type': '90 (Space View)'})
+
+if __name__ == '__main__':
+    unittest.main()
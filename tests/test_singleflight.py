@@ -0,0 +1,148 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'lib'))
+
+from pysky import grib2
+from pysky.cache import ResponseCache
+from pysky.singleflight import Abandoned, SingleFlight, Timeout
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    def test_follower_gets_leader_result(self):
+        call, leader = self.flights.begin('key')
+        self.assertTrue(leader)
+        follower, leader = self.flights.begin('key')
+        self.assertFalse(leader)
+        self.flights.finish('key', call, 'value')
+        self.assertEqual(self.flights.wait(follower, 1), 'value')
+
+    def test_follower_timeout(self):
+        self.flights.begin('key')
+        follower, _ = self.flights.begin('key')
+        self.assertRaises(Timeout, self.flights.wait, follower, 0.01)
+
+    def test_do_computes_after_timeout(self):
+        self.flights.begin('key') # a leader that never finishes
+        self.assertEqual(self.flights.do('key', lambda: 'own', 0.01), 'own')
+
+    def test_do_computes_after_abandon(self):
+        call, _ = self.flights.begin('key')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.flights.do('key', lambda: 'own', 5)))
+        thread.start()
+        while not call.followers:
+            pass
+        self.flights.finish('key', call, error=Abandoned('gone'))
+        thread.join()
+        self.assertEqual(results, ['own'])
+
+class StreamTest(unittest.TestCase):
+    """ grib2._stream with degrib replaced by a function yielding chunks """
+
+    def setUp(self):
+        self.saved = grib2._run
+        self.runs = []
+        self.release = threading.Event()
+        self.release.set()
+        grib2._run = self.run_degrib
+        self.config = grib2.Config(cache=ResponseCache(1024 * 1024), flights=SingleFlight(), flight_timeout=5)
+
+    def tearDown(self):
+        grib2._run = self.saved
+
+    def run_degrib(self, config, args):
+        self.runs.append(args)
+        yield b'first '
+        self.release.wait()
+        yield b'second'
+
+    def test_response_is_cached(self):
+        key = ('gen', 1, 2)
+        self.assertEqual(b''.join(grib2._stream(self.config, ['degrib'], key)), b'first second')
+        self.assertEqual(b''.join(grib2._stream(self.config, ['degrib'], key)), b'first second')
+        self.assertEqual(len(self.runs), 1)
+
+    def test_passed_through_without_cache(self):
+        self.config.cache = None
+        key = ('gen', 1, 2)
+        self.release.clear()
+        stream = grib2._stream(self.config, ['degrib'], key)
+        self.assertEqual(next(stream), b'first ')
+        self.assertEqual(self.config.flights.stats()['in_flight'], 0)
+        self.release.set()
+        self.assertEqual(b''.join(stream), b'second')
+
+    def test_large_response_is_passed_through(self):
+        self.config.max_shared = 8
+        key = ('gen', 1, 2)
+        self.release.clear()
+        leader = grib2._stream(self.config, ['degrib'], key)
+        self.assertEqual(next(leader), b'first ')
+        self.release.set()
+        self.assertEqual(b''.join(leader), b'second')
+        self.assertIsNone(self.config.cache.get(key))
+        # an identical query is not left waiting on the leader
+        self.assertEqual(b''.join(grib2._stream(self.config, ['degrib'], key)), b'first second')
+        self.assertEqual(len(self.runs), 2)
+
+    def test_leader_publishes_when_its_client_stops_reading(self):
+        key = ('gen', 1, 2)
+        self.release.clear()
+        leader = grib2._stream(self.config, ['degrib'], key)
+        self.assertEqual(next(leader), b'first ')
+        follower = []
+        thread = threading.Thread(target=lambda: follower.append(b''.join(grib2._stream(self.config, ['degrib'], key))))
+        thread.start()
+        leader.close() # the leader's client went away
+        self.release.set()
+        thread.join(5)
+        self.assertEqual(follower, [b'first second'])
+        self.assertEqual(self.config.cache.get(key), b'first second')
+        self.assertEqual(len(self.runs), 1)
+
+    def test_follower_runs_query_after_timeout(self):
+        key = ('gen', 1, 2)
+        self.config.flight_timeout = 0.01
+        call, _ = self.config.flights.begin(key) # a leader that never finishes
+        self.assertEqual(b''.join(grib2._stream(self.config, ['degrib'], key)), b'first second')
+        self.assertEqual(len(self.runs), 1)
+
+    def test_errors_reach_client_and_followers(self):
+        def failing(config, args):
+            self.runs.append(args)
+            self.release.wait()
+            raise RuntimeError('degrib failed')
+            yield
+        grib2._run = failing
+        key = ('gen', 1, 2)
+        self.release.clear()
+        errors = []
+
+        def query():
+            try:
+                b''.join(grib2._stream(self.config, ['degrib'], key))
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=query) for _ in range(2)]
+        threads[0].start()
+        while not self.runs:
+            pass
+        threads[1].start()
+        while not self.config.flights.stats()['followers']:
+            pass
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(errors, ['degrib failed'] * 2)
+        self.assertEqual(len(self.runs), 1)
+        self.assertIsNone(self.config.cache.get(key))
+
+if __name__ == '__main__':
+    unittest.main()